@@ -1,11 +1,12 @@
 import logging
+import click
 from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from sqlalchemy.exc import SQLAlchemyError
-from apscheduler.schedulers.background import BackgroundScheduler
+from werkzeug.middleware.proxy_fix import ProxyFix
 from app.extensions import init_redis
 from app.config import Config
 
@@ -29,6 +30,9 @@ def create_app(config_class=None):
         app,
         origins=["http://localhost:5173"],
         allow_headers=["Content-Type", "Authorization"],
+        # курсор keyset-пагинации (/bookings/history, /beaches);
+        # Retry-After — poll статуса замка (202 при холодном кэше)
+        expose_headers=["X-Next-Cursor", "Retry-After"],
         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
         supports_credentials=True,
     )
@@ -40,6 +44,11 @@ def create_app(config_class=None):
 
     app.config.from_object(Config)
 
+    # за nginx remote_addr — адрес прокси; реальный IP клиента — из X-Forwarded-For
+    hops = app.config.get("PROXY_FIX_HOPS", 0)
+    if hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
     # 3. Настраиваем логирование
     setup_logging(app)
 
@@ -60,83 +69,13 @@ def create_app(config_class=None):
     # 8. Проверяем подключение к базе данных
     check_database_connection(app)
 
-    from app.tasks.booking_cleanup import cancel_expired_pending_bookings
-    import os
-
-    import os
-    from apscheduler.schedulers.background import BackgroundScheduler
-
-    def start_scheduler(app):
-        # ❗ не запускать scheduler дважды при flask debug reload
-        if app.debug and os.environ.get("WERKZEUG_RUN_MAIN") != "true":
-            return
-
-        scheduler = BackgroundScheduler()
-
-        # ---------- pending → cancelled ----------
-        from app.tasks.booking_cleanup import cancel_expired_pending_bookings
-
-        def cleanup_job():
-            with app.app_context():
-                cancel_expired_pending_bookings()
-
-        scheduler.add_job(
-            cleanup_job,
-            trigger="interval",
-            minutes=1,
-            id="booking_cleanup"
-        )
-
-        # ---------- auto complete booking ----------
-        from app.tasks.booking_autocomplete import auto_complete_bookings
-
-        def autocomplete_job():
-            with app.app_context():
-                auto_complete_bookings()
-
-        scheduler.add_job(
-            autocomplete_job,
-            trigger="interval",
-            minutes=1,
-            id="booking_autocomplete"
-        )
-
-        # ---------- overdue booking ----------
-        from app.tasks.booking_overdue import process_overdue_bookings
-
-        def overdue_job():
-            with app.app_context():
-                process_overdue_bookings()
-
-        scheduler.add_job(
-            overdue_job,
-            "interval",
-            minutes=1,
-            id="booking_overdue"
-        )
-
-        # ---------- autorefund ----------#
-        from app.services.overdue_autorefund_service import auto_refund_overdue_charges
-        from app.config import AUTO_REFUND_CHECK_INTERVAL_SECONDS
-        def autorefund_job():
-            with app.app_context():
-                auto_refund_overdue_charges()
-
-        scheduler.add_job(
-            autorefund_job,
-            "interval",
-            seconds=AUTO_REFUND_CHECK_INTERVAL_SECONDS,
-            id="auto_refund_overdue",
-            replace_existing=True
-        )
-
-        scheduler.start()
-
-        # ❗ сохраняем ссылку, чтобы GC не убил scheduler
-        app.scheduler = scheduler
-
     init_redis(app)
-    start_scheduler(app)
+
+    # 9. Фоновые задачи — в отдельном worker'е (worker.py).
+    # В web-процессе только для локальной разработки.
+    if app.config["SCHEDULER_IN_WEB"]:
+        from app.scheduler import start_scheduler_in_web
+        start_scheduler_in_web(app)
 
     return app
 
@@ -233,7 +172,8 @@ def register_error_handlers(app):
 def register_blueprints(app):
     from app.routes import (
         auth_bp, beaches_bp, sunbeds_bp, bookings_bp,
-        prices_bp, payments_bp, admin_bp, owner_legal_bp, dashboard_bp, locations_bp, owner_payment_bp
+        prices_bp, payments_bp, admin_bp, owner_legal_bp, dashboard_bp, locations_bp, owner_payment_bp,
+        ttlock_bp,
     )
 
     app.register_blueprint(auth_bp, url_prefix="/api/auth")
@@ -247,11 +187,67 @@ def register_blueprints(app):
     app.register_blueprint(dashboard_bp, url_prefix="/api/dashboard")
     app.register_blueprint(locations_bp, url_prefix="/api/locations")
     app.register_blueprint(owner_payment_bp, url_prefix="/api/owner")
+    app.register_blueprint(ttlock_bp, url_prefix="/api/ttlock")
 
 
 def register_commands(app):
     """Регистрация CLI команд"""
 
+    @app.cli.command('rebuild-daily-revenue')
+    @click.option('--from', 'date_from', default=None, help='YYYY-MM-DD (MSK)')
+    @click.option('--to', 'date_to', default=None, help='YYYY-MM-DD (MSK)')
+    def rebuild_daily_revenue_cmd(date_from, date_to):
+        """Пересборка daily_revenue (без параметров — вся история)"""
+        from datetime import date
+        from app.services.revenue_rollup_service import rebuild_daily_revenue
+
+        rows = rebuild_daily_revenue(
+            date_from=date.fromisoformat(date_from) if date_from else None,
+            date_to=date.fromisoformat(date_to) if date_to else None,
+        )
+        print(f"✅ daily_revenue пересобран: {rows} строк")
+
+    @app.cli.command('ensure-archive-partitions')
+    @click.option('--from', 'date_from', default=None, help='YYYY-MM (первый месяц)')
+    @click.option('--to', 'date_to', default=None, help='YYYY-MM (последний месяц)')
+    def ensure_archive_partitions_cmd(date_from, date_to):
+        """Месячные партиции bookings_archive / overdue_charges_archive"""
+        from datetime import date
+        from app.services.archive_service import (
+            ensure_archive_partitions,
+            ensure_upcoming_partitions,
+        )
+
+        if date_from or date_to:
+            start = date.fromisoformat(f"{date_from or date_to}-01")
+            end = date.fromisoformat(f"{date_to or date_from}-01")
+            created = ensure_archive_partitions(start, end)
+        else:
+            created = ensure_upcoming_partitions()
+        print(f"✅ Партиций создано: {len(created)}")
+
+    @app.cli.command('archive-bookings')
+    @click.option('--months', default=None, type=int, help='старше N месяцев (по умолчанию ARCHIVE_AFTER_MONTHS)')
+    def archive_bookings_cmd(months):
+        """Перенос завершённых броней в bookings_archive"""
+        from app.config import ARCHIVE_AFTER_MONTHS
+        from app.services.archive_service import archive_terminal_bookings
+
+        moved = archive_terminal_bookings(
+            months=months or ARCHIVE_AFTER_MONTHS,
+            max_batches=10_000,
+        )
+        print(f"✅ В архив перенесено броней: {moved}")
+
+    @app.cli.command('requeue-payment-events')
+    @click.option('--id', 'event_ids', multiple=True, type=int, help='id события (можно несколько)')
+    def requeue_payment_events_cmd(event_ids):
+        """Повторная обработка failed-событий YooKassa (без --id — всех)"""
+        from app.services.payment_webhook_service import requeue_payment_events
+
+        count = requeue_payment_events(list(event_ids) or None)
+        print(f"✅ Событий возвращено в очередь: {count}")
+
     @app.cli.command('init-db')
     def init_db():
         """Инициализация базы данных"""
@@ -268,6 +264,24 @@ def register_commands(app):
         db.session.commit()
         print("✅ База данных инициализирована")
 
+    @app.cli.command('set-user-role')
+    @click.argument('phone_number')
+    @click.argument('role_name')
+    def set_user_role(phone_number, role_name):
+        """Смена роли пользователя (инвалидирует права в выданных JWT)"""
+        from app.models import User, Role
+        from app.authz import bump_perm_version
+
+        user = User.query.filter_by(phone_number=phone_number).first()
+        role = Role.query.filter_by(name=role_name).first()
+        if not user or not role:
+            print("❌ Пользователь или роль не найдены")
+            return
+
+        user.role_id = role.id
+        bump_perm_version(user)  # commit внутри
+        print(f"✅ {phone_number}: роль {role_name}")
+
     @app.cli.command('create-admin')
     def create_admin():
         """Создание администратора"""
@@ -1,9 +1,27 @@
 from functools import wraps
 from flask import jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 
-from app.models import User
-from app.permissions import has_perm
+from app import db
+from app.scope import get_tenant_scope, _remember_perm_version
+
+
+def bump_perm_version(user) -> None:
+    """
+    Вызывать при смене роли / отзыве прав.
+    Старые токены перестают проходить stateless-проверку и идут в БД.
+
+    commit делает сама функция (вместе с остальными изменениями сессии):
+    Redis пишется только после него — до commit'а параллельный запрос
+    прочитал бы из БД старую версию, а новая в Redis разрешила бы
+    токены, которых БД ещё не подтверждает.
+    """
+    user.perm_version = int(user.perm_version or 0) + 1
+    db.session.add(user)
+    db.session.commit()
+
+    # без Redis stateless-проверка не сработает → fallback в БД
+    _remember_perm_version(user.id, user.perm_version)
 
 
 def require_perm(perm: str):
@@ -11,15 +29,12 @@ def require_perm(perm: str):
         @wraps(fn)
         @jwt_required()
         def wrapper(*args, **kwargs):
-            current = get_jwt_identity()
-            if not current or "id" not in current:
-                return jsonify({"error": "unauthorized"}), 401
-
-            user = User.query.get(current["id"])
-            if not user:
+            # scope резолвится один раз и переиспользуется в handler'е
+            scope = get_tenant_scope()
+            if not scope:
                 return jsonify({"error": "user_not_found"}), 401
 
-            if not has_perm(user, perm):
+            if not scope.has_perm(perm):
                 return jsonify({
                     "error": "forbidden",
                     "missing": perm
@@ -12,6 +12,9 @@ PENDING_TTL_MINUTES = 15
 OVERDUE_REFUND_GRACE_MINUTES = 5
 AUTO_REFUND_CHECK_INTERVAL_SECONDS = 60
 
+# завершённые брони старше N месяцев уезжают в bookings_archive
+ARCHIVE_AFTER_MONTHS = 6
+
 YOOKASSA_WEBHOOK_SECRET = "test_zych0DYaqUcZykzSFoQ1U-2S6yxwbBjPZmh_YD_I3Ro"
 
 
@@ -50,6 +53,15 @@ class Config:
     JWT_HEADER_NAME = 'Authorization'
     JWT_HEADER_TYPE = 'Bearer'
 
+    # права из подписанных claims (role + perm_version), БД — только если версия устарела
+    AUTHZ_STATELESS = os.getenv("AUTHZ_STATELESS", "true").lower() in ("true", "1", "t")
+
+    # ---------- PROXY ----------
+    # число доверенных reverse proxy (nginx) перед приложением:
+    # remote_addr (лимиты логина по IP) берётся из X-Forwarded-For.
+    # 0 — запросы приходят напрямую, заголовку не доверяем
+    PROXY_FIX_HOPS = int(os.getenv("PROXY_FIX_HOPS", "0"))
+
     # ---------- APP ----------
     DEBUG = os.environ.get('FLASK_DEBUG', 'True').lower() in ('true', '1', 't')
 
@@ -77,6 +89,22 @@ class Config:
         "TTLOCK_BASE_URL",
         "https://api.sciener.com"
     )
+    # callback событий замков: /api/ttlock/callback?token=...
+    TTLOCK_CALLBACK_TOKEN = os.getenv("TTLOCK_CALLBACK_TOKEN")
+    # recordType → статус замка; остальные события только сбрасывают кэш.
+    # По умолчанию пусто: коды зависят от прошивки, а "unlocked" из кэша
+    # ведёт к списанию overdue — задавать только проверенные типы
+    TTLOCK_UNLOCK_RECORD_TYPES = os.getenv("TTLOCK_UNLOCK_RECORD_TYPES", "")
+    TTLOCK_LOCK_RECORD_TYPES = os.getenv("TTLOCK_LOCK_RECORD_TYPES", "")
+    # errcode keyboardPwd/delete "PIN на замке нет" — удаление считается выполненным
+    TTLOCK_PIN_NOT_FOUND_ERRCODES = os.getenv("TTLOCK_PIN_NOT_FOUND_ERRCODES", "-1007")
+
+    # ---------- SCHEDULER ----------
+    # задачи выполняет worker.py; web-процессы scheduler не поднимают
+    SCHEDULER_IN_WEB = os.getenv("SCHEDULER_IN_WEB", "false").lower() in ("true", "1", "t")
+    # ключ pg_advisory_lock лидера и период перевыборов
+    SCHEDULER_LOCK_KEY = int(os.getenv("SCHEDULER_LOCK_KEY", "742001"))
+    SCHEDULER_LEADER_CHECK_SECONDS = int(os.getenv("SCHEDULER_LEADER_CHECK_SECONDS", "15"))
 
     # ---------- REDIS ----------
     REDIS_URL = os.getenv("REDIS_URL")
@@ -1,6 +1,6 @@
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import Index, CheckConstraint
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Index, CheckConstraint, Computed
+from sqlalchemy.dialects.postgresql import JSONB, TSTZRANGE, ExcludeConstraint
 from app import db
 from app.permissions import permissions_for_role
 from app.utils.time import now_utc
@@ -42,6 +42,9 @@ class User(db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     role_id = db.Column(db.Integer, db.ForeignKey("roles.id"), nullable=False, index=True)
 
+    # версия прав: меняется при смене роли → старые JWT-claims считаются устаревшими
+    perm_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
     created_at = db.Column(db.DateTime(timezone=True), default=now_utc)
     updated_at = db.Column(
         db.DateTime(timezone=True),
@@ -50,7 +53,6 @@ class User(db.Model):
     )
 
     __table_args__ = (
-        Index("idx_user_phone", "phone_number"),
         Index("idx_user_role", "role_id"),
     )
 
@@ -237,7 +239,6 @@ class Beach(db.Model):
     image_url = db.Column(db.String(255))
 
     __table_args__ = (
-        Index("idx_beach_owner", "owner_id"),
         Index("idx_beach_location", "location_id"),
         CheckConstraint("count_of_sunbeds >= 0", name="check_sunbeds_count"),
     )
@@ -355,7 +356,6 @@ class Sunbed(db.Model):
 
     __table_args__ = (
         Index("idx_sunbed_beach_status", "beach_id", "status"),
-        Index("idx_sunbed_lock", "lock_identifier"),
         CheckConstraint(
             "status IN ('available','booked','maintenance')",
             name="check_sunbed_status"
@@ -425,6 +425,12 @@ class Booking(db.Model):
         index=True
     )
 
+    # [start_time, end_time) — для exclusion constraint (генерируется БД)
+    period = db.Column(
+        TSTZRANGE,
+        Computed("tstzrange(start_time, end_time, '[)')", persisted=True),
+    )
+
     # ───────────────────────────────
     # PRICING
     # ───────────────────────────────
@@ -480,6 +486,10 @@ class Booking(db.Model):
     payment_id = db.Column(db.String(100), index=True)
     payment_provider = db.Column(db.String(50))  # "yookassa", "stripe", ...
 
+    # момент подтверждения возврата (refund.succeeded); день возврата
+    # в daily_revenue и выгрузке — не updated_at, который сдвигается
+    refunded_at = db.Column(db.DateTime(timezone=True))
+
     # ───────────────────────────────
     # TTLOCK ACCESS
     # ───────────────────────────────
@@ -497,7 +507,8 @@ class Booking(db.Model):
     lock_closed_confirmed = db.Column(db.Boolean, default=False)
     lock_closed_confirmed_at = db.Column(db.DateTime(timezone=True))
 
-    # служебное (НЕ источник истины)
+    # служебное (НЕ источник истины): время последнего overdue-списания,
+    # по нему выбираются кандидаты (overdue_service.select_overdue_candidates)
     last_overdue_charge_at = db.Column(db.DateTime(timezone=True))
 
     # ───────────────────────────────
@@ -596,6 +607,69 @@ class Booking(db.Model):
         Index("idx_booking_user_status", "user_id", "status"),
         Index("idx_booking_sunbed_status", "sunbed_id", "status"),
         Index("idx_booking_payment_account", "payment_account_id"),
+        # ── partial indexes: только живые строки (terminal — ~95% таблицы)
+
+        # выборка overdue-кандидатов / problematic: только открытые аренды
+        Index(
+            "idx_booking_overdue_candidates",
+            "end_time",
+            postgresql_where=db.text("status = 'confirmed' AND lock_closed_confirmed = false"),
+        ),
+        # занятость лежака (availability / timeline) + active / holding в dashboard
+        Index(
+            "idx_booking_confirmed_sunbed",
+            "sunbed_id",
+            "end_time",
+            postgresql_include=["start_time", "payment_status", "total_price"],
+            postgresql_where=db.text("status = 'confirmed'"),
+        ),
+        # занятость pending в пределах TTL + release_expired_pending
+        Index(
+            "idx_booking_pending_sunbed",
+            "sunbed_id",
+            "end_time",
+            postgresql_include=["start_time", "created_at"],
+            postgresql_where=db.text("status = 'pending' AND payment_status = 'pending'"),
+        ),
+        # TTL-скан pending (expire_pending_bookings_bulk)
+        Index(
+            "idx_booking_pending_created",
+            "created_at",
+            postgresql_where=db.text("status = 'pending' AND payment_status = 'pending'"),
+        ),
+        # автозавершение: пользователь закрыл, замок ещё не подтверждён
+        Index(
+            "idx_booking_close_requested",
+            "end_time",
+            postgresql_where=db.text(
+                "status = 'confirmed' AND user_requested_close = true AND lock_closed_confirmed = false"
+            ),
+        ),
+        # keyset-пагинация: история пользователя (start_time, id)
+        Index(
+            "idx_booking_user_history",
+            "user_id",
+            "start_time",
+            "id",
+            postgresql_where=db.text("status IN ('completed', 'cancelled')"),
+        ),
+        # revenue_today в dashboard summary
+        Index(
+            "idx_booking_completed_paid",
+            "updated_at",
+            postgresql_include=["total_price"],
+            postgresql_where=db.text("status = 'completed' AND payment_status = 'paid'"),
+        ),
+
+        # ❗ Инвариант "нет пересечений" гарантирует БД (btree_gist)
+        ExcludeConstraint(
+            ("sunbed_id", "="),
+            ("period", "&&"),
+            name="excl_booking_sunbed_period",
+            using="gist",
+            # как busy_booking_clause: pending с незавершённой оплатой или confirmed
+            where="(status = 'pending' AND payment_status = 'pending') OR status = 'confirmed'",
+        ),
 
         CheckConstraint(
             "end_time > start_time",
@@ -626,6 +700,9 @@ class Booking(db.Model):
     # SERIALIZATION
     # ───────────────────────────────
     def to_dict(self):
+        # один проход по relationships вместо двух
+        autopay_reason = self.autopay_unavailable_reason
+
         return {
             "id": self.id,
             "user_id": self.user_id,
@@ -647,8 +724,8 @@ class Booking(db.Model):
             "lock_closed_confirmed": self.lock_closed_confirmed,
             "reminder_sent": self.reminder_sent,
 
-            "autopay_available": self.autopay_available,
-            "autopay_unavailable_reason": self.autopay_unavailable_reason,
+            "autopay_available": autopay_reason is None,
+            "autopay_unavailable_reason": autopay_reason,
 
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
@@ -766,3 +843,299 @@ class UserPaymentMethod(db.Model):
             name="uq_user_payment_method_external"
         ),
     )
+
+
+class DailyRevenue(db.Model):
+    """
+    Пред-агрегированная выручка (owner, beach, день по MSK).
+
+    НЕ источник истины: пересобирается из bookings / overdue_charges
+    (revenue_rollup_service.rebuild_daily_revenue).
+    """
+    __tablename__ = "daily_revenue"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    owner_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    beach_id = db.Column(db.Integer, db.ForeignKey("beaches.id"), nullable=False)
+    msk_date = db.Column(db.Date, nullable=False)
+
+    # completed + paid (возврат вычитает бронь обратно)
+    bookings_count = db.Column(db.Integer, nullable=False, default=0)
+    gross = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    # день = refunded_at
+    refunds = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    overdue_income = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=now_utc,
+        onupdate=now_utc
+    )
+
+    __table_args__ = (
+        db.UniqueConstraint(
+            "owner_id",
+            "beach_id",
+            "msk_date",
+            name="uq_daily_revenue_owner_beach_date"
+        ),
+        Index("idx_daily_revenue_date", "msk_date"),
+    )
+
+    def to_dict(self):
+        return {
+            "owner_id": self.owner_id,
+            "beach_id": self.beach_id,
+            "date": self.msk_date.isoformat() if self.msk_date else None,
+            "bookings_count": self.bookings_count,
+            "gross": float(self.gross or 0),
+            "refunds": float(self.refunds or 0),
+            "overdue_income": float(self.overdue_income or 0),
+        }
+
+
+class PaymentEvent(db.Model):
+    """
+    Inbox webhook'ов YooKassa.
+
+    Webhook только аутентифицирует событие и кладёт его сюда
+    (dedupe_key уникален → повторная доставка не создаёт дубль),
+    обработку делает worker (tasks/webhook_inbox.py) —
+    по порядку id внутри одного booking_key.
+    """
+    __tablename__ = "payment_events"
+
+    id = db.Column(db.BigInteger, primary_key=True)
+
+    provider = db.Column(db.String(20), nullable=False, default="yookassa")
+
+    # event:object_id:object_status
+    dedupe_key = db.Column(db.String(200), nullable=False, unique=True)
+
+    event_type = db.Column(db.String(50), nullable=False)
+    object_id = db.Column(db.String(100), nullable=False)
+
+    # ключ упорядочивания: booking:<id> / booking_group:<ids> / overdue:<id> / payment:<id>
+    booking_key = db.Column(db.String(200), nullable=False)
+
+    # без FK: inbox не должен мешать архивации / удалению аккаунтов
+    payment_account_id = db.Column(db.Integer, nullable=False)
+
+    payload = db.Column(JSONB, nullable=False)
+
+    # pending | processing | done | failed
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+
+    # аудит: чем закончилась обработка (booking_confirmed, ignored, ...)
+    result = db.Column(db.String(64))
+    # сколько раз YooKassa доставила событие (повторы — дошедшие до БД)
+    deliveries = db.Column(db.Integer, nullable=False, default=1)
+
+    received_at = db.Column(db.DateTime(timezone=True), nullable=False, default=now_utc)
+    last_delivered_at = db.Column(db.DateTime(timezone=True), nullable=False, default=now_utc)
+    next_attempt_at = db.Column(db.DateTime(timezone=True), nullable=False, default=now_utc)
+    locked_at = db.Column(db.DateTime(timezone=True))
+    processed_at = db.Column(db.DateTime(timezone=True))
+
+    __table_args__ = (
+        CheckConstraint(
+            "status IN ('pending','processing','done','failed')",
+            name="check_payment_event_status",
+        ),
+        # выборка очереди: только живые события
+        Index(
+            "idx_payment_events_queue",
+            "next_attempt_at",
+            "id",
+            postgresql_where=db.text("status = 'pending'"),
+        ),
+        Index("idx_payment_events_booking_key", "booking_key", "status"),
+        Index("idx_payment_events_object", "object_id"),
+    )
+
+    def to_dict(self, *, with_payload: bool = False):
+        data = {
+            "id": self.id,
+            "provider": self.provider,
+            "event_type": self.event_type,
+            "object_id": self.object_id,
+            "booking_key": self.booking_key,
+            "payment_account_id": self.payment_account_id,
+            "status": self.status,
+            "result": self.result,
+            "attempts": self.attempts,
+            "deliveries": self.deliveries,
+            "last_error": self.last_error,
+            "received_at": self.received_at.isoformat() if self.received_at else None,
+            "last_delivered_at": self.last_delivered_at.isoformat() if self.last_delivered_at else None,
+            "processed_at": self.processed_at.isoformat() if self.processed_at else None,
+        }
+        if with_payload:
+            data["payload"] = self.payload
+        return data
+
+
+class ScheduledAction(db.Model):
+    """
+    Отложенные действия по броням (delayed queue).
+
+    Вместо сканирования bookings раз в минуту worker забирает
+    только созревшие строки (due_at <= now).
+    Одна строка на (action, booking_id): перепланирование — upsert due_at.
+    Без FK на bookings (архивация, см. bookings_archive).
+    """
+    __tablename__ = "scheduled_actions"
+
+    id = db.Column(db.BigInteger, primary_key=True)
+
+    # expire_pending | overdue_check | autocomplete_check
+    action = db.Column(db.String(30), nullable=False)
+    booking_id = db.Column(db.Integer, nullable=False)
+
+    due_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=now_utc)
+
+    __table_args__ = (
+        db.UniqueConstraint("action", "booking_id", name="uq_scheduled_action_booking"),
+        CheckConstraint(
+            "action IN ('expire_pending','overdue_check','autocomplete_check')",
+            name="check_scheduled_action",
+        ),
+        Index("idx_scheduled_actions_due", "due_at"),
+    )
+
+
+class PinRevocation(db.Model):
+    """
+    Outbox удаления PIN-кодов TTLock.
+
+    clear_access не ходит в TTLock: он кладёт строку сюда в той же
+    транзакции, что и смена статуса брони. Удаляет PIN worker
+    (tasks/pin_revocations.py) — пачками по замку, с retry/backoff.
+    Без FK на bookings (архивация).
+    """
+    __tablename__ = "pin_revocations"
+
+    id = db.Column(db.BigInteger, primary_key=True)
+
+    # TTLock lockId (Sunbed.lock_identifier) + keyboardPwdId
+    lock_id = db.Column(db.String(100), nullable=False)
+    password_id = db.Column(db.String(50), nullable=False)
+
+    booking_id = db.Column(db.Integer)
+
+    # pending | processing | done | failed
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=now_utc)
+    next_attempt_at = db.Column(db.DateTime(timezone=True), nullable=False, default=now_utc)
+    locked_at = db.Column(db.DateTime(timezone=True))
+    processed_at = db.Column(db.DateTime(timezone=True))
+
+    __table_args__ = (
+        db.UniqueConstraint("lock_id", "password_id", name="uq_pin_revocation"),
+        CheckConstraint(
+            "status IN ('pending','processing','done','failed')",
+            name="check_pin_revocation_status",
+        ),
+        Index(
+            "idx_pin_revocations_queue",
+            "next_attempt_at",
+            "lock_id",
+            postgresql_where=db.text("status = 'pending'"),
+        ),
+    )
+
+
+# ───────────────────────────────
+# ARCHIVE (cold, partitioned)
+# ───────────────────────────────
+
+class BookingArchive(db.Model):
+    """
+    Холодный архив завершённых броней (archive_service).
+
+    Партиционирован по месяцу start_time (RANGE); партиции создаёт
+    archive_service.ensure_archive_partitions. Живая таблица bookings
+    не партиционируется: exclusion constraint по period и FK на bookings.id
+    требуют ключа партиционирования в constraint'ах.
+    Без FK и без данных доступа (PIN уже отозван).
+    """
+    __tablename__ = "bookings_archive"
+
+    # PK партиционированной таблицы обязан включать ключ партиционирования
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    start_time = db.Column(db.DateTime(timezone=True), primary_key=True)
+
+    user_id = db.Column(db.Integer, nullable=False)
+    sunbed_id = db.Column(db.Integer, nullable=False)
+    payment_account_id = db.Column(db.Integer)
+    payment_method_id = db.Column(db.Integer)
+
+    end_time = db.Column(db.DateTime(timezone=True), nullable=False)
+    total_price = db.Column(db.Numeric(10, 2), nullable=False)
+
+    status = db.Column(db.String(20), nullable=False)
+    payment_status = db.Column(db.String(30), nullable=False)
+    payment_id = db.Column(db.String(100))
+    payment_provider = db.Column(db.String(50))
+    refunded_at = db.Column(db.DateTime(timezone=True))
+
+    user_requested_close = db.Column(db.Boolean)
+    user_requested_close_at = db.Column(db.DateTime(timezone=True))
+    lock_closed_confirmed = db.Column(db.Boolean)
+    lock_closed_confirmed_at = db.Column(db.DateTime(timezone=True))
+    last_overdue_charge_at = db.Column(db.DateTime(timezone=True))
+    overdue_hours = db.Column(db.Integer)
+    reminder_sent = db.Column(db.Boolean)
+
+    created_at = db.Column(db.DateTime(timezone=True))
+    updated_at = db.Column(db.DateTime(timezone=True))
+    archived_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.text("now()"))
+
+    # только чтение (история): FK нет
+    sunbed = db.relationship(
+        "Sunbed",
+        primaryjoin="foreign(BookingArchive.sunbed_id) == Sunbed.id",
+        viewonly=True,
+    )
+
+    __table_args__ = (
+        Index("idx_bookings_archive_user", "user_id", "start_time", "id"),
+        {"postgresql_partition_by": "RANGE (start_time)"},
+    )
+
+
+class OverdueChargeArchive(db.Model):
+    """
+    Архив overdue-списаний — вместе с бронью, в партиции того же месяца
+    (booking_start_time = start_time брони).
+    """
+    __tablename__ = "overdue_charges_archive"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    booking_start_time = db.Column(db.DateTime(timezone=True), primary_key=True)
+
+    booking_id = db.Column(db.Integer, nullable=False)
+    hours = db.Column(db.Integer, nullable=False)
+    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    payment_id = db.Column(db.String(100))
+    payment_status = db.Column(db.String(20), nullable=False)
+    refund_id = db.Column(db.String(100))
+
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    paid_at = db.Column(db.DateTime(timezone=True))
+    refunded_at = db.Column(db.DateTime(timezone=True))
+    archived_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.text("now()"))
+
+    __table_args__ = (
+        Index("idx_overdue_charges_archive_booking", "booking_id"),
+        {"postgresql_partition_by": "RANGE (booking_start_time)"},
+    )
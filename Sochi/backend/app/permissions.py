@@ -68,6 +68,7 @@ ADMIN_EXTRA_PERMS = {
 
     # platform
     "platform:stats",
+    "payment_events:read",
 
     "sunbed:remote_unlock",
 }
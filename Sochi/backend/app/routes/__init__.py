@@ -9,6 +9,7 @@ from .owner_legal import owner_legal_bp
 from .dashboard import dashboard_bp
 from .locations import locations_bp
 from .owner_payment_accounts import owner_payment_bp
+from .ttlock import ttlock_bp
 
 
 __all__ = [
@@ -23,4 +24,5 @@ __all__ = [
     "dashboard_bp",
     "locations_bp",
     "owner_payment_bp",
+    "ttlock_bp",
 ]
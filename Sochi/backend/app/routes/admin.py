@@ -1,6 +1,7 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from flask_jwt_extended import get_jwt_identity
-from sqlalchemy import func
+from sqlalchemy import and_, any_, func, literal, or_
+from sqlalchemy.orm import joinedload
 
 from app import db
 from app.models import (
@@ -9,8 +10,12 @@ from app.models import (
     Sunbed,
     Booking,
     OverdueCharge,
+    DailyRevenue,
+    PaymentEvent,
 )
 from app.authz import require_perm
+from app.routes.utils import CursorError, keyset_args, keyset_paginate
+from app.serializers import with_booking_view, serialize_bookings
 from app.services.booking_service import try_complete_booking, BookingServiceError
 from app.services.overdue_refund_service import refund_overdue_charge, OverdueRefundError
 from app.utils.time import now_utc
@@ -23,8 +28,22 @@ admin_bp = Blueprint("admin", __name__)
 @admin_bp.route("/users", methods=["GET"])
 @require_perm("users:read")
 def admin_users():
-    users = User.query.order_by(User.id.desc()).all()
-    return jsonify({"users": [u.to_dict() for u in users]}), 200
+    """?cursor=&limit= — keyset по id (новые сверху)."""
+    cursor, limit = keyset_args()
+    try:
+        users, next_cursor = keyset_paginate(
+            User.query.options(joinedload(User.role)),
+            (User.id,),
+            cursor=cursor,
+            limit=limit,
+        )
+    except CursorError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "users": [u.to_dict() for u in users],
+        "next_cursor": next_cursor,
+    }), 200
 
 
 # -------------------------------------------------
@@ -33,8 +52,22 @@ def admin_users():
 @admin_bp.route("/beaches", methods=["GET"])
 @require_perm("beach:write")
 def admin_beaches():
-    beaches = Beach.query.order_by(Beach.id.desc()).all()
-    return jsonify({"beaches": [b.to_dict() for b in beaches]}), 200
+    """?cursor=&limit= — keyset по id (новые сверху)."""
+    cursor, limit = keyset_args()
+    try:
+        beaches, next_cursor = keyset_paginate(
+            Beach.query.options(joinedload(Beach.location)),
+            (Beach.id,),
+            cursor=cursor,
+            limit=limit,
+        )
+    except CursorError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "beaches": [b.to_dict() for b in beaches],
+        "next_cursor": next_cursor,
+    }), 200
 
 
 @admin_bp.route("/beaches/<int:beach_id>/deactivate", methods=["POST"])
@@ -51,6 +84,51 @@ def admin_deactivate_beach(beach_id: int):
     }), 200
 
 
+# -------------------------------------------------
+# PAYMENT EVENTS (аудит webhook'ов YooKassa)
+# -------------------------------------------------
+@admin_bp.route("/payment-events", methods=["GET"])
+@require_perm("payment_events:read")
+def admin_payment_events():
+    """
+    ?booking_id= | ?booking_key= | ?object_id= | ?status= | ?limit=
+    ?with_payload=1 — с исходным телом события
+    """
+    query = PaymentEvent.query
+
+    booking_id = request.args.get("booking_id", type=int)
+    if booking_id:
+        # одиночная бронь — booking:<id>, групповой платёж — booking_group:<id>,<id>,...
+        group_ids = func.string_to_array(func.split_part(PaymentEvent.booking_key, ":", 2), ",")
+        query = query.filter(or_(
+            PaymentEvent.booking_key == f"booking:{booking_id}",
+            and_(
+                PaymentEvent.booking_key.like("booking_group:%"),
+                literal(str(booking_id)) == any_(group_ids),
+            ),
+        ))
+
+    booking_key = request.args.get("booking_key")
+    if booking_key:
+        query = query.filter(PaymentEvent.booking_key == booking_key)
+
+    object_id = request.args.get("object_id")
+    if object_id:
+        query = query.filter(PaymentEvent.object_id == object_id)
+
+    status = request.args.get("status")
+    if status:
+        query = query.filter(PaymentEvent.status == status)
+
+    limit = min(request.args.get("limit", 100, type=int), 500)
+    with_payload = request.args.get("with_payload") in ("1", "true")
+
+    events = query.order_by(PaymentEvent.id.desc()).limit(limit).all()
+    return jsonify({
+        "events": [e.to_dict(with_payload=with_payload) for e in events],
+    }), 200
+
+
 # -------------------------------------------------
 # SUNBEDS
 # -------------------------------------------------
@@ -74,13 +152,22 @@ def admin_deactivate_sunbed(sunbed_id: int):
 @admin_bp.route("/bookings", methods=["GET"])
 @require_perm("booking:read_all")
 def admin_bookings():
-    bookings = (
-        Booking.query
-        .order_by(Booking.created_at.desc())
-        .limit(200)
-        .all()
-    )
-    return jsonify({"bookings": [b.to_dict() for b in bookings]}), 200
+    """?cursor=&limit= — keyset по id (новые сверху; created_at бывает NULL)."""
+    cursor, limit = keyset_args()
+    try:
+        bookings, next_cursor = keyset_paginate(
+            with_booking_view(Booking.query),
+            (Booking.id,),
+            cursor=cursor,
+            limit=limit,
+        )
+    except CursorError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "bookings": serialize_bookings(bookings),
+        "next_cursor": next_cursor,
+    }), 200
 
 
 @admin_bp.route("/bookings/<int:booking_id>/force-close", methods=["POST"])
@@ -170,12 +257,22 @@ def admin_refund_overdue(overdue_id: int):
 @admin_bp.route("/stats", methods=["GET"])
 @require_perm("platform:stats")
 def platform_stats():
-    revenue = (
+    # завершённые — из rollup, активные оплаченные — живым запросом
+    completed_revenue = (
+        db.session.query(func.sum(DailyRevenue.gross))
+        .scalar()
+        or 0
+    )
+    active_revenue = (
         db.session.query(func.sum(Booking.total_price))
-        .filter(Booking.payment_status == "paid")
+        .filter(
+            Booking.status == "confirmed",
+            Booking.payment_status == "paid",
+        )
         .scalar()
         or 0
     )
+    revenue = completed_revenue + active_revenue
 
     return jsonify({
         "users_total": User.query.count(),
@@ -5,10 +5,16 @@ import re
 from app import db
 from app.models import User, Role
 from app.permissions import permissions_for_role
+from app.utils.rate_limit import allow_sliding_window
 
 
 auth_bp = Blueprint('auth', __name__)
 
+# подбор пароля: лимиты на номер и на IP
+LOGIN_LIMIT_PER_PHONE = 5        # попыток
+LOGIN_LIMIT_PER_IP = 30          # попыток
+LOGIN_LIMIT_WINDOW = 300         # секунд
+
 
 def validate_phone(phone):
     """Валидация российского номера телефона"""
@@ -87,6 +93,16 @@ def login():
         if not data or 'phone_number' not in data or 'password' not in data:
             return jsonify({'error': 'Phone number and password required'}), 400
 
+        if (
+            not allow_sliding_window(
+                f"login:ip:{request.remote_addr}", LOGIN_LIMIT_PER_IP, LOGIN_LIMIT_WINDOW
+            )
+            or not allow_sliding_window(
+                f"login:phone:{data['phone_number']}", LOGIN_LIMIT_PER_PHONE, LOGIN_LIMIT_WINDOW
+            )
+        ):
+            return jsonify({'error': 'Too many login attempts'}), 429
+
         user = User.query.filter_by(phone_number=data['phone_number']).first()
 
         if not user or not user.check_password(data['password']):
@@ -100,6 +116,7 @@ def login():
                 'id': user.id,
                 'phone': user.phone_number,
                 'role': role.name if role else 'customer',
+                'pv': user.perm_version or 0,
                 'name': user.name
             }
         )
@@ -169,6 +186,7 @@ def refresh():
                 'id': user.id,
                 'phone': user.phone_number,
                 'role': role.name if role else 'customer',
+                'pv': user.perm_version or 0,
                 'name': user.name
             }
         )
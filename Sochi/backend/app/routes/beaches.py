@@ -2,11 +2,13 @@ from os import abort
 
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.orm import joinedload
 
 from app import db
-from app.models import Beach, Location, Sunbed, Booking, User
+from app.models import Beach, Location, Sunbed, Booking
 from app.authz import require_perm
-from .utils import legal_required, validate_json
+from app.scope import get_tenant_scope
+from .utils import legal_required, validate_json, CursorError, keyset_args, keyset_paginate
 
 beaches_bp = Blueprint("beaches", __name__)
 
@@ -14,21 +16,29 @@ beaches_bp = Blueprint("beaches", __name__)
 # PUBLIC
 # -------------------------------------------------
 
-def _current_user() -> User:
-    current = get_jwt_identity()
-    return User.query.get(current["id"])
-
-
 @beaches_bp.route("/", methods=["GET"], strict_slashes=False)
 def list_beaches():
-    q = Beach.query.filter_by(owner_hidden=False)
+    """
+    ?location_id= ; ?cursor=&limit= — keyset по id (новые сверху),
+    курсор следующей страницы — в заголовке X-Next-Cursor.
+    Без cursor и limit — весь список (как до пагинации).
+    """
+    q = Beach.query.options(joinedload(Beach.location)).filter_by(owner_hidden=False)
 
     location_id = request.args.get("location_id", type=int)
     if location_id:
         q = q.filter(Beach.location_id == location_id)
 
-    beaches = q.order_by(Beach.id.desc()).all()
-    return jsonify([b.to_dict() for b in beaches]), 200
+    cursor, limit = keyset_args(unbounded_by_default=True)
+    try:
+        beaches, next_cursor = keyset_paginate(q, (Beach.id,), cursor=cursor, limit=limit)
+    except CursorError as e:
+        return jsonify({"error": str(e)}), 400
+
+    response = jsonify([b.to_dict() for b in beaches])
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response, 200
 
 
 @beaches_bp.route("/<int:beach_id>", methods=["GET"], strict_slashes=False)
@@ -99,16 +109,12 @@ def create_beach():
 @require_perm("beach:write")
 @legal_required
 def update_beach(beach_id: int):
-    current = get_jwt_identity()
     beach = Beach.query.get_or_404(beach_id)
 
     # owner может редактировать только свои пляжи
-    if not beach.owner_id == current["id"]:
-        # admin может всё
-        from app.models import User
-        user = User.query.get(current["id"])
-        if not user or not user.has_perm("users:read"):
-            return jsonify({"error": "Access denied"}), 403
+    # admin может всё
+    if not get_tenant_scope().can_access_owner(beach.owner_id, "users:read"):
+        return jsonify({"error": "Access denied"}), 403
 
     data = request.get_json() or {}
 
@@ -143,15 +149,11 @@ def update_beach(beach_id: int):
 @require_perm("beach:write")
 @legal_required
 def delete_beach(beach_id: int):
-    current = get_jwt_identity()
     beach = Beach.query.get_or_404(beach_id)
 
     # owner может удалять только свои пляжи
-    if not beach.owner_id == current["id"]:
-        from app.models import User
-        user = User.query.get(current["id"])
-        if not user or not user.has_perm("users:read"):
-            return jsonify({"error": "Access denied"}), 403
+    if not get_tenant_scope().can_access_owner(beach.owner_id, "users:read"):
+        return jsonify({"error": "Access denied"}), 403
 
     # ❗ Инвариант: нельзя удалить, если есть бронирования
     has_bookings = (
@@ -181,14 +183,11 @@ def delete_beach(beach_id: int):
 @beaches_bp.route("/<int:beach_id>/sunbeds", methods=["GET"])
 @require_perm("sunbed:read")
 def get_beach_sunbeds(beach_id: int):
-    user = _current_user()
-
     beach = Beach.query.get_or_404(beach_id)
 
     # owner → только свои пляжи
-    if not user.has_perm("booking:read_all"):
-        if beach.owner_id != user.id:
-            return jsonify({"error": "Access denied"}), 403
+    if not get_tenant_scope().can_access_owner(beach.owner_id):
+        return jsonify({"error": "Access denied"}), 403
 
     sunbeds = (
         Sunbed.query
@@ -7,16 +7,31 @@ from typing import Tuple, Optional
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 
 from app import db
 from app.config import PENDING_TTL_MINUTES
-from app.models import Booking, Sunbed, Price, OwnerPaymentAccount
-from app.services.booking_service import try_complete_booking, BookingServiceError
+from app.models import Booking, BookingArchive, Sunbed, Price, OwnerPaymentAccount
+from app.services.booking_service import (
+    try_complete_booking,
+    release_expired_pending,
+    BookingServiceError,
+    LockCheckPending,
+)
+from app.services.lock_status_service import LOCK_REFRESH_RETRY_AFTER
+from app.services.scheduled_actions_service import (
+    schedule_pending_expiry,
+    schedule_autocomplete_check,
+)
+from app.serializers import with_booking_view, serialize_bookings
+from app.services.availability_service import busy_booking_clause
 from app.services.yookassa_service import YooKassaService
 from app.utils.time import to_utc, now_utc, to_msk
-import app.extensions as ext
+from app.utils.rate_limit import allow_sliding_window
+from app.routes.utils import CursorError, keyset_args, keyset_filter, keyset_cursor
 
 RATE_LIMIT_SECONDS = 5
+MAX_BATCH_SUNBEDS = 10
 
 bookings_bp = Blueprint("bookings", __name__)
 
@@ -24,54 +39,49 @@ bookings_bp = Blueprint("bookings", __name__)
 # ============================================================
 # Helpers
 # ============================================================
-def _rate_limit(key: str, seconds: int = RATE_LIMIT_SECONDS) -> bool:
+def _pending_cutoff() -> datetime:
+    return now_utc() - timedelta(minutes=PENDING_TTL_MINUTES)
+
+
+BOOKING_OVERLAP_CONSTRAINT = "excl_booking_sunbed_period"
+
+
+def _is_overlap_violation(error: IntegrityError) -> bool:
     """
-    True = allowed
-    False = blocked (too frequent)
+    True, если INSERT отклонён exclusion constraint'ом (пересечение броней).
     """
-    r = getattr(ext, "redis_client", None)
-    if not r:
+    diag = getattr(error.orig, "diag", None)
+    if diag is not None and getattr(diag, "constraint_name", None) == BOOKING_OVERLAP_CONSTRAINT:
         return True
+    return BOOKING_OVERLAP_CONSTRAINT in str(error.orig)
 
-    try:
-        # SET key value NX EX seconds
-        ok = r.set(name=key, value="1", nx=True, ex=seconds)
-        return bool(ok)
-    except Exception:
-        # Redis optional — do not fail business flow
-        return True
 
+def _parse_window(start_raw, end_raw) -> Tuple[Optional[datetime], Optional[datetime], Optional[str]]:
+    if not start_raw or not end_raw:
+        return None, None, "Missing required fields"
 
-def _pending_cutoff() -> datetime:
-    return now_utc() - timedelta(minutes=PENDING_TTL_MINUTES)
+    try:
+        start = to_utc(datetime.fromisoformat(start_raw))
+        end = to_utc(datetime.fromisoformat(end_raw))
+    except Exception:
+        return None, None, "Invalid datetime format"
 
+    if start >= end:
+        return None, None, "Invalid time range"
 
-def _has_conflict(sunbed_id: int, start: datetime, end: datetime) -> bool:
-    """
-    Overlap logic:
-      start < existing.end AND end > existing.start
+    return start, end, None
 
-    We treat:
-      - confirmed always conflicts
-      - pending conflicts only if not expired by TTL
-    """
-    cutoff = _pending_cutoff()
 
-    conflict = (
-        Booking.query.filter(
-            Booking.sunbed_id == sunbed_id,
-            Booking.start_time < end,
-            Booking.end_time > start,
-            Booking.status.in_(["confirmed", "pending"]),
-            or_(
-                Booking.status == "confirmed",
-                Booking.created_at >= cutoff,
-            ),
+def _resolve_payment_account(owner_id: int) -> Optional[OwnerPaymentAccount]:
+    return (
+        OwnerPaymentAccount.query
+        .filter_by(
+            owner_id=owner_id,
+            provider="yookassa",
+            is_active=True,
         )
         .first()
-        is not None
     )
-    return conflict
 
 
 def _calc_price(sunbed: Sunbed, start: datetime, end: datetime) -> Tuple[Optional[Decimal], Optional[str]]:
@@ -138,39 +148,27 @@ def create_booking():
     data = request.get_json() or {}
 
     sunbed_id = data.get("sunbed_id")
-    start_raw = data.get("start_time")
-    end_raw = data.get("end_time")
-
-    if not sunbed_id or not start_raw or not end_raw:
+    if not sunbed_id:
         return jsonify({"error": "Missing required fields"}), 400
 
-    try:
-        start = to_utc(datetime.fromisoformat(start_raw))
-        end = to_utc(datetime.fromisoformat(end_raw))
-    except Exception:
-        return jsonify({"error": "Invalid datetime format"}), 400
-
-    if start >= end:
-        return jsonify({"error": "Invalid time range"}), 400
+    start, end, err = _parse_window(data.get("start_time"), data.get("end_time"))
+    if err:
+        return jsonify({"error": err}), 400
 
-    # Serialize booking creation per sunbed to kill race conditions
+    # Без row lock: пересечения отсекает exclusion constraint в БД,
+    # конкурирующие INSERT'ы на разные слоты не ждут друг друга
     try:
         with db.session.begin():
-            sunbed = (
-                Sunbed.query.filter_by(id=int(sunbed_id))
-                .with_for_update()
-                .first()
-            )
+            sunbed = Sunbed.query.get(int(sunbed_id))
             if not sunbed:
                 return jsonify({"error": "Sunbed not found"}), 404
 
-            if _has_conflict(sunbed.id, start, end):
-                return jsonify({"error": "Time slot already booked"}), 409
-
             total_price, err = _calc_price(sunbed, start, end)
             if err:
                 return jsonify({"error": err}), 400
 
+            release_expired_pending([sunbed.id], start, end)
+
             booking = Booking(
                 user_id=current["id"],
                 sunbed_id=sunbed.id,
@@ -181,9 +179,19 @@ def create_booking():
                 payment_status="pending",
             )
             db.session.add(booking)
+            db.session.flush()  # нужен booking.id
+
+            # TTL pending — точный срок, а не ближайший проход booking_cleanup
+            schedule_pending_expiry(booking)
 
         return jsonify(booking.to_dict()), 201
 
+    except IntegrityError as e:
+        db.session.rollback()
+        if _is_overlap_violation(e):
+            return jsonify({"error": "Time slot already booked"}), 409
+        return jsonify({"error": "Booking failed"}), 500
+
     except Exception:
         db.session.rollback()
         return jsonify({"error": "Booking failed"}), 500
@@ -197,7 +205,7 @@ def create_booking():
 def pay_booking(booking_id: int):
     current = get_jwt_identity()
 
-    if not _rate_limit(f"pay_booking:{current['id']}:{booking_id}", RATE_LIMIT_SECONDS):
+    if not allow_sliding_window(f"pay_booking:{current['id']}:{booking_id}", 1, RATE_LIMIT_SECONDS):
         return jsonify({"error": "Too many requests"}), 429
 
     booking = Booking.query.get_or_404(booking_id)
@@ -229,17 +237,7 @@ def pay_booking(booking_id: int):
     if not sunbed or not sunbed.beach:
         return jsonify({"error": "Invalid booking configuration"}), 500
 
-    owner_id = sunbed.beach.owner_id
-    payment_account = (
-        OwnerPaymentAccount.query
-        .filter_by(
-            owner_id=owner_id,
-            provider="yookassa",
-            is_active=True,
-        )
-        .first()
-    )
-
+    payment_account = _resolve_payment_account(sunbed.beach.owner_id)
     if not payment_account:
         return jsonify({"error": "Owner payment account not configured"}), 409
 
@@ -287,6 +285,230 @@ def pay_booking(booking_id: int):
 
 
 
+# ============================================================
+# Batch booking (group / family)
+# ============================================================
+@bookings_bp.route("/batch", methods=["POST"])
+@jwt_required()
+def create_booking_batch():
+    """
+    Несколько лежаков одного пляжа на одно окно — одной транзакцией.
+
+    body: {"sunbed_ids": [...], "start_time": ..., "end_time": ...}
+    Всё или ничего: при любом пересечении ни одна бронь не создаётся.
+    """
+    current = get_jwt_identity()
+    data = request.get_json() or {}
+
+    try:
+        sunbed_ids = sorted({int(i) for i in (data.get("sunbed_ids") or [])})
+    except (TypeError, ValueError):
+        return jsonify({"error": "sunbed_ids must be a list of ids"}), 400
+
+    if not sunbed_ids:
+        return jsonify({"error": "Missing required fields"}), 400
+
+    if len(sunbed_ids) > MAX_BATCH_SUNBEDS:
+        return jsonify({"error": f"Too many sunbeds (max {MAX_BATCH_SUNBEDS})"}), 400
+
+    start, end, err = _parse_window(data.get("start_time"), data.get("end_time"))
+    if err:
+        return jsonify({"error": err}), 400
+
+    try:
+        with db.session.begin():
+            sunbeds = (
+                Sunbed.query
+                .filter(Sunbed.id.in_(sunbed_ids))
+                .order_by(Sunbed.id)
+                .all()
+            )
+            if len(sunbeds) != len(sunbed_ids):
+                return jsonify({"error": "Sunbed not found"}), 404
+
+            # одна касса → один платёж
+            if len({s.beach_id for s in sunbeds}) != 1:
+                return jsonify({"error": "All sunbeds must belong to one beach"}), 400
+
+            prices = {}
+            for sunbed in sunbeds:
+                total_price, err = _calc_price(sunbed, start, end)
+                if err:
+                    return jsonify({"error": err, "sunbed_id": sunbed.id}), 400
+                prices[sunbed.id] = total_price
+
+            release_expired_pending(sunbed_ids, start, end)
+
+            busy_ids = [
+                sid for (sid,) in (
+                    db.session.query(Booking.sunbed_id)
+                    .filter(
+                        Booking.sunbed_id.in_(sunbed_ids),
+                        busy_booking_clause(start, end),
+                    )
+                    .distinct()
+                    .all()
+                )
+            ]
+            if busy_ids:
+                return jsonify({
+                    "error": "Time slot already booked",
+                    "sunbed_ids": sorted(busy_ids),
+                }), 409
+
+            bookings = [
+                Booking(
+                    user_id=current["id"],
+                    sunbed_id=sunbed.id,
+                    start_time=start,
+                    end_time=end,
+                    total_price=prices[sunbed.id],
+                    status="pending",
+                    payment_status="pending",
+                )
+                for sunbed in sunbeds
+            ]
+            db.session.add_all(bookings)
+            db.session.flush()  # нужны booking.id
+
+            for booking in bookings:
+                schedule_pending_expiry(booking)
+
+        return jsonify({
+            "bookings": serialize_bookings(bookings),
+            "total_price": float(sum(b.total_price for b in bookings)),
+        }), 201
+
+    except IntegrityError as e:
+        db.session.rollback()
+        if _is_overlap_violation(e):
+            return jsonify({"error": "Time slot already booked"}), 409
+        return jsonify({"error": "Booking failed"}), 500
+
+    except Exception:
+        db.session.rollback()
+        return jsonify({"error": "Booking failed"}), 500
+
+
+@bookings_bp.route("/batch/pay", methods=["POST"])
+@jwt_required()
+def pay_booking_batch():
+    """
+    Один платёж YooKassa на группу броней.
+
+    body: {"booking_ids": [...]}
+    metadata платежа: type=booking_group, booking_ids="1,2,3"
+    """
+    current = get_jwt_identity()
+    data = request.get_json() or {}
+
+    try:
+        booking_ids = sorted({int(i) for i in (data.get("booking_ids") or [])})
+    except (TypeError, ValueError):
+        return jsonify({"error": "booking_ids must be a list of ids"}), 400
+
+    if not booking_ids:
+        return jsonify({"error": "Missing required fields"}), 400
+
+    if len(booking_ids) > MAX_BATCH_SUNBEDS:
+        return jsonify({"error": f"Too many bookings (max {MAX_BATCH_SUNBEDS})"}), 400
+
+    group_key = ",".join(str(i) for i in booking_ids)
+    if not allow_sliding_window(f"pay_booking_batch:{current['id']}:{group_key}", 1, RATE_LIMIT_SECONDS):
+        return jsonify({"error": "Too many requests"}), 429
+
+    bookings = (
+        Booking.query
+        .filter(Booking.id.in_(booking_ids))
+        .order_by(Booking.id)
+        .all()
+    )
+    if len(bookings) != len(booking_ids):
+        return jsonify({"error": "Booking not found"}), 404
+
+    if any(b.user_id != current["id"] for b in bookings):
+        return jsonify({"error": "Access denied"}), 403
+
+    # ───────────────────────────────
+    # STATE CHECKS
+    # ───────────────────────────────
+    if any(b.status != "pending" for b in bookings):
+        return jsonify({"error": "Booking is not payable"}), 409
+
+    if any(b.payment_status == "paid" for b in bookings):
+        return jsonify({"error": "Already paid"}), 400
+
+    # TTL guard (просроченные отменяем все, а не до первой)
+    expired = [b for b in bookings if _expire_pending_if_needed(b)]
+    if expired:
+        return jsonify({
+            "error": "Booking expired",
+            "booking_ids": [b.id for b in expired],
+        }), 409
+
+    if any(b.payment_id for b in bookings):
+        return jsonify({"error": "Payment already initiated"}), 409
+
+    # ───────────────────────────────
+    # RESOLVE PAYMENT ACCOUNT (ONE OWNER)
+    # ───────────────────────────────
+    owner_ids = {
+        b.sunbed.beach.owner_id
+        for b in bookings
+        if b.sunbed and b.sunbed.beach
+    }
+    if len(owner_ids) != 1 or any(not b.sunbed or not b.sunbed.beach for b in bookings):
+        return jsonify({"error": "Bookings belong to different owners"}), 409
+
+    payment_account = _resolve_payment_account(owner_ids.pop())
+    if not payment_account:
+        return jsonify({"error": "Owner payment account not configured"}), 409
+
+    # ───────────────────────────────
+    # CREATE PAYMENT (HTTP YooKassa)
+    # ───────────────────────────────
+    svc = YooKassaService(payment_account=payment_account)
+    total = sum(Decimal(b.total_price) for b in bookings)
+
+    try:
+        payment = svc.create_payment(
+            amount=total,
+            description=f"Sunbed bookings #{group_key}",
+            return_url=current_app.config.get(
+                "YOOKASSA_RETURN_URL",
+                "https://localhost:5173/profile",
+            ),
+            save_payment_method=True,
+            metadata={
+                "type": "booking_group",
+                "booking_ids": group_key,
+                "payment_account_id": payment_account.id,
+            },
+        )
+    except Exception:
+        current_app.logger.exception("YooKassa group payment creation failed")
+        return jsonify({"error": "Payment initiation failed"}), 502
+
+    # ───────────────────────────────
+    # PERSIST PAYMENT INFO
+    # ───────────────────────────────
+    now = now_utc()
+    for b in bookings:
+        b.payment_id = payment["id"]
+        b.payment_provider = "yookassa"
+        b.payment_account_id = payment_account.id
+        b.updated_at = now
+
+    db.session.commit()
+
+    return jsonify({
+        "payment_id": payment["id"],
+        "payment_url": payment["confirmation"]["confirmation_url"],
+        "booking_ids": booking_ids,
+        "total_price": float(total),
+    }), 200
+
+
 # ============================================================
 # Access code
 # ============================================================
@@ -349,15 +571,29 @@ def close_lock_request(booking_id: int):
     try:
         completed = try_complete_booking(
             booking,
-            require_user_request=True
+            require_user_request=True,
+            wait_for_lock=False,
         )
         db.session.commit()
 
         if completed:
             return jsonify({"status": "completed", "booking": booking.to_dict()}), 200
 
+        # замок ещё открыт: намерение сохранено, перепроверим сами
+        if booking.status == "confirmed":
+            schedule_autocomplete_check(booking, delay=timedelta(minutes=1))
+            db.session.commit()
         return jsonify({"status": "not_completed"}), 409
 
+    except LockCheckPending:
+        # намерение сохраняем: бронь завершит отложенная проверка
+        # (scheduled_actions), клиент может повторить запрос через Retry-After
+        schedule_autocomplete_check(booking)
+        db.session.commit()
+        resp = jsonify({"status": "pending", "retry_after": LOCK_REFRESH_RETRY_AFTER})
+        resp.headers["Retry-After"] = str(LOCK_REFRESH_RETRY_AFTER)
+        return resp, 202
+
     except BookingServiceError as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 409
@@ -378,7 +614,7 @@ def get_active_bookings():
     cutoff = _pending_cutoff()
 
     bookings = (
-        Booking.query
+        with_booking_view(Booking.query)
         .filter(
             Booking.user_id == current["id"],
             Booking.status.in_(["confirmed", "pending"]),
@@ -410,7 +646,7 @@ def get_active_bookings():
         # remove expired from response
         bookings = [b for b in bookings if b.id not in expired_ids]
 
-    return jsonify([b.to_dict() for b in bookings]), 200
+    return jsonify(serialize_bookings(bookings)), 200
 
 
 # ============================================================
@@ -419,20 +655,56 @@ def get_active_bookings():
 @bookings_bp.route("/history", methods=["GET"])
 @jwt_required()
 def get_booking_history():
+    """
+    История (completed / cancelled), новые сверху.
+    Keyset по (start_time, id): ?cursor=&limit=,
+    курсор следующей страницы — в заголовке X-Next-Cursor.
+    Без cursor и limit — вся история (как до пагинации).
+    """
     current = get_jwt_identity()
+    cursor, limit = keyset_args(unbounded_by_default=True)
 
-    bookings = (
-        Booking.query
-        .filter(
-            Booking.user_id == current["id"],
-            Booking.status.in_(["completed", "cancelled"]),
+    live_key = (Booking.start_time, Booking.id)
+    archive_key = (BookingArchive.start_time, BookingArchive.id)
+
+    try:
+        live_q = keyset_filter(
+            with_booking_view(Booking.query, "history")
+            .filter(
+                Booking.user_id == current["id"],
+                Booking.status.in_(["completed", "cancelled"]),
+            ),
+            live_key,
+            cursor,
         )
-        .order_by(Booking.start_time.desc())
-        .all()
-    )
+
+        # старые брони — в холодном архиве (archive_service); тот же ключ
+        archive_q = keyset_filter(
+            with_booking_view(BookingArchive.query, "archive_history")
+            .filter(BookingArchive.user_id == current["id"]),
+            archive_key,
+            cursor,
+        )
+
+        if limit is not None:
+            live_q = live_q.limit(limit + 1)
+            archive_q = archive_q.limit(limit + 1)
+
+        bookings = live_q.all()
+        archived = archive_q.all()
+    except CursorError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if archived:
+        bookings = sorted(bookings + archived, key=lambda b: (b.start_time, b.id), reverse=True)
+
+    next_cursor = None
+    if limit is not None and len(bookings) > limit:
+        bookings = bookings[:limit]
+        next_cursor = keyset_cursor(bookings[-1], live_key)
 
     # keep response stable for frontend (city/beach/sunbed names)
-    return jsonify([
+    response = jsonify([
         {
             "id": b.id,
             "city_name": b.sunbed.beach.location.location_city if b.sunbed and b.sunbed.beach and b.sunbed.beach.location else None,
@@ -445,4 +717,7 @@ def get_booking_history():
             "payment_status": b.payment_status,
         }
         for b in bookings
-    ]), 200
+    ])
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response, 200
@@ -1,66 +1,96 @@
-from flask import Blueprint, jsonify, request
-from flask_jwt_extended import get_jwt_identity
-from datetime import datetime
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context
+from sqlalchemy import func, and_, false
+from datetime import date, datetime, time, timedelta
 from app.utils.time import now_utc, to_msk, to_utc
 
 from app import db
-from app.models import User, Beach, Sunbed, Booking
+from app.models import Beach, Sunbed, Booking, DailyRevenue
 from app.authz import require_perm
-from app.services.ttlock_service import TTLockService, TTLockError
+from app.scope import TenantScope, get_tenant_scope
+from app.services.ttlock_service import TTLockService, TTLockError, TTLOCK_BUDGET_INTERACTIVE
+from app.services.lock_status_service import (
+    get_lock_status_nowait,
+    LockStatusError,
+    LockStatusPending,
+    LOCK_REFRESH_RETRY_AFTER,
+)
 
 from app.services.booking_service import try_complete_booking, BookingServiceError
+from app.services.finance_export_service import (
+    EXPORT_KINDS,
+    FinanceExportError,
+    iter_csv,
+    iter_finance_rows,
+    iter_ndjson,
+)
+from app.utils.rate_limit import allow_sliding_window
 
 
 dashboard_bp = Blueprint("dashboard", __name__)
 
+EXPORT_MAX_DAYS = 400
+EXPORT_RATE_LIMIT = 5          # выгрузок
+EXPORT_RATE_WINDOW = 60        # секунд, на пользователя
+
 
 # ───────────────────────────────
 # helpers
 # ───────────────────────────────
 
-def _current_user() -> User:
-    current = get_jwt_identity()
-    return User.query.get(current["id"])
+def _can_access_sunbed(scope: TenantScope, sunbed: Sunbed) -> bool:
+    if scope.is_global:
+        return True
+    owner_id = (
+        db.session.query(Beach.owner_id)
+        .filter(Beach.id == sunbed.beach_id)
+        .scalar()
+    )
+    return owner_id is not None and scope.can_access_owner(owner_id)
 
 
-def _owner_beach_ids(user: User):
-    return [b.id for b in Beach.query.filter_by(owner_id=user.id).all()]
+def _today_start_utc(now):
+    """
+    Начало текущего дня по MSK, переведённое в UTC (для сравнений в БД).
+    """
+    today_start_msk = to_msk(now).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    return to_utc(today_start_msk)
 
 
-def _scoped_bookings_query(user: User):
-    q = Booking.query
+def _sum_where(column, *conditions):
+    """SUM(column) FILTER (WHERE ...), 0 вместо NULL."""
+    return func.coalesce(func.sum(column).filter(and_(*conditions)), 0)
 
-    # admin → всё
-    if not user.has_perm("booking:read_all"):
-        q = q.join(Sunbed).filter(
-            Sunbed.beach_id.in_(_owner_beach_ids(user))
-        )
 
-    return q
+def _count_where(*conditions):
+    """COUNT(*) FILTER (WHERE ...)."""
+    return func.count().filter(and_(*conditions))
 
 
-def _scoped_sunbeds_query(user: User):
-    q = Sunbed.query
+def _scoped_bookings_query(scope: TenantScope):
+    # admin → всё, owner → join по beaches.owner_id
+    return scope.filter_bookings(Booking.query)
 
-    if not user.has_perm("booking:read_all"):
-        q = q.filter(
-            Sunbed.beach_id.in_(_owner_beach_ids(user))
-        )
 
-    return q
+def _scoped_sunbeds_query(scope: TenantScope):
+    return scope.filter_sunbeds(Sunbed.query)
 
-def _scoped_beaches_query(user: User):
-    q = Beach.query
 
-    # admin → все пляжи
-    if not user.has_perm("booking:read_all"):
-        q = q.filter(
-            Beach.owner_id == user.id
-        )
+def _scoped_revenue_query(scope: TenantScope):
+    q = DailyRevenue.query
+
+    # rollup уже разложен по owner_id — join не нужен
+    if not scope.is_global:
+        q = q.filter(DailyRevenue.owner_id == scope.user_id)
 
     return q
 
 
+def _scoped_beaches_query(scope: TenantScope):
+    return scope.filter_beaches(Beach.query)
+
+
 
 # ───────────────────────────────
 # SUMMARY
@@ -69,53 +99,58 @@ def _scoped_beaches_query(user: User):
 @dashboard_bp.route("/summary", methods=["GET"])
 @require_perm("dashboard:read")
 def dashboard_summary():
-    user = _current_user()
+    scope = get_tenant_scope()
     now = now_utc()
+    today_start_utc = _today_start_utc(now)
 
-    bookings_q = _scoped_bookings_query(user)
-    sunbeds_q = _scoped_sunbeds_query(user)
-    beaches_q = _scoped_beaches_query(user)
-
-    # ───────────────────────────────
-    # TODAY RANGE (MSK → UTC)
-    # ───────────────────────────────
-    now_msk = to_msk(now)
-    today_start_msk = now_msk.replace(
-        hour=0, minute=0, second=0, microsecond=0
+    beaches_total = (
+        _scoped_beaches_query(scope)
+        .with_entities(func.count(Beach.id))
+        .correlate(None)
+        .scalar_subquery()
     )
-    today_start_utc = to_utc(today_start_msk)
-
-    # ───────────────────────────────
-    # REVENUE (ONLY COMPLETED + PAID)
-    # ───────────────────────────────
-    completed_paid = bookings_q.filter(
-        Booking.status == "completed",
-        Booking.payment_status == "paid",
+    sunbeds_total = (
+        _scoped_sunbeds_query(scope)
+        .with_entities(func.count(Sunbed.id))
+        .correlate(None)
+        .scalar_subquery()
     )
 
-    revenue_today = sum(
-        b.total_price
-        for b in completed_paid.filter(
-            Booking.updated_at >= today_start_utc
+    # один round trip: KPI броней + счётчики пляжей / лежаков
+    # (correlate(None): sunbeds из scope-join'а не должен "протечь" в подзапрос)
+    row = (
+        _scoped_bookings_query(scope)
+        .filter(Booking.status.in_(["confirmed", "completed"]))
+        .with_entities(
+            _count_where(Booking.status == "confirmed").label("active"),
+            _count_where(
+                Booking.status == "confirmed",
+                Booking.end_time < now,
+                Booking.lock_closed_confirmed == false(),
+            ).label("problematic"),
+            # 💰 REVENUE (ONLY COMPLETED + PAID)
+            _sum_where(
+                Booking.total_price,
+                Booking.status == "completed",
+                Booking.payment_status == "paid",
+                Booking.updated_at >= today_start_utc,
+            ).label("revenue_today"),
         )
+        .add_columns(
+            beaches_total.label("beaches_total"),
+            sunbeds_total.label("sunbeds_total"),
+        )
+        .one()
     )
 
     return jsonify({
-        "active_bookings": bookings_q.filter(
-            Booking.status == "confirmed"
-        ).count(),
-
-        "problematic_bookings": bookings_q.filter(
-            Booking.status == "confirmed",
-            Booking.end_time < now,
-            Booking.lock_closed_confirmed.is_(False)
-        ).count(),
+        "active_bookings": row.active,
+        "problematic_bookings": row.problematic,
 
-        "beaches_total": beaches_q.count(),
-        "sunbeds_total": sunbeds_q.count(),
+        "beaches_total": row.beaches_total,
+        "sunbeds_total": row.sunbeds_total,
 
-        # 💰 NEW
-        "revenue_today": float(revenue_today),
+        "revenue_today": float(row.revenue_today),
     }), 200
 
 
@@ -127,10 +162,10 @@ def dashboard_summary():
 @dashboard_bp.route("/bookings/active", methods=["GET"])
 @require_perm("booking:read")
 def active_bookings():
-    user = _current_user()
+    scope = get_tenant_scope()
 
     bookings = (
-        _scoped_bookings_query(user)
+        _scoped_bookings_query(scope)
         .filter(Booking.status == "confirmed")
         .order_by(Booking.end_time)
         .all()
@@ -153,15 +188,15 @@ def active_bookings():
 @dashboard_bp.route("/bookings/problematic", methods=["GET"])
 @require_perm("booking:read")
 def problematic_bookings():
-    user = _current_user()
+    scope = get_tenant_scope()
     now = now_utc()
 
     bookings = (
-        _scoped_bookings_query(user)
+        _scoped_bookings_query(scope)
         .filter(
             Booking.status == "confirmed",
             Booking.end_time < now,
-            Booking.lock_closed_confirmed.is_(False),
+            Booking.lock_closed_confirmed == false(),
         )
         .order_by(Booking.end_time)
         .all()
@@ -183,15 +218,13 @@ def problematic_bookings():
 @dashboard_bp.route("/bookings/<int:booking_id>/force-close", methods=["POST"])
 @require_perm("booking:force_close")
 def force_close(booking_id: int):
-    user = _current_user()
+    scope = get_tenant_scope()
 
     booking = Booking.query.get_or_404(booking_id)
     sunbed = Sunbed.query.get_or_404(booking.sunbed_id)
 
-    if not user.has_perm("booking:read_all"):
-        beach = Beach.query.get(sunbed.beach_id)
-        if not beach or beach.owner_id != user.id:
-            return jsonify({"error": "Access denied"}), 403
+    if not _can_access_sunbed(scope, sunbed):
+        return jsonify({"error": "Access denied"}), 403
 
     if booking.status == "completed":
         return jsonify({
@@ -238,22 +271,28 @@ def force_close(booking_id: int):
 @dashboard_bp.route("/sunbeds/<int:sunbed_id>/lock-status", methods=["GET"])
 @require_perm("sunbed:read")
 def get_lock_status(sunbed_id: int):
-    user = _current_user()
+    scope = get_tenant_scope()
     sunbed = Sunbed.query.get_or_404(sunbed_id)
 
-    if not user.has_perm("booking:read_all"):
-        beach = Beach.query.get(sunbed.beach_id)
-        if not beach or beach.owner_id != user.id:
-            return jsonify({"error": "Access denied"}), 403
+    if not _can_access_sunbed(scope, sunbed):
+        return jsonify({"error": "Access denied"}), 403
 
     if not sunbed.has_lock or not sunbed.lock_identifier:
         return jsonify({"error": "No lock configured for this sunbed"}), 400
 
+    # не держим web-поток на TTLock: кэш или фоновое обновление + poll
     try:
-        status = TTLockService().query_status(
-            lock_id=int(sunbed.lock_identifier)
-        )
-    except TTLockError as e:
+        status = get_lock_status_nowait(int(sunbed.lock_identifier))
+    except LockStatusPending:
+        resp = jsonify({
+            "sunbed_id": sunbed.id,
+            "lock_identifier": sunbed.lock_identifier,
+            "status": "pending",
+            "retry_after": LOCK_REFRESH_RETRY_AFTER,
+        })
+        resp.headers["Retry-After"] = str(LOCK_REFRESH_RETRY_AFTER)
+        return resp, 202
+    except LockStatusError as e:
         return jsonify({
             "error": "Failed to query lock status",
             "details": str(e),
@@ -263,20 +302,20 @@ def get_lock_status(sunbed_id: int):
         "sunbed_id": sunbed.id,
         "lock_identifier": sunbed.lock_identifier,
         "locked": status.get("locked"),
-        "lock_status_raw": status.get("raw"),
+        "lock_status": status.get("lockStatus"),
+        "source": status.get("source"),
+        "cached": status.get("cached", False),
     }), 200
 
 
 @dashboard_bp.route("/sunbeds/<int:sunbed_id>/lock-records", methods=["GET"])
 @require_perm("sunbed:read")
 def get_lock_records(sunbed_id: int):
-    user = _current_user()
+    scope = get_tenant_scope()
     sunbed = Sunbed.query.get_or_404(sunbed_id)
 
-    if not user.has_perm("booking:read_all"):
-        beach = Beach.query.get(sunbed.beach_id)
-        if not beach or beach.owner_id != user.id:
-            return jsonify({"error": "Access denied"}), 403
+    if not _can_access_sunbed(scope, sunbed):
+        return jsonify({"error": "Access denied"}), 403
 
     if not sunbed.has_lock or not sunbed.lock_identifier:
         return jsonify({"error": "No lock configured for this sunbed"}), 400
@@ -285,7 +324,7 @@ def get_lock_records(sunbed_id: int):
     page_size = request.args.get("page_size", 20, type=int)
 
     try:
-        records = TTLockService().get_lock_records(
+        records = TTLockService(budget=TTLOCK_BUDGET_INTERACTIVE).get_lock_records(
             lock_id=int(sunbed.lock_identifier),
             page=page,
             page_size=page_size,
@@ -308,19 +347,17 @@ def get_lock_records(sunbed_id: int):
 @dashboard_bp.route("/sunbeds/<int:sunbed_id>/remote-unlock", methods=["POST"])
 @require_perm("sunbed:remote_unlock")
 def remote_unlock(sunbed_id: int):
-    user = _current_user()
+    scope = get_tenant_scope()
     sunbed = Sunbed.query.get_or_404(sunbed_id)
 
-    if not user.has_perm("booking:read_all"):
-        beach = Beach.query.get(sunbed.beach_id)
-        if not beach or beach.owner_id != user.id:
-            return jsonify({"error": "Access denied"}), 403
+    if not _can_access_sunbed(scope, sunbed):
+        return jsonify({"error": "Access denied"}), 403
 
     if not sunbed.has_lock or not sunbed.lock_identifier:
         return jsonify({"error": "No lock configured for this sunbed"}), 400
 
     try:
-        TTLockService().remote_unlock(
+        TTLockService(budget=TTLOCK_BUDGET_INTERACTIVE).remote_unlock(
             lock_id=int(sunbed.lock_identifier)
         )
     except TTLockError as e:
@@ -342,55 +379,117 @@ def remote_unlock(sunbed_id: int):
 @dashboard_bp.route("/finance/summary", methods=["GET"])
 @require_perm("payout:read")
 def finance_summary():
-    user = _current_user()
-    now = now_utc()
-    # 1️⃣ берём "сейчас" в MSK
-    now_msk = to_msk(now)
+    scope = get_tenant_scope()
+    today_msk = to_msk(now_utc()).date()
+
+    # завершённые — из rollup (несколько сотен строк, а не вся история)
+    rollup = (
+        _scoped_revenue_query(scope)
+        .with_entities(
+            func.coalesce(func.sum(DailyRevenue.gross), 0).label("total_earned"),
+            _sum_where(
+                DailyRevenue.gross,
+                DailyRevenue.msk_date == today_msk,
+            ).label("earned_today"),
+            func.coalesce(func.sum(DailyRevenue.bookings_count), 0).label("completed_count"),
+            func.coalesce(func.sum(DailyRevenue.refunds), 0).label("refunds"),
+            func.coalesce(func.sum(DailyRevenue.overdue_income), 0).label("overdue_income"),
+        )
+        .one()
+    )
 
-    # 2️⃣ начало дня в MSK
-    today_start_msk = now_msk.replace(
-        hour=0, minute=0, second=0, microsecond=0
+    # активные — живые данные (маленький набор confirmed)
+    active_holding = (
+        _scoped_bookings_query(scope)
+        .filter(
+            Booking.status == "confirmed",
+            Booking.payment_status == "paid",
+        )
+        .with_entities(func.coalesce(func.sum(Booking.total_price), 0))
+        .scalar()
     )
 
-    # 3️⃣ переводим обратно в UTC для БД
-    today_start_utc = to_utc(today_start_msk)
+    return jsonify({
+        "total_earned": float(rollup.total_earned),
+        "earned_today": float(rollup.earned_today),
+        "active_holding": float(active_holding),
+        "completed_count": int(rollup.completed_count),
+        "refunds": float(rollup.refunds),
+        "overdue_income": float(rollup.overdue_income),
+    }), 200
 
-    q = _scoped_bookings_query(user)
 
-    completed_paid = q.filter(
-        Booking.status == "completed",
-        Booking.payment_status == "paid",
-    )
+@dashboard_bp.route("/finance/daily", methods=["GET"])
+@require_perm("payout:read")
+def finance_daily():
+    """
+    Выручка по дням (MSK) для графиков.
+
+    query:
+      from, to  — YYYY-MM-DD (включительно), по умолчанию последние 30 дней
+      beach_id  — опционально
+    """
+    scope = get_tenant_scope()
+    today_msk = to_msk(now_utc()).date()
+
+    try:
+        date_to = date.fromisoformat(request.args["to"]) if request.args.get("to") else today_msk
+        date_from = (
+            date.fromisoformat(request.args["from"])
+            if request.args.get("from")
+            else date_to - timedelta(days=29)
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
 
-    active_paid = q.filter(
-        Booking.status == "confirmed",
-        Booking.payment_status == "paid",
+    if date_from > date_to:
+        return jsonify({"error": "Invalid date range"}), 400
+
+    q = _scoped_revenue_query(scope).filter(
+        DailyRevenue.msk_date >= date_from,
+        DailyRevenue.msk_date <= date_to,
     )
 
-    total_earned = sum(b.total_price for b in completed_paid)
-    earned_today = sum(
-        b.total_price
-        for b in completed_paid.filter(
-            Booking.updated_at >= today_start_utc
+    beach_id = request.args.get("beach_id", type=int)
+    if beach_id:
+        q = q.filter(DailyRevenue.beach_id == beach_id)
+
+    rows = (
+        q.with_entities(
+            DailyRevenue.msk_date,
+            func.sum(DailyRevenue.bookings_count).label("bookings_count"),
+            func.sum(DailyRevenue.gross).label("gross"),
+            func.sum(DailyRevenue.refunds).label("refunds"),
+            func.sum(DailyRevenue.overdue_income).label("overdue_income"),
         )
+        .group_by(DailyRevenue.msk_date)
+        .order_by(DailyRevenue.msk_date)
+        .all()
     )
-    active_holding = sum(b.total_price for b in active_paid)
 
     return jsonify({
-        "total_earned": float(total_earned),
-        "earned_today": float(earned_today),
-        "active_holding": float(active_holding),
-        "completed_count": completed_paid.count(),
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "days": [
+            {
+                "date": r.msk_date.isoformat(),
+                "bookings_count": int(r.bookings_count or 0),
+                "gross": float(r.gross or 0),
+                "refunds": float(r.refunds or 0),
+                "overdue_income": float(r.overdue_income or 0),
+            }
+            for r in rows
+        ],
     }), 200
 
 
 @dashboard_bp.route("/finance/bookings", methods=["GET"])
 @require_perm("payout:read")
 def finance_bookings():
-    user = _current_user()
+    scope = get_tenant_scope()
 
     bookings = (
-        _scoped_bookings_query(user)
+        _scoped_bookings_query(scope)
         .filter(Booking.payment_status == "paid")
         .order_by(Booking.updated_at.desc())
         .limit(200)
@@ -412,3 +511,72 @@ def finance_bookings():
             for b in bookings
         ],
     }), 200
+
+
+@dashboard_bp.route("/finance/export", methods=["GET"])
+@require_perm("payout:read")
+def finance_export():
+    """
+    Потоковая выгрузка для сверки выплат (без лимита строк).
+
+    query:
+      from, to — YYYY-MM-DD (MSK, включительно), по умолчанию последние 30 дней
+      format   — csv (по умолчанию) | ndjson
+      kinds    — через запятую: booking, booking_refund, overdue, overdue_refund
+                 (по умолчанию все)
+    """
+    scope = get_tenant_scope()
+    today_msk = to_msk(now_utc()).date()
+
+    try:
+        date_to = date.fromisoformat(request.args["to"]) if request.args.get("to") else today_msk
+        date_from = (
+            date.fromisoformat(request.args["from"])
+            if request.args.get("from")
+            else date_to - timedelta(days=29)
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
+
+    if (date_to - date_from).days + 1 > EXPORT_MAX_DAYS:
+        return jsonify({"error": f"Range is limited to {EXPORT_MAX_DAYS} days"}), 400
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    kinds_raw = request.args.get("kinds")
+    kinds = tuple(k.strip() for k in kinds_raw.split(",") if k.strip()) if kinds_raw else EXPORT_KINDS
+
+    # границы дней MSK → UTC, [start, end)
+    start = to_utc(datetime.combine(date_from, time.min))
+    end = to_utc(datetime.combine(date_to + timedelta(days=1), time.min))
+
+    try:
+        rows = iter_finance_rows(scope, start, end, kinds)
+    except FinanceExportError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not allow_sliding_window(
+        f"ratelimit:finance_export:{scope.user_id}",
+        EXPORT_RATE_LIMIT,
+        EXPORT_RATE_WINDOW,
+    ):
+        return jsonify({"error": "Too many exports, try again later"}), 429
+
+    filename = f"finance_{date_from.isoformat()}_{date_to.isoformat()}.{fmt}"
+    if fmt == "csv":
+        body, mimetype = iter_csv(rows), "text/csv; charset=utf-8"
+    else:
+        body, mimetype = iter_ndjson(rows), "application/x-ndjson"
+
+    # stream_with_context: сессия БД и scope живут, пока генератор отдаёт строки
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no",   # nginx: не буферизовать поток
+        },
+    )
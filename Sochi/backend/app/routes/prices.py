@@ -1,19 +1,14 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import get_jwt_identity
 
 from app import db
-from app.models import Price, User, Sunbed
+from app.models import Price, Sunbed
 from app.authz import require_perm
+from app.scope import get_tenant_scope
 from .utils import paginate, format_pagination, legal_required
 
 prices_bp = Blueprint("prices", __name__)
 
 
-def _current_user() -> User:
-    current = get_jwt_identity()
-    return User.query.get(current["id"])
-
-
 # -------------------------------------------------
 # CREATE
 # -------------------------------------------------
@@ -21,14 +16,14 @@ def _current_user() -> User:
 @require_perm("price:write")
 @legal_required
 def create_price():
-    user = _current_user()
+    scope = get_tenant_scope()
     data = request.get_json() or {}
 
     if data.get("price_per_hour") is None:
         return jsonify({"error": "price_per_hour is required"}), 400
 
     price = Price(
-        owner_id=user.id,
+        owner_id=scope.user_id,
         price_per_hour=data["price_per_hour"],
         price_per_day=data.get("price_per_day"),
         currency=data.get("currency", "RUB"),
@@ -51,11 +46,11 @@ def create_price():
 @prices_bp.route("/", methods=["GET"])
 @require_perm("price:read")
 def list_prices():
-    user = _current_user()
+    scope = get_tenant_scope()
 
     q = Price.query
-    if not user.has_perm("price:read_all"):
-        q = q.filter(Price.owner_id == user.id)
+    if not scope.has_perm("price:read_all"):
+        q = q.filter(Price.owner_id == scope.user_id)
 
     page = request.args.get("page", 1, type=int)
     per_page = request.args.get("per_page", 20, type=int)
@@ -70,11 +65,11 @@ def list_prices():
 @prices_bp.route("/<int:price_id>", methods=["GET"])
 @require_perm("price:read")
 def get_price(price_id: int):
-    user = _current_user()
+    scope = get_tenant_scope()
     price = Price.query.get_or_404(price_id)
 
     # owner видит только свои, admin — все
-    if not user.has_perm("price:read_all") and price.owner_id != user.id:
+    if not scope.has_perm("price:read_all") and price.owner_id != scope.user_id:
         return jsonify({"error": "Access denied"}), 403
 
     return jsonify(price.to_dict()), 200
@@ -87,10 +82,10 @@ def get_price(price_id: int):
 @require_perm("price:write")
 @legal_required
 def update_price(price_id: int):
-    user = _current_user()
+    scope = get_tenant_scope()
     price = Price.query.get_or_404(price_id)
 
-    if not user.has_perm("price:read_all") and price.owner_id != user.id:
+    if not scope.has_perm("price:read_all") and price.owner_id != scope.user_id:
         return jsonify({"error": "Access denied"}), 403
 
     data = request.get_json() or {}
@@ -120,10 +115,10 @@ def update_price(price_id: int):
 @require_perm("price:write")
 @legal_required
 def delete_price(price_id: int):
-    user = _current_user()
+    scope = get_tenant_scope()
     price = Price.query.get_or_404(price_id)
 
-    if not user.has_perm("price:read_all") and price.owner_id != user.id:
+    if not scope.has_perm("price:read_all") and price.owner_id != scope.user_id:
         return jsonify({"error": "Access denied"}), 403
 
     used = Sunbed.query.filter_by(price_id=price.id).first()
@@ -1,82 +1,107 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import get_jwt_identity
-from datetime import timedelta
+from datetime import date, datetime
 
 from app import db
 from app.models import Sunbed, Price, Beach, Booking
 from app.authz import require_perm
-from app.utils.time import now_utc
-from app.config import PENDING_TTL_MINUTES
+from app.scope import get_tenant_scope
+from app.services.availability_service import (
+    find_available_sunbeds,
+    build_beach_timeline,
+    AvailabilityError,
+)
+from app.utils.time import to_utc, to_msk, now_msk
 
 sunbeds_bp = Blueprint("sunbeds", __name__)
 
 
-# -------------------------------------------------
-# helpers
-# -------------------------------------------------
-
-def _pending_is_active(created_at, now):
-    cutoff = now - timedelta(minutes=PENDING_TTL_MINUTES)
-    return created_at and created_at >= cutoff
-
-
 # -------------------------------------------------
 # PUBLIC: AVAILABLE SUNBEDS
 # -------------------------------------------------
 @sunbeds_bp.route("/available", methods=["GET"])
 def get_available():
+    """
+    Свободные лежаки пляжа.
+
+    query:
+      beach_id   — обязательный
+      start_time — опционально (ISO, без tz = MSK), по умолчанию "сейчас"
+      end_time   — опционально (ISO), без него окно открыто
+    """
     beach_id = request.args.get("beach_id", type=int)
     if not beach_id:
         return jsonify({"error": "beach_id is required"}), 400
 
-    now = now_utc()
+    start_raw = request.args.get("start_time")
+    end_raw = request.args.get("end_time")
 
-    busy_confirmed = (
-        db.session.query(Booking.sunbed_id)
-        .filter(
-            Booking.end_time > now,
-            Booking.status == "confirmed",
-        )
-        .subquery()
-    )
+    try:
+        start = to_utc(datetime.fromisoformat(start_raw)) if start_raw else None
+        end = to_utc(datetime.fromisoformat(end_raw)) if end_raw else None
+    except ValueError:
+        return jsonify({"error": "Invalid datetime format"}), 400
 
-    pending = (
-        Booking.query
-        .with_entities(Booking.sunbed_id, Booking.created_at)
-        .filter(
-            Booking.status == "pending",
-            Booking.payment_status == "pending",
-            Booking.end_time > now,
-        )
-        .all()
-    )
+    try:
+        rows = find_available_sunbeds(beach_id, start=start, end=end)
+    except AvailabilityError as e:
+        return jsonify({"error": str(e)}), 400
+
+    result = []
+    for sunbed, price in rows:
+        d = sunbed.to_dict()
+        d["price"] = price.to_dict()
+        result.append(d)
 
-    active_pending_ids = [
-        sid for (sid, created_at) in pending
-        if _pending_is_active(created_at, now)
-    ]
+    return jsonify({"sunbeds": result}), 200
 
-    q = Sunbed.query.filter(
-        Sunbed.beach_id == beach_id,
-        ~Sunbed.id.in_(busy_confirmed),
-    )
 
-    if active_pending_ids:
-        q = q.filter(~Sunbed.id.in_(active_pending_ids))
+# -------------------------------------------------
+# PUBLIC: DAY TIMELINE (free / busy intervals)
+# -------------------------------------------------
+def _interval_to_dict(interval):
+    start, end = interval
+    return {
+        "start": to_msk(start).isoformat(),
+        "end": to_msk(end).isoformat(),
+    }
+
+
+@sunbeds_bp.route("/timeline", methods=["GET"])
+def get_timeline():
+    """
+    Сетка дня по всем лежакам пляжа за один запрос.
+
+    query:
+      beach_id — обязательный
+      date     — YYYY-MM-DD (MSK), по умолчанию сегодня
+    """
+    beach_id = request.args.get("beach_id", type=int)
+    if not beach_id:
+        return jsonify({"error": "beach_id is required"}), 400
 
-    sunbeds = q.all()
+    date_raw = request.args.get("date")
+    try:
+        day = date.fromisoformat(date_raw) if date_raw else now_msk().date()
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
 
-    result = []
-    for s in sunbeds:
-        price = Price.query.get(s.price_id)
-        if not price or not price.is_active:
-            continue
+    timeline = build_beach_timeline(beach_id, day)
 
-        d = s.to_dict()
-        d["price"] = price.to_dict()
-        result.append(d)
+    sunbeds = []
+    for item in timeline["sunbeds"]:
+        d = item["sunbed"].to_dict()
+        d["price"] = item["price"].to_dict() if item["price"] else None
+        d["busy"] = [_interval_to_dict(i) for i in item["busy"]]
+        d["free"] = [_interval_to_dict(i) for i in item["free"]]
+        sunbeds.append(d)
 
-    return jsonify({"sunbeds": result}), 200
+    return jsonify({
+        "beach_id": beach_id,
+        "date": day.isoformat(),
+        "day_start": to_msk(timeline["day_start"]).isoformat(),
+        "day_end": to_msk(timeline["day_end"]).isoformat(),
+        "sunbeds": sunbeds,
+    }), 200
 
 
 # -------------------------------------------------
@@ -85,7 +110,6 @@ def get_available():
 @sunbeds_bp.route("/", methods=["POST"], strict_slashes=False)
 @require_perm("sunbed:write")
 def create_sunbed():
-    current = get_jwt_identity()
     data = request.get_json() or {}
 
     name = data.get("name")
@@ -100,11 +124,8 @@ def create_sunbed():
     beach = Beach.query.get_or_404(beach_id)
 
     # owner может работать только со своими пляжами
-    if beach.owner_id != current["id"]:
-        from app.models import User
-        user = User.query.get(current["id"])
-        if not user or not user.has_perm("beach:read_all"):
-            return jsonify({"error": "Access denied"}), 403
+    if not get_tenant_scope().can_access_owner(beach.owner_id, "beach:read_all"):
+        return jsonify({"error": "Access denied"}), 403
 
     price = Price.query.get(price_id)
     if not price or not price.is_active:
@@ -141,15 +162,11 @@ def create_sunbed():
 @sunbeds_bp.route("/<int:sunbed_id>", methods=["PUT"])
 @require_perm("sunbed:write")
 def update_sunbed(sunbed_id: int):
-    current = get_jwt_identity()
     sunbed = Sunbed.query.get_or_404(sunbed_id)
 
     beach = Beach.query.get(sunbed.beach_id)
-    if not beach or beach.owner_id != current["id"]:
-        from app.models import User
-        user = User.query.get(current["id"])
-        if not user or not user.has_perm("beach:read_all"):
-            return jsonify({"error": "Access denied"}), 403
+    if not beach or not get_tenant_scope().can_access_owner(beach.owner_id, "beach:read_all"):
+        return jsonify({"error": "Access denied"}), 403
 
     data = request.get_json() or {}
 
@@ -198,15 +215,11 @@ def update_sunbed(sunbed_id: int):
 @sunbeds_bp.route("/<int:sunbed_id>", methods=["DELETE"])
 @require_perm("sunbed:write")
 def delete_sunbed(sunbed_id: int):
-    current = get_jwt_identity()
     sunbed = Sunbed.query.get_or_404(sunbed_id)
 
     beach = Beach.query.get(sunbed.beach_id)
-    if not beach or beach.owner_id != current["id"]:
-        from app.models import User
-        user = User.query.get(current["id"])
-        if not user or not user.has_perm("beach:read_all"):
-            return jsonify({"error": "Access denied"}), 403
+    if not beach or not get_tenant_scope().can_access_owner(beach.owner_id, "beach:read_all"):
+        return jsonify({"error": "Access denied"}), 403
 
     # ❗ Инвариант: нельзя удалить, если есть бронирования
     used = (
@@ -0,0 +1,91 @@
+import hmac
+import json
+
+from flask import Blueprint, request, current_app
+
+from app.services.lock_status_service import apply_lock_event, request_lock_status_refresh
+
+ttlock_bp = Blueprint("ttlock", __name__)
+
+
+def _record_types(config_key: str) -> set[int]:
+    raw = current_app.config.get(config_key) or ""
+    return {int(x) for x in raw.split(",") if x.strip().isdigit()}
+
+
+def _lock_date(record: dict) -> int:
+    try:
+        return int(record.get("lockDate") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _parse_records() -> list[dict]:
+    """
+    TTLock шлёт form-data: lockId, notifyType, records (JSON-строка).
+    На всякий случай принимаем и JSON-тело.
+    """
+    data = request.form.to_dict() or (request.get_json(silent=True) or {})
+
+    records = data.get("records") or []
+    if isinstance(records, str):
+        try:
+            records = json.loads(records)
+        except ValueError:
+            records = []
+
+    if not records and data.get("lockId"):
+        records = [data]
+
+    return [r for r in records if isinstance(r, dict)]
+
+
+# ───────────────────────────────
+# TTLock callback (события замков)
+# ───────────────────────────────
+
+@ttlock_bp.route("/callback", methods=["POST"])
+def ttlock_callback():
+    """
+    Обновляет кэш статуса замка сразу по событию:
+      - известный recordType → статус пишем в кэш
+      - остальные → кэш сбрасываем и обновляем в фоне
+    TTLock ждёт в ответ текст "success".
+    """
+    expected = current_app.config.get("TTLOCK_CALLBACK_TOKEN")
+    token = request.args.get("token") or ""
+    if not expected or not hmac.compare_digest(token, expected):
+        return "forbidden", 403
+
+    unlock_types = _record_types("TTLOCK_UNLOCK_RECORD_TYPES")
+    lock_types = _record_types("TTLOCK_LOCK_RECORD_TYPES")
+
+    # последнее событие по каждому замку
+    latest: dict[int, dict] = {}
+    for record in _parse_records():
+        try:
+            lock_id = int(record.get("lockId"))
+        except (TypeError, ValueError):
+            continue
+
+        prev = latest.get(lock_id)
+        if prev is None or _lock_date(record) >= _lock_date(prev):
+            latest[lock_id] = record
+
+    for lock_id, record in latest.items():
+        try:
+            record_type = int(record.get("recordType"))
+        except (TypeError, ValueError):
+            record_type = None
+
+        success = str(record.get("success", "1")) == "1"
+
+        if success and record_type in unlock_types:
+            apply_lock_event(lock_id, locked=False)
+        elif success and record_type in lock_types:
+            apply_lock_event(lock_id, locked=True)
+        else:
+            apply_lock_event(lock_id, locked=None)
+            request_lock_status_refresh(lock_id)
+
+    return "success", 200
@@ -1,8 +1,14 @@
+import base64
+import json
+from datetime import datetime
 from functools import wraps
+
 from flask import jsonify, request
 from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import tuple_
 
 from app.models import User, OwnerLegalInfo
+from app.scope import get_tenant_scope
 
 
 def get_current_user() -> User | None:
@@ -26,15 +32,15 @@ def legal_required(f):
     """
     @wraps(f)
     def w(*args, **kwargs):
-        user = get_current_user()
-        if not user:
+        scope = get_tenant_scope()
+        if not scope:
             return jsonify({"error": "Authentication required"}), 401
 
         # Admin bypass: используем permissions (не role.name)
-        if user.has_perm("booking:read_all"):
+        if scope.is_global:
             return f(*args, **kwargs)
 
-        info = OwnerLegalInfo.query.filter_by(user_id=user.id).first()
+        info = OwnerLegalInfo.query.filter_by(user_id=scope.user_id).first()
         if not info:
             return jsonify({
                 "error": "Legal information required",
@@ -79,3 +85,107 @@ def format_pagination(pagination, data_key="items"):
         "has_next": pagination.has_next,
         "has_prev": pagination.has_prev,
     }
+
+
+# -------------------------------------------------
+# KEYSET (cursor) PAGINATION
+#
+# paginate() выше — OFFSET + COUNT(*) на каждую страницу:
+# чем дальше страница, тем дороже оба запроса.
+# Keyset: WHERE (k1, k2) < (:v1, :v2) ORDER BY k1 DESC, k2 DESC LIMIT n+1 —
+# стоимость страницы не зависит от глубины (индекс по тем же колонкам).
+# Курсор непрозрачный: base64(JSON значений ключа последней строки).
+# -------------------------------------------------
+
+KEYSET_DEFAULT_LIMIT = 50
+KEYSET_MAX_LIMIT = 200
+
+
+class CursorError(ValueError):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(values) -> str:
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = [_decode_value(v) for v in values]
+    except (ValueError, TypeError) as e:
+        raise CursorError("Invalid cursor") from e
+
+    if not isinstance(values, list) or len(values) != size or any(v is None for v in values):
+        raise CursorError("Invalid cursor")
+    return values
+
+
+def keyset_args(
+    default_limit: int = KEYSET_DEFAULT_LIMIT,
+    max_limit: int = KEYSET_MAX_LIMIT,
+    *,
+    unbounded_by_default: bool = False,
+):
+    """
+    ?cursor=&limit= из запроса → (cursor | None, limit | None).
+    unbounded_by_default — без ?cursor и ?limit limit = None (весь список):
+    клиенты, не читающие курсор, получают то же, что и до пагинации.
+    """
+    cursor = request.args.get("cursor") or None
+    limit = request.args.get("limit", type=int)
+
+    if limit is None:
+        if unbounded_by_default and cursor is None:
+            return None, None
+        limit = default_limit
+
+    limit = max(1, min(limit, max_limit))
+    return cursor, limit
+
+
+def keyset_cursor(item, columns) -> str:
+    """Курсор, указывающий на item (значения ключевых колонок)."""
+    return encode_cursor([getattr(item, col.key) for col in columns])
+
+
+def keyset_filter(query, columns, cursor: str | None):
+    """Условие "после курсора" + порядок DESC по ключу (без LIMIT)."""
+    if cursor:
+        values = decode_cursor(cursor, len(columns))
+        query = query.filter(tuple_(*columns) < tuple_(*values))
+    return query.order_by(*[col.desc() for col in columns])
+
+
+def keyset_paginate(query, columns, *, cursor: str | None = None, limit: int | None = KEYSET_DEFAULT_LIMIT):
+    """
+    Одна страница по ключу columns (DESC; последняя колонка — уникальная, обычно id).
+    Колонки ключа — NOT NULL: NULL в курсоре не сравнить.
+    Возвращает (items, next_cursor | None). Без COUNT(*):
+    берём limit + 1 строку, лишняя означает "есть следующая страница".
+    limit=None — все строки после курсора одной страницей.
+    CursorError — битый курсор (→ 400 в route).
+    """
+    if limit is None:
+        return keyset_filter(query, columns, cursor).all(), None
+
+    rows = keyset_filter(query, columns, cursor).limit(limit + 1).all()
+
+    if len(rows) <= limit:
+        return rows, None
+    items = rows[:limit]
+    return items, keyset_cursor(items[-1], columns)
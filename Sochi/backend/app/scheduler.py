@@ -0,0 +1,314 @@
+"""
+Фоновые задачи (APScheduler) + выбор лидера.
+
+Scheduler запускается НЕ в каждом web-процессе, а в отдельном worker'е
+(backend/worker.py). Чтобы при нескольких worker'ах каждая задача
+отрабатывала один раз за тик, задачи выполняет только лидер —
+процесс, удерживающий Postgres advisory lock.
+
+  - lock сессионный: живёт, пока жив выделенный connection
+  - упал лидер → Postgres отпускает lock → следующий standby забирает его
+  - потеряли connection → останавливаем scheduler и снова идём в выборы
+
+Scheduler не критичен для корректности (см. invariants.md),
+поэтому короткое окно без лидера допустимо.
+"""
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import text
+
+from app import db
+
+
+logger = logging.getLogger(__name__)
+
+SCHEDULED_ACTIONS_INTERVAL_SECONDS = 5
+SAFETY_SWEEP_MINUTES = 15
+
+
+# ─────────────────────────────────────────────
+# JOBS
+# ─────────────────────────────────────────────
+
+def _in_context(app, fn):
+    def job():
+        with app.app_context():
+            fn()
+    job.__name__ = fn.__name__
+    return job
+
+
+def register_jobs(scheduler, app) -> None:
+    """
+    Все периодические задачи приложения.
+    coalesce + max_instances=1: пропущенные тики не догоняются пачкой,
+    медленный тик не накладывается на следующий.
+    """
+    from app.config import AUTO_REFUND_CHECK_INTERVAL_SECONDS
+    from app.services.overdue_autorefund_service import auto_refund_overdue_charges
+    from app.services.revenue_rollup_service import rebuild_daily_revenue
+    from app.tasks.booking_autocomplete import auto_complete_bookings
+    from app.tasks.booking_archive import archive_old_bookings
+    from app.tasks.booking_cleanup import cancel_expired_pending_bookings
+    from app.tasks.booking_overdue import process_overdue_bookings
+    from app.tasks.pin_revocations import revoke_pending_pins
+    from app.tasks.scheduled_actions import run_scheduled_actions
+    from app.tasks.webhook_inbox import drain_webhook_inbox
+    from app.utils.time import now_msk
+
+    def revenue_rollup():
+        # страховка от дрейфа инкрементальных upsert'ов: вчера + сегодня
+        rebuild_daily_revenue(date_from=now_msk().date() - timedelta(days=1))
+
+    job_defaults = {
+        "coalesce": True,
+        "max_instances": 1,
+        "replace_existing": True,
+    }
+
+    # ---------- сроки броней (scheduled_actions) ----------
+    # expire_pending / overdue_check / autocomplete_check — только созревшие
+    scheduler.add_job(
+        _in_context(app, run_scheduled_actions),
+        "interval",
+        seconds=SCHEDULED_ACTIONS_INTERVAL_SECONDS,
+        id="scheduled_actions",
+        **job_defaults,
+    )
+
+    # ---------- страховочные сканы ----------
+    # на случай потерянных scheduled_actions (сбой между commit'ами и т.п.)
+
+    # pending → cancelled
+    scheduler.add_job(
+        _in_context(app, cancel_expired_pending_bookings),
+        "interval",
+        minutes=SAFETY_SWEEP_MINUTES,
+        id="booking_cleanup",
+        **job_defaults,
+    )
+
+    # auto complete booking
+    scheduler.add_job(
+        _in_context(app, auto_complete_bookings),
+        "interval",
+        minutes=SAFETY_SWEEP_MINUTES,
+        id="booking_autocomplete",
+        **job_defaults,
+    )
+
+    # overdue booking
+    scheduler.add_job(
+        _in_context(app, process_overdue_bookings),
+        "interval",
+        minutes=SAFETY_SWEEP_MINUTES,
+        id="booking_overdue",
+        **job_defaults,
+    )
+
+    # ---------- autorefund ----------
+    scheduler.add_job(
+        _in_context(app, auto_refund_overdue_charges),
+        "interval",
+        seconds=AUTO_REFUND_CHECK_INTERVAL_SECONDS,
+        id="auto_refund_overdue",
+        **job_defaults,
+    )
+
+    # ---------- YooKassa webhook inbox ----------
+    scheduler.add_job(
+        _in_context(app, drain_webhook_inbox),
+        "interval",
+        seconds=2,
+        id="payment_webhook_inbox",
+        **job_defaults,
+    )
+
+    # ---------- TTLock PIN revocation outbox ----------
+    scheduler.add_job(
+        _in_context(app, revoke_pending_pins),
+        "interval",
+        seconds=5,
+        id="pin_revocations",
+        **job_defaults,
+    )
+
+    # ---------- daily revenue rollup ----------
+    scheduler.add_job(
+        _in_context(app, revenue_rollup),
+        "interval",
+        minutes=30,
+        id="daily_revenue_rollup",
+        **job_defaults,
+    )
+
+    # ---------- archive terminal bookings ----------
+    # ночью по МСК: пик нагрузки — днём
+    scheduler.add_job(
+        _in_context(app, archive_old_bookings),
+        "cron",
+        hour=4,
+        minute=30,
+        timezone="Europe/Moscow",
+        id="booking_archive",
+        **job_defaults,
+    )
+
+
+# ─────────────────────────────────────────────
+# LEADER ELECTION (Postgres advisory lock)
+# ─────────────────────────────────────────────
+
+class LeaderLock:
+    """
+    Сессионный pg_advisory_lock на выделенном connection.
+    Не потокобезопасен — используется одним потоком SchedulerRunner.
+    """
+
+    def __init__(self, engine, key: int):
+        self.engine = engine
+        self.key = key
+        self._conn = None
+
+    def acquire(self) -> bool:
+        """
+        Лидер → проверяем, что connection жив.
+        Не лидер → одна попытка pg_try_advisory_lock.
+        """
+        if self._conn is not None:
+            try:
+                self._conn.execute(text("SELECT 1"))
+                self._conn.commit()
+                return True
+            except Exception:
+                logger.warning("Scheduler leader connection lost")
+                self._drop()
+                return False
+
+        conn = None
+        try:
+            conn = self.engine.connect()
+            acquired = conn.execute(
+                text("SELECT pg_try_advisory_lock(:key)"),
+                {"key": self.key},
+            ).scalar()
+            # autocommit-семантика: не держим транзакцию открытой
+            conn.commit()
+        except Exception as e:
+            logger.warning(f"Scheduler leader election failed: {e}")
+            if conn is not None:
+                conn.invalidate()
+                conn.close()
+            return False
+
+        if not acquired:
+            conn.close()
+            return False
+
+        self._conn = conn
+        return True
+
+    def release(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(
+                text("SELECT pg_advisory_unlock(:key)"),
+                {"key": self.key},
+            )
+            self._conn.commit()
+            self._conn.close()
+        except Exception:
+            self._drop()
+        self._conn = None
+
+    def _drop(self) -> None:
+        # connection мог уже умереть: выкидываем его из пула,
+        # Postgres сам отпустит lock вместе с сессией
+        try:
+            self._conn.invalidate()
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+
+class SchedulerRunner:
+    """
+    Цикл выборов: стали лидером → стартуем scheduler,
+    потеряли лидерство → останавливаем.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.check_interval = app.config["SCHEDULER_LEADER_CHECK_SECONDS"]
+        self._stop = threading.Event()
+        self._scheduler = None
+
+        with app.app_context():
+            engine = db.engine
+        self._lock = LeaderLock(engine, app.config["SCHEDULER_LOCK_KEY"])
+
+    def run_forever(self) -> None:
+        logger.info(f"Scheduler worker started (pid={os.getpid()})")
+        try:
+            while not self._stop.is_set():
+                self._tick()
+                self._stop.wait(self.check_interval)
+        finally:
+            self._step_down()
+            logger.info("Scheduler worker stopped")
+
+    def start_in_background(self) -> threading.Thread:
+        thread = threading.Thread(
+            target=self.run_forever,
+            name="scheduler-leader",
+            daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _tick(self) -> None:
+        is_leader = self._lock.acquire()
+
+        if is_leader and self._scheduler is None:
+            scheduler = BackgroundScheduler(timezone="UTC")
+            register_jobs(scheduler, self.app)
+            scheduler.start()
+            self._scheduler = scheduler
+            logger.info(f"Scheduler leader acquired (pid={os.getpid()})")
+
+        elif not is_leader and self._scheduler is not None:
+            self._step_down()
+
+    def _step_down(self) -> None:
+        if self._scheduler is not None:
+            # ждём текущие задачи: лидерство отдаём только после них
+            self._scheduler.shutdown(wait=True)
+            self._scheduler = None
+            logger.info(f"Scheduler leadership released (pid={os.getpid()})")
+        self._lock.release()
+
+
+def start_scheduler_in_web(app):
+    """
+    Локальная разработка: scheduler в web-процессе (SCHEDULER_IN_WEB=true).
+    Выборы те же, поэтому даже так задача выполняется один раз на кластер.
+    """
+    # ❗ не запускать scheduler дважды при flask debug reload
+    if app.debug and os.environ.get("WERKZEUG_RUN_MAIN") != "true":
+        return None
+
+    runner = SchedulerRunner(app)
+    runner.start_in_background()
+
+    # ❗ сохраняем ссылку, чтобы GC не убил scheduler
+    app.scheduler = runner
+    return runner
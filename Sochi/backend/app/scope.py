@@ -0,0 +1,175 @@
+"""
+Request-scoped tenant scope.
+
+Кто делает запрос и что ему видно — резолвится ОДИН раз на запрос
+и кэшируется в flask.g:
+  - из JWT claims (role + pv), если perm_version в Redis совпадает
+  - иначе один SELECT users JOIN roles
+
+Фильтры owner-scope строятся join'ом по beaches.owner_id,
+без загрузки списка пляжей в Python и без больших IN (...).
+
+Используется:
+- authz.require_perm
+- dashboard / beaches / sunbeds / prices
+"""
+from flask import g, current_app
+from flask_jwt_extended import get_jwt_identity
+
+import app.extensions as ext
+from app import db
+from app.models import User, Role, Beach, Sunbed, Booking
+from app.permissions import permissions_for_role
+
+
+# permission, дающий глобальный (admin) scope
+GLOBAL_SCOPE_PERM = "booking:read_all"
+
+
+class TenantScope:
+    def __init__(self, user_id: int, role_name: str | None):
+        self.user_id = user_id
+        self.role_name = role_name
+
+        try:
+            self.permissions = frozenset(permissions_for_role(role_name)) if role_name else frozenset()
+        except ValueError:
+            self.permissions = frozenset()
+
+    # ────────────────
+    # permissions
+    # ────────────────
+
+    def has_perm(self, perm: str) -> bool:
+        return perm in self.permissions
+
+    @property
+    def is_global(self) -> bool:
+        return self.has_perm(GLOBAL_SCOPE_PERM)
+
+    def can_access_owner(self, owner_id: int, override_perm: str = GLOBAL_SCOPE_PERM) -> bool:
+        """
+        Свой ресурс — всегда; чужой — только при override_perm.
+        """
+        return owner_id == self.user_id or self.has_perm(override_perm)
+
+    # ────────────────
+    # query filters (join-based)
+    # ────────────────
+
+    def filter_beaches(self, query):
+        if self.is_global:
+            return query
+        return query.filter(Beach.owner_id == self.user_id)
+
+    def filter_sunbeds(self, query):
+        if self.is_global:
+            return query
+        return (
+            query
+            .join(Beach, Beach.id == Sunbed.beach_id)
+            .filter(Beach.owner_id == self.user_id)
+        )
+
+    def filter_bookings(self, query):
+        if self.is_global:
+            return query
+        return (
+            query
+            .join(Sunbed, Sunbed.id == Booking.sunbed_id)
+            .join(Beach, Beach.id == Sunbed.beach_id)
+            .filter(Beach.owner_id == self.user_id)
+        )
+
+
+# ───────────────────────────────
+# PERMISSIONS VERSION (stateless mode)
+# ───────────────────────────────
+
+PERM_VERSION_KEY = "authz:pv:{user_id}"
+PERM_VERSION_TTL = 24 * 3600  # секунд
+
+
+def _scope_from_db(user_id: int) -> TenantScope | None:
+    row = (
+        db.session.query(User.id, Role.name, User.perm_version)
+        .outerjoin(Role, Role.id == User.role_id)
+        .filter(User.id == user_id)
+        .first()
+    )
+    if not row:
+        return None
+
+    _remember_perm_version(row.id, row.perm_version)
+    return TenantScope(row.id, row.name)
+
+
+# SET только вверх: версия из более раннего SELECT (параллельный запрос,
+# прочитавший БД до bump'а) не перетирает уже записанную новую
+_PERM_VERSION_MAX_SET = """
+local cur = tonumber(redis.call('GET', KEYS[1]))
+local v = tonumber(ARGV[1])
+if cur and cur > v then
+    return cur
+end
+redis.call('SET', KEYS[1], v, 'EX', ARGV[2])
+return v
+"""
+
+
+def _remember_perm_version(user_id: int, version: int) -> None:
+    if not ext.redis_client:
+        return
+    try:
+        ext.redis_client.eval(
+            _PERM_VERSION_MAX_SET,
+            1,
+            PERM_VERSION_KEY.format(user_id=user_id),
+            int(version or 0),
+            PERM_VERSION_TTL,
+        )
+    except Exception:
+        pass  # Redis не должен ломать авторизацию
+
+
+def _scope_from_claims(current: dict) -> TenantScope | None:
+    """
+    Scope из подписанного JWT identity без обращения к БД.
+
+    Доверяем claims, только если Redis подтверждает, что perm_version
+    не менялся. Нет Redis / нет записи / версия другая → None (идём в БД).
+    """
+    if not current_app.config.get("AUTHZ_STATELESS"):
+        return None
+
+    role_name = current.get("role")
+    version = current.get("pv")
+    if not ext.redis_client or role_name is None or version is None:
+        return None
+
+    try:
+        stored = ext.redis_client.get(PERM_VERSION_KEY.format(user_id=current["id"]))
+    except Exception:
+        return None
+
+    if stored is None or int(stored) != int(version):
+        return None
+
+    return TenantScope(current["id"], role_name)
+
+
+def get_tenant_scope() -> TenantScope | None:
+    """
+    TenantScope текущего запроса (jwt_required должен быть выше по стеку).
+    None — пользователь не найден.
+    """
+    if "tenant_scope" in g:
+        return g.tenant_scope
+
+    current = get_jwt_identity()
+    if not current or "id" not in current:
+        return None
+
+    scope = _scope_from_claims(current) or _scope_from_db(current["id"])
+    g.tenant_scope = scope
+    return scope
@@ -0,0 +1,54 @@
+"""
+Сериализация списков броней без N+1.
+
+Каждый view объявляет, какие relationships ему нужны;
+они загружаются пачкой (joinedload) вместе с основным запросом,
+поэтому число SELECT'ов на список фиксировано и не зависит от числа строк.
+"""
+from sqlalchemy.orm import joinedload
+
+from app.models import Booking, BookingArchive, Sunbed, Beach
+
+
+# =================================================
+# VIEW → RELATIONSHIPS
+# =================================================
+
+BOOKING_VIEWS = {
+    # Booking.to_dict → autopay-флаги (payment_account + payment_method)
+    "default": (
+        joinedload(Booking.payment_account),
+        joinedload(Booking.payment_method),
+    ),
+
+    # история пользователя: город / пляж / лежак
+    "history": (
+        joinedload(Booking.sunbed)
+        .joinedload(Sunbed.beach)
+        .joinedload(Beach.location),
+    ),
+
+    # то же для архива (query по BookingArchive)
+    "archive_history": (
+        joinedload(BookingArchive.sunbed)
+        .joinedload(Sunbed.beach)
+        .joinedload(Beach.location),
+    ),
+}
+
+
+# =================================================
+# PUBLIC API
+# =================================================
+
+def with_booking_view(query, view: str = "default"):
+    """
+    Навешивает на query загрузку relationships нужного view.
+    """
+    if view not in BOOKING_VIEWS:
+        raise ValueError(f"Unknown booking view: {view}")
+    return query.options(*BOOKING_VIEWS[view])
+
+
+def serialize_bookings(bookings) -> list[dict]:
+    return [b.to_dict() for b in bookings]
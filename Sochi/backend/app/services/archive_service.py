@@ -0,0 +1,217 @@
+"""
+Архивация завершённых броней в холодные партиции.
+
+bookings / overdue_charges (живые, горячие индексы)
+    → bookings_archive / overdue_charges_archive
+      (PARTITION BY RANGE, месяц start_time брони)
+
+Переносятся только терминальные строки: completed / cancelled,
+без незавершённых денег (pending / refund_pending / requires_payment)
+и закончившиеся раньше, чем ARCHIVE_AFTER_MONTHS месяцев назад.
+Перенос — один statement на пачку (DELETE ... RETURNING → INSERT),
+строка не может оказаться в двух таблицах или потеряться.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+
+from app import db
+from app.config import ARCHIVE_AFTER_MONTHS
+from app.models import BookingArchive, OverdueChargeArchive
+from app.utils.time import now_utc
+
+
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_MAX_BATCHES = 40            # за один запуск job'а
+ARCHIVE_PARTITIONS_AHEAD = 2        # месяцев вперёд от границы архивации
+
+# (родительская таблица, префикс партиций)
+_PARTITIONED = (
+    ("bookings_archive", "bookings_archive"),
+    ("overdue_charges_archive", "overdue_charges_archive"),
+)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+# ─────────────────────────────────────────────
+# MONTHS
+# ─────────────────────────────────────────────
+
+def _month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def _add_months(d: date, months: int) -> date:
+    index = d.year * 12 + (d.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def archive_cutoff(*, now=None, months: int = ARCHIVE_AFTER_MONTHS) -> datetime:
+    """Граница архивации: начало месяца N месяцев назад (UTC)."""
+    now = now or now_utc()
+    d = _add_months(_month_start(now.date()), -months)
+    return datetime(d.year, d.month, 1, tzinfo=timezone.utc)
+
+
+# ─────────────────────────────────────────────
+# PARTITIONS
+# ─────────────────────────────────────────────
+
+def _partition_name(prefix: str, month: date) -> str:
+    return f"{prefix}_p{month.year:04d}_{month.month:02d}"
+
+
+def ensure_archive_partitions(date_from: date, date_to: date) -> list[str]:
+    """
+    Создаёт недостающие месячные партиции обеих архивных таблиц
+    для месяцев [date_from, date_to] (включительно). Коммитит сам.
+    Возвращает имена созданных партиций.
+    """
+    if date_from > date_to:
+        raise ArchiveError("date_from must be <= date_to")
+
+    existing = {
+        name
+        for (name,) in db.session.execute(text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname IN ('bookings_archive', 'overdue_charges_archive')
+        """))
+    }
+
+    created = []
+    month = _month_start(date_from)
+    last = _month_start(date_to)
+
+    while month <= last:
+        upper = _add_months(month, 1)
+        for parent, prefix in _PARTITIONED:
+            name = _partition_name(prefix, month)
+            if name in existing:
+                continue
+            # имена и границы — из дат, не из пользовательского ввода;
+            # границы — полночь UTC (не зависят от TimeZone сессии)
+            db.session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent} "
+                f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') "
+                f"TO ('{upper.isoformat()} 00:00:00+00')"
+            ))
+            created.append(name)
+        month = upper
+
+    db.session.commit()
+    return created
+
+
+def ensure_upcoming_partitions(*, now=None, months_ahead: int = ARCHIVE_PARTITIONS_AHEAD) -> list[str]:
+    """Партиции заранее: от границы архивации на months_ahead вперёд."""
+    cutoff = archive_cutoff(now=now).date()
+    return ensure_archive_partitions(_add_months(cutoff, -1), _add_months(cutoff, months_ahead))
+
+
+# ─────────────────────────────────────────────
+# ARCHIVE
+# ─────────────────────────────────────────────
+
+# колонки берём из моделей архива — INSERT и модель не разъедутся
+_BOOKING_COLUMNS = [
+    c.name for c in BookingArchive.__table__.columns if c.name != "archived_at"
+]
+_CHARGE_COLUMNS = [
+    c.name for c in OverdueChargeArchive.__table__.columns
+    if c.name not in ("archived_at", "booking_start_time")
+]
+
+_ARCHIVABLE_WHERE = """
+    b.status IN ('completed', 'cancelled')
+    AND b.payment_status IN ('paid', 'failed', 'refunded')
+    AND b.end_time < :cutoff
+    AND NOT EXISTS (
+        SELECT 1
+        FROM overdue_charges oc
+        WHERE oc.booking_id = b.id
+          AND oc.payment_status IN ('pending', 'refund_pending', 'requires_payment')
+    )
+"""
+
+_OLDEST_SQL = text(f"""
+    SELECT MIN(b.start_time)
+    FROM bookings b
+    WHERE {_ARCHIVABLE_WHERE}
+""")
+
+# FK overdue_charges → bookings (NO ACTION) проверяется в конце statement'а,
+# поэтому оба DELETE в одном запросе допустимы
+_MOVE_SQL = text(f"""
+    WITH picked AS (
+        SELECT b.id, b.start_time
+        FROM bookings b
+        WHERE {_ARCHIVABLE_WHERE}
+        ORDER BY b.id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    ),
+    moved_charges AS (
+        DELETE FROM overdue_charges o
+        USING picked p
+        WHERE o.booking_id = p.id
+        RETURNING {", ".join(f"o.{c}" for c in _CHARGE_COLUMNS)}, p.start_time AS booking_start_time
+    ),
+    archived_charges AS (
+        INSERT INTO overdue_charges_archive ({", ".join(_CHARGE_COLUMNS)}, booking_start_time)
+        SELECT {", ".join(_CHARGE_COLUMNS)}, booking_start_time
+        FROM moved_charges
+    ),
+    moved AS (
+        DELETE FROM bookings b
+        USING picked p
+        WHERE b.id = p.id
+        RETURNING {", ".join(f"b.{c}" for c in _BOOKING_COLUMNS)}
+    )
+    INSERT INTO bookings_archive ({", ".join(_BOOKING_COLUMNS)})
+    SELECT {", ".join(_BOOKING_COLUMNS)}
+    FROM moved
+""")
+
+
+def archive_terminal_bookings(
+    *,
+    now=None,
+    months: int = ARCHIVE_AFTER_MONTHS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    max_batches: int = ARCHIVE_MAX_BATCHES,
+) -> int:
+    """
+    Переносит терминальные брони старше months месяцев в архив
+    (вместе с их overdue_charges). Пачками, commit на пачку.
+    Возвращает число перенесённых броней.
+    """
+    cutoff = archive_cutoff(now=now, months=months)
+
+    oldest = db.session.execute(_OLDEST_SQL, {"cutoff": cutoff}).scalar()
+    if oldest is None:
+        db.session.rollback()
+        return 0
+
+    # партиции под весь переносимый диапазон — до переноса,
+    # иначе строки осядут в DEFAULT и помешают создать партицию позже
+    ensure_archive_partitions(oldest.astimezone(timezone.utc).date(), cutoff.date())
+
+    total = 0
+    for _ in range(max_batches):
+        result = db.session.execute(_MOVE_SQL, {"cutoff": cutoff, "limit": batch_size})
+        db.session.commit()
+
+        moved = result.rowcount or 0
+        total += moved
+        if moved < batch_size:
+            break
+
+    return total
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import and_, or_, exists
+
+from app import db
+from app.config import PENDING_TTL_MINUTES
+from app.models import Booking, Sunbed, Price
+from app.utils.time import now_utc, to_utc, MSK
+
+
+class AvailabilityError(Exception):
+    pass
+
+
+# ─────────────────────────────────────────────
+# BUSY PREDICATE
+# ─────────────────────────────────────────────
+
+def busy_booking_clause(start: datetime, end: datetime | None = None, *, now=None):
+    """
+    SQL-условие "бронь занимает лежак в окне [start, end)".
+
+    Та же формула, что и в _has_conflict:
+      - confirmed занимает всегда
+      - pending занимает только в пределах TTL
+    end=None — открытое окно ("с start и дальше").
+    """
+    now = now or now_utc()
+    cutoff = now - timedelta(minutes=PENDING_TTL_MINUTES)
+
+    clauses = [
+        Booking.end_time > start,
+        or_(
+            Booking.status == "confirmed",
+            and_(
+                Booking.status == "pending",
+                Booking.payment_status == "pending",
+                Booking.created_at >= cutoff,
+            ),
+        ),
+    ]
+    if end is not None:
+        clauses.append(Booking.start_time < end)
+
+    return and_(*clauses)
+
+
+# ─────────────────────────────────────────────
+# AVAILABLE SUNBEDS
+# ─────────────────────────────────────────────
+
+def find_available_sunbeds(
+    beach_id: int,
+    *,
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> list[tuple[Sunbed, Price]]:
+    """
+    Свободные лежаки пляжа в окне [start, end) — ОДНИМ запросом.
+
+    - цена подтягивается join'ом (только активные)
+    - занятость — NOT EXISTS по bookings того же лежака,
+      поэтому стоимость не зависит от общего числа броней в системе
+    - start=None → "с текущего момента"
+    """
+    now = now_utc()
+    start = start or now
+
+    if end is not None and end <= start:
+        raise AvailabilityError("Invalid time range")
+
+    busy = exists().where(
+        Booking.sunbed_id == Sunbed.id,
+        busy_booking_clause(start, end, now=now),
+    )
+
+    rows = (
+        db.session.query(Sunbed, Price)
+        .join(Price, Price.id == Sunbed.price_id)
+        .filter(
+            Sunbed.beach_id == beach_id,
+            Price.is_active.is_(True),
+            ~busy,
+        )
+        .order_by(Sunbed.id)
+        .all()
+    )
+
+    return [(sunbed, price) for sunbed, price in rows]
+
+
+# ─────────────────────────────────────────────
+# DAY TIMELINE
+# ─────────────────────────────────────────────
+
+def _merge_intervals(intervals, lo: datetime, hi: datetime) -> list[tuple[datetime, datetime]]:
+    """
+    intervals — отсортированы по start.
+    Обрезает по [lo, hi) и склеивает пересекающиеся / смежные.
+    """
+    merged: list[list[datetime]] = []
+    for start, end in intervals:
+        start = max(start, lo)
+        end = min(end, hi)
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(s, e) for s, e in merged]
+
+
+def _free_intervals(busy, lo: datetime, hi: datetime) -> list[tuple[datetime, datetime]]:
+    free = []
+    cursor = lo
+    for start, end in busy:
+        if start > cursor:
+            free.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < hi:
+        free.append((cursor, hi))
+    return free
+
+
+def build_beach_timeline(beach_id: int, day: date) -> dict:
+    """
+    Свободные / занятые интервалы каждого лежака пляжа за день (MSK).
+
+    Два запроса:
+      1) лежаки пляжа + цена
+      2) занимающие брони за день, отсортированные по (sunbed_id, start_time)
+    Дальше — один проход с merge интервалов, без _has_conflict на слот.
+    """
+    day_start = to_utc(datetime.combine(day, time.min, tzinfo=MSK))
+    day_end = day_start + timedelta(days=1)
+
+    sunbeds = (
+        db.session.query(Sunbed, Price)
+        .outerjoin(Price, Price.id == Sunbed.price_id)
+        .filter(Sunbed.beach_id == beach_id)
+        .order_by(Sunbed.id)
+        .all()
+    )
+
+    bookings = (
+        db.session.query(Booking.sunbed_id, Booking.start_time, Booking.end_time)
+        .join(Sunbed, Sunbed.id == Booking.sunbed_id)
+        .filter(
+            Sunbed.beach_id == beach_id,
+            busy_booking_clause(day_start, day_end),
+        )
+        .order_by(Booking.sunbed_id, Booking.start_time)
+        .all()
+    )
+
+    busy_by_sunbed: dict[int, list[tuple[datetime, datetime]]] = {}
+    for sunbed_id, start, end in bookings:
+        busy_by_sunbed.setdefault(sunbed_id, []).append((start, end))
+
+    timeline = []
+    for sunbed, price in sunbeds:
+        busy = _merge_intervals(busy_by_sunbed.get(sunbed.id, ()), day_start, day_end)
+        timeline.append({
+            "sunbed": sunbed,
+            "price": price,
+            "busy": busy,
+            "free": _free_intervals(busy, day_start, day_end),
+        })
+
+    return {
+        "day_start": day_start,
+        "day_end": day_end,
+        "sunbeds": timeline,
+    }
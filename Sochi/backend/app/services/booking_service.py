@@ -1,19 +1,40 @@
 from __future__ import annotations
 
-from datetime import timedelta
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
 
 from app import db
 from app.config import PENDING_TTL_MINUTES
 from app.models import Booking, Sunbed
-from app.services.ttlock_service import TTLockService, TTLockError
-from app.services.lock_status_service import get_lock_status, LockStatusError
+from app.services.pin_revocation_service import enqueue_pin_revocation
+from app.services.lock_status_service import (
+    get_lock_status,
+    get_lock_status_nowait,
+    LockStatusError,
+    LockStatusPending,
+)
+from app.services.revenue_rollup_service import (
+    record_booking_completed,
+    record_booking_payment_reversed,
+    record_booking_refunded,
+)
+from app.services.scheduled_actions_service import schedule_overdue_check
 from app.utils.time import now_utc
 
 
+EXPIRE_CHUNK_SIZE = 500
+
+
 class BookingServiceError(Exception):
     pass
 
 
+class LockCheckPending(BookingServiceError):
+    """Статус замка ещё не известен — проверка идёт в фоне."""
+    pass
+
+
 # ─────────────────────────────────────────────
 # PENDING TTL
 # ─────────────────────────────────────────────
@@ -34,22 +55,166 @@ def is_pending_active(booking: Booking, *, now=None) -> bool:
     return booking.created_at >= cutoff
 
 
+def expire_pending_booking(booking: Booking, *, now=None) -> bool:
+    """
+    pending → cancelled по TTL (payment_status → failed).
+    False — бронь уже не pending или TTL ещё не истёк.
+    commit делает вызывающий код.
+    """
+    now = now or now_utc()
+
+    if booking.status != "pending" or booking.payment_status != "pending":
+        return False
+
+    if is_pending_active(booking, now=now):
+        return False
+
+    booking.status = "cancelled"
+    booking.payment_status = "failed"
+    booking.updated_at = now
+    clear_access(booking)  # 🔒 на всякий случай
+    return True
+
+
+# один chunk: блокируем (SKIP LOCKED — бронь может как раз оплачиваться),
+# переводим в cancelled и возвращаем СТАРЫЙ ttlock_password_id
+# (RETURNING видит уже обнулённое значение, поэтому берём его из CTE)
+_EXPIRE_PENDING_CHUNK_SQL = text("""
+    WITH expired AS (
+        SELECT id, ttlock_password_id
+        FROM bookings
+        WHERE status = 'pending'
+          AND payment_status = 'pending'
+          AND created_at < :cutoff
+        ORDER BY id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE bookings b
+    SET status = 'cancelled',
+        payment_status = 'failed',
+        updated_at = :now,
+        access_code = NULL,
+        ttlock_password_id = NULL,
+        access_code_valid_from = NULL,
+        access_code_valid_to = NULL
+    FROM expired e
+    WHERE b.id = e.id
+    RETURNING b.id, e.ttlock_password_id, b.sunbed_id
+""")
+
+_DROP_EXPIRE_ACTIONS_SQL = text("""
+    DELETE FROM scheduled_actions
+    WHERE action = 'expire_pending'
+      AND booking_id = ANY(:ids)
+""")
+
+
+def expire_pending_bookings_bulk(*, now=None, chunk_size: int = EXPIRE_CHUNK_SIZE) -> int:
+    """
+    Массовый pending → cancelled по TTL без загрузки ORM-объектов.
+
+    Chunk'и по chunk_size: UPDATE ... RETURNING + commit на каждый,
+    транзакции короткие даже после долгого простоя.
+    В outbox pin_revocations попадают только те немногие брони,
+    где PIN есть.
+    Коммитит сам. Возвращает число отменённых броней.
+    """
+    now = now or now_utc()
+    cutoff = now - timedelta(minutes=PENDING_TTL_MINUTES)
+    total = 0
+
+    while True:
+        rows = db.session.execute(
+            _EXPIRE_PENDING_CHUNK_SQL,
+            {"cutoff": cutoff, "now": now, "limit": chunk_size},
+        ).all()
+
+        if not rows:
+            break
+
+        ids = [booking_id for booking_id, _, _ in rows]
+        # отложенные expire_pending по этим броням больше не нужны
+        db.session.execute(_DROP_EXPIRE_ACTIONS_SQL, {"ids": ids})
+
+        # PIN'ы — в outbox той же транзакцией
+        with_pin = [row for row in rows if row[1]]
+        if with_pin:
+            _revoke_pins(with_pin)
+
+        db.session.commit()
+        total += len(rows)
+
+        if len(rows) < chunk_size:
+            break
+
+    return total
+
+
+def release_expired_pending(sunbed_ids: list[int], start: datetime, end: datetime, *, now=None) -> int:
+    """
+    Отменяет просроченные (по TTL) pending-брони лежаков, пересекающие окно.
+
+    Нужна перед INSERT: exclusion constraint видит pending по статусу,
+    а не по TTL, поэтому "протухший" pending иначе заблокирует слот
+    до прихода booking_cleanup.
+    Один UPDATE, commit делает вызывающий код.
+    """
+    now = now or now_utc()
+    cutoff = now - timedelta(minutes=PENDING_TTL_MINUTES)
+
+    return (
+        Booking.query
+        .filter(
+            Booking.sunbed_id.in_(sunbed_ids),
+            Booking.status == "pending",
+            Booking.payment_status == "pending",
+            Booking.created_at < cutoff,
+            Booking.start_time < end,
+            Booking.end_time > start,
+        )
+        .update(
+            {
+                "status": "cancelled",
+                "payment_status": "failed",
+                "updated_at": now,
+            },
+            synchronize_session=False,
+        )
+    )
+
+
 # ─────────────────────────────────────────────
 # ACCESS CLEANUP
 # ─────────────────────────────────────────────
 
-def clear_access(booking: Booking, *, sunbed: Sunbed | None = None) -> None:
-    sunbed = sunbed or Sunbed.query.get(booking.sunbed_id)
+def _revoke_pins(rows: list[tuple[int, str, int]]) -> None:
+    """rows — (booking_id, ttlock_password_id, sunbed_id); лежаки одним запросом."""
+    sunbeds = {
+        s.id: s
+        for s in Sunbed.query.filter(Sunbed.id.in_({sunbed_id for _, _, sunbed_id in rows})).all()
+    }
+    for booking_id, password_id, sunbed_id in rows:
+        sunbed = sunbeds.get(sunbed_id)
+        if sunbed and sunbed.lock_identifier:
+            enqueue_pin_revocation(sunbed.lock_identifier, password_id, booking_id=booking_id)
 
-    if booking.ttlock_password_id and sunbed and sunbed.lock_identifier:
-        try:
-            TTLockService().delete_pin(
-                int(sunbed.lock_identifier),
+
+def clear_access(booking: Booking, *, sunbed: Sunbed | None = None) -> None:
+    """
+    Снимает доступ с брони. В TTLock не ходит: удаление PIN
+    уходит в outbox pin_revocations и фиксируется тем же commit'ом,
+    что и смена статуса (commit делает вызывающий код).
+    """
+    if booking.ttlock_password_id:
+        # лежак нужен только если есть что удалять
+        sunbed = sunbed or Sunbed.query.get(booking.sunbed_id)
+        if sunbed and sunbed.lock_identifier:
+            enqueue_pin_revocation(
+                sunbed.lock_identifier,
                 booking.ttlock_password_id,
+                booking_id=booking.id,
             )
-        except Exception:
-            # 🔥 НИКОГДА не роняем бизнес-логику из-за замка
-            pass
 
     booking.access_code = None
     booking.ttlock_password_id = None
@@ -93,6 +258,34 @@ def confirm_booking_payment(
 
     db.session.add(booking)
 
+    # следующий срок брони: проверка overdue после end_time + grace
+    schedule_overdue_check(booking)
+
+
+# ─────────────────────────────────────────────
+# REFUND → REFUNDED
+# ─────────────────────────────────────────────
+
+def mark_booking_refunded(booking: Booking) -> bool:
+    """
+    Финальный статус возврата (ставится только webhook'ом).
+    Идемпотентна, commit делает вызывающий код.
+    """
+    if booking.payment_status == "refunded":
+        return False
+
+    now = now_utc()
+    record_booking_payment_reversed(booking)
+
+    booking.payment_status = "refunded"
+    booking.refunded_at = now
+    booking.updated_at = now
+    clear_access(booking)
+    record_booking_refunded(booking)
+
+    db.session.add(booking)
+    return True
+
 
 # ─────────────────────────────────────────────
 # CONFIRMED → COMPLETED
@@ -103,6 +296,7 @@ def try_complete_booking(
     *,
     require_user_request: bool = True,
     force: bool = False,
+    wait_for_lock: bool = True,
 ) -> bool:
     """
     Пытается завершить бронь.
@@ -114,6 +308,8 @@ def try_complete_booking(
     - без force:
         - если есть замок → AND-close
         - если нет замка → только user intent
+    - wait_for_lock=False (web-запросы): статус замка только из кэша,
+      нет в кэше → LockCheckPending, проверка уходит в фон
     - НЕ коммитит транзакцию
     """
 
@@ -149,7 +345,12 @@ def try_complete_booking(
     # ─────────────────────────────
     if has_lock and not force:
         try:
-            status = get_lock_status(int(sunbed.lock_identifier))
+            if wait_for_lock:
+                status = get_lock_status(int(sunbed.lock_identifier))
+            else:
+                status = get_lock_status_nowait(int(sunbed.lock_identifier))
+        except LockStatusPending as e:
+            raise LockCheckPending(str(e))
         except LockStatusError as e:
             raise BookingServiceError(str(e))
 
@@ -173,6 +374,7 @@ def try_complete_booking(
     booking.updated_at = now_utc()
 
     clear_access(booking, sunbed=sunbed)
+    record_booking_completed(booking)
 
     booking.user_requested_close = False
     booking.user_requested_close_at = now_utc()
@@ -0,0 +1,310 @@
+"""
+Потоковая выгрузка финансов (брони, overdue, возвраты) для сверки выплат.
+
+Строки читаются server-side курсором (yield_per → stream_results)
+и сразу сериализуются в CSV / NDJSON: память постоянна,
+сколько бы строк ни было за период. ORM-объекты не создаются —
+только кортежи нужных колонок.
+
+Живые таблицы + архив (archive_service): период может уходить
+глубже ARCHIVE_AFTER_MONTHS.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from app import db
+from app.models import (
+    Beach,
+    Booking,
+    BookingArchive,
+    OverdueCharge,
+    OverdueChargeArchive,
+    Sunbed,
+)
+from app.scope import TenantScope
+from app.utils.time import to_msk
+
+
+EXPORT_YIELD_PER = 1000         # строк на fetch server-side курсора
+EXPORT_FLUSH_ROWS = 500         # строк CSV на один chunk ответа
+
+KIND_BOOKING = "booking"
+KIND_BOOKING_REFUND = "booking_refund"
+KIND_OVERDUE = "overdue"
+KIND_OVERDUE_REFUND = "overdue_refund"
+EXPORT_KINDS = (KIND_BOOKING, KIND_BOOKING_REFUND, KIND_OVERDUE, KIND_OVERDUE_REFUND)
+
+EXPORT_COLUMNS = (
+    "kind",
+    "booking_id",
+    "overdue_id",
+    "sunbed_id",
+    "status",
+    "payment_status",
+    "amount",
+    "payment_id",
+    "refund_id",
+    "booking_start",
+    "booking_end",
+    "event_at",
+)
+
+# брони, по которым реально были деньги
+_PAID_STATUSES = ("paid", "refund_pending", "refunded")
+
+
+class FinanceExportError(Exception):
+    pass
+
+
+# ─────────────────────────────────────────────
+# SCOPE
+# ─────────────────────────────────────────────
+
+def _scope_archive(scope: TenantScope, query, sunbed_id_column):
+    """Тот же owner-scope, что и TenantScope.filter_bookings, для архива (без FK)."""
+    if scope.is_global:
+        return query
+    return (
+        query
+        .join(Sunbed, Sunbed.id == sunbed_id_column)
+        .join(Beach, Beach.id == Sunbed.beach_id)
+        .filter(Beach.owner_id == scope.user_id)
+    )
+
+
+# ─────────────────────────────────────────────
+# QUERIES (kind → запросы live + archive)
+# ─────────────────────────────────────────────
+
+def _booking_queries(scope: TenantScope, start: datetime, end: datetime):
+    live = (
+        scope.filter_bookings(db.session.query(Booking))
+        .filter(
+            Booking.start_time >= start,
+            Booking.start_time < end,
+            Booking.payment_status.in_(_PAID_STATUSES),
+        )
+        .with_entities(
+            Booking.id, Booking.sunbed_id, Booking.status, Booking.payment_status,
+            Booking.total_price, Booking.payment_id,
+            Booking.start_time, Booking.end_time, Booking.start_time.label("event_at"),
+        )
+        .order_by(Booking.start_time, Booking.id)
+    )
+    archived = (
+        _scope_archive(scope, db.session.query(BookingArchive), BookingArchive.sunbed_id)
+        .filter(
+            BookingArchive.start_time >= start,
+            BookingArchive.start_time < end,
+            BookingArchive.payment_status.in_(_PAID_STATUSES),
+        )
+        .with_entities(
+            BookingArchive.id, BookingArchive.sunbed_id, BookingArchive.status,
+            BookingArchive.payment_status, BookingArchive.total_price, BookingArchive.payment_id,
+            BookingArchive.start_time, BookingArchive.end_time,
+            BookingArchive.start_time.label("event_at"),
+        )
+        .order_by(BookingArchive.start_time, BookingArchive.id)
+    )
+    return archived, live
+
+
+def _booking_refund_queries(scope: TenantScope, start: datetime, end: datetime):
+    # день возврата — refunded_at (как в daily_revenue), не updated_at:
+    # поздние записи в бронь не должны переносить возврат между окнами
+    live = (
+        scope.filter_bookings(db.session.query(Booking))
+        .filter(
+            Booking.payment_status == "refunded",
+            Booking.refunded_at >= start,
+            Booking.refunded_at < end,
+        )
+        .with_entities(
+            Booking.id, Booking.sunbed_id, Booking.status, Booking.payment_status,
+            Booking.total_price, Booking.payment_id,
+            Booking.start_time, Booking.end_time, Booking.refunded_at,
+        )
+        .order_by(Booking.refunded_at, Booking.id)
+    )
+    archived = (
+        _scope_archive(scope, db.session.query(BookingArchive), BookingArchive.sunbed_id)
+        .filter(
+            BookingArchive.payment_status == "refunded",
+            BookingArchive.refunded_at >= start,
+            BookingArchive.refunded_at < end,
+        )
+        .with_entities(
+            BookingArchive.id, BookingArchive.sunbed_id, BookingArchive.status,
+            BookingArchive.payment_status, BookingArchive.total_price, BookingArchive.payment_id,
+            BookingArchive.start_time, BookingArchive.end_time, BookingArchive.refunded_at,
+        )
+        .order_by(BookingArchive.refunded_at, BookingArchive.id)
+    )
+    return archived, live
+
+
+def _overdue_queries(scope: TenantScope, start: datetime, end: datetime, *, refunds: bool):
+    # overdue: день списания (created_at); возвраты overdue: refunded_at
+    live_time = OverdueCharge.refunded_at if refunds else OverdueCharge.created_at
+    archive_time = OverdueChargeArchive.refunded_at if refunds else OverdueChargeArchive.created_at
+
+    live = (
+        scope.filter_bookings(
+            db.session.query(OverdueCharge)
+            .join(Booking, Booking.id == OverdueCharge.booking_id)
+        )
+        .filter(live_time >= start, live_time < end)
+    )
+    archived = (
+        _scope_archive(
+            scope,
+            db.session.query(OverdueChargeArchive).join(
+                BookingArchive,
+                (BookingArchive.id == OverdueChargeArchive.booking_id)
+                & (BookingArchive.start_time == OverdueChargeArchive.booking_start_time),
+            ),
+            BookingArchive.sunbed_id,
+        )
+        .filter(archive_time >= start, archive_time < end)
+    )
+    if refunds:
+        live = live.filter(OverdueCharge.payment_status == "refunded")
+        archived = archived.filter(OverdueChargeArchive.payment_status == "refunded")
+
+    live = live.with_entities(
+        Booking.id, OverdueCharge.id, Booking.sunbed_id, Booking.status,
+        OverdueCharge.payment_status, OverdueCharge.amount,
+        OverdueCharge.payment_id, OverdueCharge.refund_id,
+        Booking.start_time, Booking.end_time, live_time,
+    ).order_by(live_time, OverdueCharge.id)
+    archived = archived.with_entities(
+        BookingArchive.id, OverdueChargeArchive.id, BookingArchive.sunbed_id, BookingArchive.status,
+        OverdueChargeArchive.payment_status, OverdueChargeArchive.amount,
+        OverdueChargeArchive.payment_id, OverdueChargeArchive.refund_id,
+        BookingArchive.start_time, BookingArchive.end_time, archive_time,
+    ).order_by(archive_time, OverdueChargeArchive.id)
+    return archived, live
+
+
+# ─────────────────────────────────────────────
+# ROWS
+# ─────────────────────────────────────────────
+
+def _iso(value):
+    return to_msk(value).isoformat() if value else None
+
+
+def _stream(query):
+    # yield_per включает stream_results: server-side курсор, пачками
+    return query.execution_options(yield_per=EXPORT_YIELD_PER)
+
+
+def iter_finance_rows(scope: TenantScope, start: datetime, end: datetime, kinds=EXPORT_KINDS):
+    """
+    Строки выгрузки (dict по EXPORT_COLUMNS) за [start, end) UTC.
+    Порядок: по kind, внутри — по времени события (архив, затем живые).
+
+    Параметры проверяются сразу (FinanceExportError — до начала ответа),
+    строки — лениво.
+    """
+    if start >= end:
+        raise FinanceExportError("Invalid date range")
+
+    unknown = set(kinds) - set(EXPORT_KINDS)
+    if unknown:
+        raise FinanceExportError(f"Unknown export kind: {', '.join(sorted(unknown))}")
+
+    return _iter_rows(scope, start, end, kinds)
+
+
+def _iter_rows(scope: TenantScope, start: datetime, end: datetime, kinds):
+    for kind in EXPORT_KINDS:
+        if kind not in kinds:
+            continue
+
+        if kind in (KIND_BOOKING, KIND_BOOKING_REFUND):
+            queries = (
+                _booking_queries(scope, start, end)
+                if kind == KIND_BOOKING
+                else _booking_refund_queries(scope, start, end)
+            )
+            for query in queries:
+                for (booking_id, sunbed_id, status, payment_status, amount,
+                     payment_id, b_start, b_end, event_at) in _stream(query):
+                    yield {
+                        "kind": kind,
+                        "booking_id": booking_id,
+                        "overdue_id": None,
+                        "sunbed_id": sunbed_id,
+                        "status": status,
+                        "payment_status": payment_status,
+                        "amount": str(amount) if amount is not None else None,
+                        "payment_id": payment_id,
+                        "refund_id": None,
+                        "booking_start": _iso(b_start),
+                        "booking_end": _iso(b_end),
+                        "event_at": _iso(event_at),
+                    }
+            continue
+
+        queries = _overdue_queries(scope, start, end, refunds=kind == KIND_OVERDUE_REFUND)
+        for query in queries:
+            for (booking_id, overdue_id, sunbed_id, status, payment_status, amount,
+                 payment_id, refund_id, b_start, b_end, event_at) in _stream(query):
+                yield {
+                    "kind": kind,
+                    "booking_id": booking_id,
+                    "overdue_id": overdue_id,
+                    "sunbed_id": sunbed_id,
+                    "status": status,
+                    "payment_status": payment_status,
+                    "amount": str(amount) if amount is not None else None,
+                    "payment_id": payment_id,
+                    "refund_id": refund_id,
+                    "booking_start": _iso(b_start),
+                    "booking_end": _iso(b_end),
+                    "event_at": _iso(event_at),
+                }
+
+
+# ─────────────────────────────────────────────
+# FORMATS
+# ─────────────────────────────────────────────
+
+def iter_csv(rows):
+    """CSV чанками по EXPORT_FLUSH_ROWS строк; BOM — чтобы Excel открыл UTF-8."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+
+    buffer.write("\ufeff")
+    writer.writeheader()
+
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= EXPORT_FLUSH_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+
+    yield buffer.getvalue()
+
+
+def iter_ndjson(rows):
+    """NDJSON (строка = JSON-объект), те же чанки, что и у CSV."""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False))
+        if len(lines) >= EXPORT_FLUSH_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+
+    if lines:
+        yield "\n".join(lines) + "\n"
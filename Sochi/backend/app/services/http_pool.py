@@ -0,0 +1,61 @@
+"""
+Общие HTTP-сессии для внешних провайдеров (TTLock, YooKassa).
+
+requests.post / requests.request на каждый вызов открывают новое
+TCP + TLS соединение. Здесь — одна requests.Session на провайдера
+(для YooKassa — на магазин) на процесс: keep-alive и пул соединений
+переиспользуются между запросами и потоками.
+
+  - retry на уровне urllib3 выключен: ретраи делают сами сервисы
+  - после fork (gunicorn --preload) сессии создаются заново,
+    сокеты родителя не переиспользуются
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+HTTP_POOL_CONNECTIONS = 4   # хостов на адаптер
+HTTP_POOL_MAXSIZE = 16      # keep-alive соединений на хост (>= потоков bulk-запросов)
+
+_sessions: dict[tuple, requests.Session] = {}
+_sessions_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=0,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(provider: str, key: str | None = None) -> requests.Session:
+    """
+    Сессия процесса для (provider, key).
+    key — разделение внутри провайдера (например, shop_id YooKassa).
+    """
+    global _sessions_pid
+
+    cache_key = (provider, key)
+
+    with _lock:
+        if _sessions_pid != os.getpid():
+            # мы в дочернем процессе: сессии родителя не трогаем
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+
+        session = _sessions.get(cache_key)
+        if session is None:
+            session = _build_session()
+            _sessions[cache_key] = session
+
+        return session
+
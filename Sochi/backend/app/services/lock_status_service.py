@@ -1,46 +1,426 @@
+"""
+Статус замков TTLock с двухуровневым кэшем.
+
+  L1 — LRU в памяти процесса (короткий TTL, без сети)
+  L2 — Redis (общий для процессов, опционален)
+
+  - в кэше лежит полный статус (JSON), а не только locked/unlocked
+  - ошибки TTLock кэшируются коротко (negative cache): при деградации
+    провайдера каждый тик не бьёт в TTLock заново
+  - одновременные промахи по одному замку в процессе → один запрос (single-flight)
+  - callback TTLock (routes/ttlock.py) обновляет кэш сразу — apply_lock_event
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
 import app.extensions as ext
-from app.services.ttlock_service import TTLockService, TTLockError
+from app.services.ttlock_service import (
+    TTLockService,
+    TTLockError,
+    TTLOCK_BUDGET_INTERACTIVE,
+)
 
-LOCK_STATUS_TTL = 30  # секунд
+LOCK_STATUS_TTL = 30  # секунд — L2 (Redis)
+LOCK_STATUS_LOCAL_TTL = 5  # секунд — L1 (процесс); ограничивает рассинхрон между процессами
+LOCK_STATUS_LOCAL_MAXSIZE = 2048
+LOCK_STATUS_ERROR_TTL = 5  # секунд — negative cache
+LOCK_STATUS_EVENT_TTL = 300  # секунд — статус, пришедший callback'ом
+
+LOCK_STATUS_MAX_WORKERS = 8  # параллельных запросов к TTLock в bulk
+
+LOCK_REFRESH_WORKERS = 2        # фоновых потоков обновления на процесс
+LOCK_REFRESH_DEDUPE_TTL = 15    # секунд — один refresh замка на кластер
+LOCK_REFRESH_RETRY_AFTER = 2    # секунд — подсказка клиенту для poll
+
+LOCK_COALESCE_WAIT = 25  # секунд — потолок ожидания follower'а (не больше его budget)
 
 
 class LockStatusError(Exception):
     pass
 
 
-def get_lock_status(lock_id: int) -> dict:
-    """
-    Возвращает статус замка.
-    Использует Redis как кэш, если он включён.
-    """
+class LockStatusPending(LockStatusError):
+    """Статуса нет в кэше, обновление запущено в фоне — спросите позже."""
+    pass
 
-    cache_key = f"lock:{lock_id}:status"
 
-    # 1️⃣ пробуем Redis (если есть)
-    if ext.redis_client:
-        cached = ext.redis_client.get(cache_key)
-        if cached:
-            return {
-                "locked": cached == "locked",
-                "cached": True
-            }
-
-    # 2️⃣ дергаем TTLock
+# ───────────────────────────────
+# CACHE ENTRIES
+# ───────────────────────────────
+# entry (dict, JSON в Redis):
+#   {"locked": bool, "lockStatus": int | None, "source": "poll" | "callback", "at": epoch}
+#   {"error": str, "at": epoch}  — negative cache
+
+def _cache_key(lock_id: int) -> str:
+    return f"lock:{lock_id}:status"
+
+
+def _entry_from_status(status: dict, source: str = "poll") -> dict:
+    return {
+        "locked": bool(status.get("locked")),
+        "lockStatus": status.get("lockStatus"),
+        "source": source,
+        "at": time.time(),
+    }
+
+
+def _decode(raw) -> dict | None:
+    if not raw:
+        return None
+    # старый формат: "locked" / "unlocked"
+    if raw in ("locked", "unlocked"):
+        return {"locked": raw == "locked", "lockStatus": None, "source": "poll", "at": None}
     try:
-        status = TTLockService().query_status(lock_id=lock_id)
-    except TTLockError as e:
-        raise LockStatusError(str(e))
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+def _status_from_entry(entry: dict) -> dict:
+    """Entry → ответ get_lock_status; negative entry → LockStatusError."""
+    if "error" in entry:
+        raise LockStatusError(entry["error"])
+    return {
+        "locked": entry.get("locked"),
+        "lockStatus": entry.get("lockStatus"),
+        "source": entry.get("source"),
+        "cached": True,
+    }
+
+
+class _LocalCache:
+    """LRU + TTL, потокобезопасный."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, lock_id: int) -> dict | None:
+        with self._lock:
+            item = self._data.get(lock_id)
+            if item is None:
+                return None
+            expires_at, entry = item
+            if expires_at < time.monotonic():
+                del self._data[lock_id]
+                return None
+            self._data.move_to_end(lock_id)
+            return entry
+
+    def set(self, lock_id: int, entry: dict, ttl: float) -> None:
+        with self._lock:
+            self._data[lock_id] = (time.monotonic() + ttl, entry)
+            self._data.move_to_end(lock_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, lock_id: int) -> None:
+        with self._lock:
+            self._data.pop(lock_id, None)
+
+
+_local = _LocalCache(LOCK_STATUS_LOCAL_MAXSIZE)
+
+
+def _read_cached(lock_id: int) -> dict | None:
+    entry = _local.get(lock_id)
+    if entry is not None:
+        return entry
+
+    if not ext.redis_client:
+        return None
+
+    try:
+        raw = ext.redis_client.get(_cache_key(lock_id))
+    except Exception:
+        return None
+
+    entry = _decode(raw)
+    if entry is not None:
+        _local.set(lock_id, entry, LOCK_STATUS_LOCAL_TTL)
+    return entry
+
+
+def _ttl_for(entry: dict) -> int:
+    if "error" in entry:
+        return LOCK_STATUS_ERROR_TTL
+    if entry.get("source") == "callback":
+        return LOCK_STATUS_EVENT_TTL
+    return LOCK_STATUS_TTL
+
+
+def _write_cached(lock_id: int, entry: dict) -> None:
+    ttl = _ttl_for(entry)
+    _local.set(lock_id, entry, min(ttl, LOCK_STATUS_LOCAL_TTL))
 
-    # 3️⃣ сохраняем в Redis (если есть)
     if ext.redis_client:
         try:
-            ext.redis_client.setex(
-                cache_key,
-                LOCK_STATUS_TTL,
-                "locked" if status.get("locked") else "unlocked"
-            )
+            ext.redis_client.setex(_cache_key(lock_id), ttl, json.dumps(entry))
         except Exception:
             pass  # Redis не должен ломать бизнес-логику
 
+
+def invalidate_lock_status(lock_id: int) -> None:
+    lock_id = int(lock_id)
+    _local.delete(lock_id)
+    if ext.redis_client:
+        try:
+            ext.redis_client.delete(_cache_key(lock_id))
+        except Exception:
+            pass
+
+
+# ───────────────────────────────
+# SINGLE-FLIGHT
+# ───────────────────────────────
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry: dict | None = None
+
+
+_flights: dict[int, _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def _fetch_entry(lock_id: int, service: TTLockService) -> dict:
+    """Один запрос к TTLock → entry (ошибка → negative entry)."""
+    try:
+        return _entry_from_status(service.query_status(lock_id=lock_id))
+    except TTLockError as e:
+        return {"error": str(e), "at": time.time()}
+    except Exception as e:
+        # один замок не должен ронять bulk (pool.map пробрасывает исключение)
+        current_app.logger.exception(f"Lock {lock_id} status fetch failed")
+        return {"error": str(e), "at": time.time()}
+
+
+def _coalesced_fetch(lock_id: int, service: TTLockService) -> dict:
+    """
+    Первый промах по замку идёт в TTLock, остальные ждут его результат.
+    Entry записывается в кэш leader'ом.
+    """
+    with _flights_lock:
+        flight = _flights.get(lock_id)
+        leader = flight is None
+        if leader:
+            flight = _Flight()
+            _flights[lock_id] = flight
+
+    if not leader:
+        # follower ждёт не дольше своего бюджета: интерактивный вызов
+        # не должен висеть на фоновом запросе leader'а
+        wait = min(LOCK_COALESCE_WAIT, service.budget)
+        if not flight.done.wait(wait) or flight.entry is None:
+            return {"error": "Lock status request timed out", "at": time.time()}
+        return flight.entry
+
+    try:
+        entry = _fetch_entry(lock_id, service)
+        _write_cached(lock_id, entry)
+        flight.entry = entry
+        return entry
+    finally:
+        with _flights_lock:
+            _flights.pop(lock_id, None)
+        flight.done.set()
+
+
+# ───────────────────────────────
+# PUBLIC API
+# ───────────────────────────────
+
+def get_lock_status(lock_id: int, *, budget: float | None = None) -> dict:
+    """
+    Возвращает статус замка: L1 → L2 → TTLock.
+    budget — бюджет времени на запрос к TTLock (по умолчанию фоновый).
+    """
+    lock_id = int(lock_id)
+
+    entry = _read_cached(lock_id)
+    if entry is not None:
+        return _status_from_entry(entry)
+
+    try:
+        service = TTLockService() if budget is None else TTLockService(budget=budget)
+    except TTLockError as e:
+        raise LockStatusError(str(e))
+
+    status = _status_from_entry(_coalesced_fetch(lock_id, service))
     status["cached"] = False
     return status
+
+
+def get_lock_statuses(lock_ids) -> dict[int, dict]:
+    """
+    Статусы нескольких замков для фоновых задач.
+
+      1) дубли lock_id схлопываются
+      2) L1, затем L2 — одним MGET
+      3) промахи — параллельно (не больше LOCK_STATUS_MAX_WORKERS потоков),
+         через тот же single-flight
+    Возвращает {lock_id: status}. Замки, статус которых получить
+    не удалось (в т.ч. negative cache), в результат НЕ попадают.
+    """
+    ids = list(dict.fromkeys(int(lock_id) for lock_id in lock_ids))
+    if not ids:
+        return {}
+
+    entries: dict[int, dict] = {}
+    misses = []
+    for lock_id in ids:
+        entry = _local.get(lock_id)
+        if entry is not None:
+            entries[lock_id] = entry
+        else:
+            misses.append(lock_id)
+
+    # 1️⃣ Redis
+    if misses and ext.redis_client:
+        try:
+            cached = ext.redis_client.mget([_cache_key(lock_id) for lock_id in misses])
+        except Exception:
+            cached = [None] * len(misses)
+
+        still_missing = []
+        for lock_id, raw in zip(misses, cached):
+            entry = _decode(raw)
+            if entry is None:
+                still_missing.append(lock_id)
+                continue
+            _local.set(lock_id, entry, LOCK_STATUS_LOCAL_TTL)
+            entries[lock_id] = entry
+        misses = still_missing
+
+    # 2️⃣ TTLock (параллельно)
+    if misses:
+        try:
+            service = TTLockService()
+        except TTLockError as e:
+            current_app.logger.warning(f"Lock status bulk skipped: {e}")
+            service = None
+
+        if service is not None:
+            app = current_app._get_current_object()
+
+            def fetch(lock_id: int):
+                # TTLockService пишет в current_app.logger → нужен контекст в потоке
+                with app.app_context():
+                    return lock_id, _coalesced_fetch(lock_id, service)
+
+            workers = min(LOCK_STATUS_MAX_WORKERS, len(misses))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for lock_id, entry in pool.map(fetch, misses):
+                    entries[lock_id] = entry
+
+    result: dict[int, dict] = {}
+    for lock_id, entry in entries.items():
+        if "error" in entry:
+            continue
+        status = _status_from_entry(entry)
+        status["cached"] = lock_id not in misses
+        result[lock_id] = status
+
+    return result
+
+
+# ───────────────────────────────
+# CALLBACK (TTLock → нас)
+# ───────────────────────────────
+
+def apply_lock_event(lock_id: int, *, locked: bool | None) -> None:
+    """
+    Событие замка из callback TTLock.
+      locked известен → пишем статус сразу (длинный TTL: дальше придут события)
+      неизвестен      → сбрасываем кэш, следующий запрос спросит TTLock
+    """
+    lock_id = int(lock_id)
+
+    if locked is None:
+        invalidate_lock_status(lock_id)
+        return
+
+    _write_cached(lock_id, _entry_from_status(
+        {"locked": locked, "lockStatus": 1 if locked else 0},
+        source="callback",
+    ))
+
+
+# ───────────────────────────────
+# NON-BLOCKING (web-запросы)
+# ───────────────────────────────
+
+_refresh_pool = ThreadPoolExecutor(
+    max_workers=LOCK_REFRESH_WORKERS,
+    thread_name_prefix="lock-refresh",
+)
+_refresh_inflight: set[int] = set()
+_refresh_lock = threading.Lock()
+
+
+def _refresh_in_background(app, lock_id: int) -> None:
+    with app.app_context():
+        try:
+            get_lock_status(lock_id)  # фоновый бюджет, пишет в кэш
+        except LockStatusError as e:
+            app.logger.warning(f"Lock {lock_id} background refresh failed: {e}")
+        finally:
+            with _refresh_lock:
+                _refresh_inflight.discard(lock_id)
+
+
+def request_lock_status_refresh(lock_id: int) -> None:
+    """
+    Ставит обновление статуса замка в фоновый пул.
+    Дубли схлопываются: в процессе — set in-flight,
+    между процессами — Redis SET NX на LOCK_REFRESH_DEDUPE_TTL.
+    """
+    lock_id = int(lock_id)
+
+    with _refresh_lock:
+        if lock_id in _refresh_inflight:
+            return
+        _refresh_inflight.add(lock_id)
+
+    try:
+        if ext.redis_client and not ext.redis_client.set(
+            f"lock:{lock_id}:refreshing", "1",
+            nx=True, ex=LOCK_REFRESH_DEDUPE_TTL,
+        ):
+            with _refresh_lock:
+                _refresh_inflight.discard(lock_id)
+            return
+    except Exception:
+        pass  # без дедупликации между процессами — не страшно
+
+    app = current_app._get_current_object()
+    _refresh_pool.submit(_refresh_in_background, app, lock_id)
+
+
+def get_lock_status_nowait(lock_id: int) -> dict:
+    """
+    Для web-запросов: не держит поток на TTLock.
+
+      - есть в кэше (L1 / L2) → статус (negative entry → LockStatusError)
+      - нет → фоновое обновление + LockStatusPending (клиент делает poll)
+      - нет Redis (poll может попасть в другой процесс, где фонового
+        результата нет) → синхронный запрос с интерактивным бюджетом
+    """
+    lock_id = int(lock_id)
+
+    entry = _read_cached(lock_id)
+    if entry is not None:
+        return _status_from_entry(entry)
+
+    if not ext.redis_client:
+        return get_lock_status(lock_id, budget=TTLOCK_BUDGET_INTERACTIVE)
+
+    request_lock_status_refresh(lock_id)
+    raise LockStatusPending("Lock status is being refreshed")
@@ -2,7 +2,7 @@ from datetime import timedelta
 
 from app import db
 from app.models import OverdueCharge, Booking, Sunbed
-from app.services.lock_status_service import get_lock_status, LockStatusError
+from app.services.lock_status_service import get_lock_statuses
 from app.services.overdue_refund_service import refund_overdue_charge
 from app.utils.time import now_utc
 from app.config import OVERDUE_REFUND_GRACE_MINUTES
@@ -16,27 +16,32 @@ def auto_refund_overdue_charges():
     now = now_utc()
     grace = timedelta(minutes=OVERDUE_REFUND_GRACE_MINUTES)
 
-    charges = (
-        OverdueCharge.query
+    rows = (
+        db.session.query(OverdueCharge, Sunbed)
+        .join(Booking, Booking.id == OverdueCharge.booking_id)
+        .join(Sunbed, Sunbed.id == Booking.sunbed_id)
         .filter(
             OverdueCharge.payment_status == "paid",
             OverdueCharge.created_at >= now - grace,
+            Sunbed.has_lock.is_(True),
+            Sunbed.lock_identifier.isnot(None),
         )
         .all()
     )
 
-    for overdue in charges:
-        booking = Booking.query.get(overdue.booking_id)
-        if not booking:
+    candidates = []
+    for overdue, sunbed in rows:
+        try:
+            candidates.append((overdue, int(sunbed.lock_identifier)))
+        except (TypeError, ValueError):
             continue
 
-        sunbed = Sunbed.query.get(booking.sunbed_id)
-        if not sunbed or not sunbed.has_lock or not sunbed.lock_identifier:
-            continue
+    # статусы замков — пачкой (MGET + параллельные запросы к TTLock)
+    statuses = get_lock_statuses(lock_id for _, lock_id in candidates)
 
-        try:
-            status = get_lock_status(int(sunbed.lock_identifier))
-        except LockStatusError:
+    for overdue, lock_id in candidates:
+        status = statuses.get(lock_id)
+        if status is None:
             continue
 
         if status.get("locked") is True:
@@ -1,9 +1,17 @@
 from datetime import timedelta
 from decimal import Decimal
 
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.orm import joinedload
+
 from app import db
 from app.models import Booking, OverdueCharge, Price
-from app.services.lock_status_service import get_lock_status, LockStatusError
+from app.services.lock_status_service import (
+    get_lock_status,
+    get_lock_statuses,
+    LockStatusError,
+)
 from app.services.yookassa_service import YooKassaService, YooKassaServiceError
 from app.config import OVERDUE_REFUND_GRACE_MINUTES
 from app.utils.time import now_utc
@@ -11,27 +19,41 @@ from app.utils.time import now_utc
 # списываем не чаще, чем раз в час
 OVERDUE_INTERVAL = timedelta(hours=1)
 
+# кандидатов на страницу; тик проходит все страницы
+OVERDUE_CANDIDATES_LIMIT = 200
 
-def process_overdue_booking(booking: Booking) -> bool:
+
+def _lock_id(sunbed) -> int | None:
+    if not sunbed or not sunbed.has_lock or not sunbed.lock_identifier:
+        return None
+    try:
+        return int(sunbed.lock_identifier)
+    except (TypeError, ValueError):
+        return None
+
+
+def _overdue_precheck(booking: Booking, now):
     """
-    Обрабатывает одну бронь на предмет overdue.
-    Возвращает True, если выполнено хоть одно действие.
+    Шаги 1–3 + наличие замка: всё, что решается без TTLock.
+    Возвращает sunbed, если нужна проверка замка, иначе None.
     """
 
-    now = now_utc()
-
     # ───────────────────────────────
     # 1. Базовые инварианты
     # ───────────────────────────────
     if booking.status != "confirmed":
-        return False
+        return None
 
     if now <= booking.end_time + timedelta(minutes=OVERDUE_REFUND_GRACE_MINUTES):
-        return False
+        return None
 
     # ───────────────────────────────
     # 2. Rate limit (1 час)
     # ───────────────────────────────
+    # быстрый путь по отметке на брони (без запроса)
+    if booking.last_overdue_charge_at and now - booking.last_overdue_charge_at < OVERDUE_INTERVAL:
+        return None
+
     last = (
         OverdueCharge.query
         .filter_by(booking_id=booking.id)
@@ -40,7 +62,7 @@ def process_overdue_booking(booking: Booking) -> bool:
     )
 
     if last and now - last.created_at < OVERDUE_INTERVAL:
-        return False
+        return None
 
     # ───────────────────────────────
     # 3. Защита от дублей pending
@@ -54,28 +76,219 @@ def process_overdue_booking(booking: Booking) -> bool:
         .first()
     )
     if pending:
+        return None
+
+    sunbed = booking.sunbed
+    if _lock_id(sunbed) is None:
+        return None
+
+    return sunbed
+
+
+def process_overdue_booking(booking: Booking) -> bool:
+    """
+    Обрабатывает одну бронь на предмет overdue.
+    Возвращает True, если выполнено хоть одно действие.
+    """
+
+    now = now_utc()
+
+    sunbed = _overdue_precheck(booking, now)
+    if sunbed is None:
         return False
 
     # ───────────────────────────────
     # 4. Проверка замка
     # ───────────────────────────────
-    sunbed = booking.sunbed
-    if not sunbed or not sunbed.has_lock or not sunbed.lock_identifier:
-        return False
-
     try:
-        status = get_lock_status(int(sunbed.lock_identifier))
+        status = get_lock_status(_lock_id(sunbed))
     except LockStatusError:
         return False
 
+    return _charge_if_unlocked(booking, sunbed, status)
+
+
+def process_overdue_bookings_bulk(bookings) -> int:
+    """
+    То же, что process_overdue_booking для каждой брони,
+    но статусы замков запрашиваются пачкой (get_lock_statuses).
+    Возвращает число броней, по которым выполнено действие.
+    """
+
+    now = now_utc()
+
+    ready = []
+    for booking in bookings:
+        try:
+            sunbed = _overdue_precheck(booking, now)
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception(
+                f"Overdue processing failed for booking {booking.id}"
+            )
+            continue
+        if sunbed is not None:
+            ready.append((booking, sunbed, None))
+
+    return _charge_ready(ready)
+
+
+# ─────────────────────────────────────────────
+# CANDIDATES (один запрос)
+# ─────────────────────────────────────────────
+
+# Шаги 1–3 + замок + цена — в SQL.
+# Partial index idx_booking_overdue_candidates (end_time)
+# WHERE status = 'confirmed' AND lock_closed_confirmed = false
+# отсекает всё, кроме открытых аренд; last_overdue_charge_at отсекает
+# списанные меньше часа назад без обращения к overdue_charges.
+# LATERAL по последнему списанию — страховка, если отметка отстала.
+# Страницы — keyset по (end_time, id): закрытые замки не списываются
+# и остаются кандидатами, OFFSET / "первые N" гоняли бы их по кругу.
+_OVERDUE_CANDIDATES_SQL = text("""
+    SELECT b.id, p.price_per_hour
+    FROM bookings b
+    JOIN sunbeds s ON s.id = b.sunbed_id
+    JOIN prices p ON p.id = s.price_id
+    LEFT JOIN LATERAL (
+        SELECT oc.created_at
+        FROM overdue_charges oc
+        WHERE oc.booking_id = b.id
+        ORDER BY oc.created_at DESC
+        LIMIT 1
+    ) last_charge ON true
+    WHERE b.status = 'confirmed'
+      AND b.lock_closed_confirmed = false
+      AND b.end_time < :ended_before
+      AND (b.last_overdue_charge_at IS NULL OR b.last_overdue_charge_at <= :charged_before)
+      AND (last_charge.created_at IS NULL OR last_charge.created_at <= :charged_before)
+      AND NOT EXISTS (
+          SELECT 1
+          FROM overdue_charges pc
+          WHERE pc.booking_id = b.id
+            AND pc.payment_status = 'pending'
+      )
+      AND s.has_lock
+      AND s.lock_identifier IS NOT NULL
+      AND p.price_per_hour > 0
+      AND (
+          CAST(:after_end AS timestamptz) IS NULL
+          OR (b.end_time, b.id) > (CAST(:after_end AS timestamptz), :after_id)
+      )
+    ORDER BY b.end_time, b.id
+    LIMIT :limit
+""")
+
+
+def select_overdue_candidates(
+    *,
+    now=None,
+    after: tuple | None = None,
+    limit: int = OVERDUE_CANDIDATES_LIMIT,
+) -> list[tuple[Booking, Decimal]]:
+    """
+    Страница броней, по которым пора списывать overdue: [(booking, price_per_hour)]
+    в порядке (end_time, id). after — (end_time, id) последней брони
+    предыдущей страницы.
+    Один SQL-запрос + одна загрузка броней с лежаками.
+    """
+    now = now or now_utc()
+    after_end, after_id = after or (None, None)
+
+    rows = db.session.execute(
+        _OVERDUE_CANDIDATES_SQL,
+        {
+            "ended_before": now - timedelta(minutes=OVERDUE_REFUND_GRACE_MINUTES),
+            "charged_before": now - OVERDUE_INTERVAL,
+            "after_end": after_end,
+            "after_id": after_id,
+            "limit": limit,
+        },
+    ).all()
+
+    if not rows:
+        return []
+
+    prices = dict(rows)
+    bookings = (
+        Booking.query
+        .options(joinedload(Booking.sunbed))
+        .filter(Booking.id.in_(prices.keys()))
+        .order_by(Booking.end_time, Booking.id)
+        .all()
+    )
+    return [(b, prices[b.id]) for b in bookings]
+
+
+def process_overdue_candidates(*, limit: int = OVERDUE_CANDIDATES_LIMIT) -> int:
+    """
+    Тик overdue: стоимость ∝ числу броней, которым пора списывать,
+    а не числу всех просроченных. Проходит все страницы кандидатов —
+    брони с закрытым замком не заслоняют более поздние.
+    Возвращает число броней, по которым выполнено действие.
+    """
+    now = now_utc()
+    after = None
+    done = 0
+
+    while True:
+        page = select_overdue_candidates(now=now, after=after, limit=limit)
+        if not page:
+            break
+
+        # курсор — до обработки: commit / rollback экспайрят объекты
+        last = page[-1][0]
+        after = (last.end_time, last.id)
+
+        ready = [
+            (booking, booking.sunbed, price_per_hour)
+            for booking, price_per_hour in page
+            if _lock_id(booking.sunbed) is not None
+        ]
+        done += _charge_ready(ready)
+
+        if len(page) < limit:
+            break
+
+    return done
+
+
+def _charge_ready(ready: list[tuple]) -> int:
+    """ready — (booking, sunbed, price_per_hour | None); замки — пачкой."""
+    if not ready:
+        return 0
+
+    statuses = get_lock_statuses(_lock_id(sunbed) for _, sunbed, _ in ready)
+
+    done = 0
+    for booking, sunbed, price_per_hour in ready:
+        status = statuses.get(_lock_id(sunbed))
+        if status is None:
+            continue
+
+        try:
+            if _charge_if_unlocked(booking, sunbed, status, price_per_hour=price_per_hour):
+                done += 1
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception(
+                f"Overdue processing failed for booking {booking.id}"
+            )
+
+    return done
+
+
+def _charge_if_unlocked(booking: Booking, sunbed, status: dict, *, price_per_hour=None) -> bool:
     if status.get("locked") is True:
         return False
 
     # ───────────────────────────────
-    # 5. Цена
+    # 5. Цена (кандидаты приходят уже с ценой)
     # ───────────────────────────────
-    price = Price.query.get(sunbed.price_id)
-    if not price or not price.price_per_hour:
+    if price_per_hour is None:
+        price = Price.query.get(sunbed.price_id)
+        price_per_hour = price.price_per_hour if price else None
+    if not price_per_hour:
         return False
 
     # ───────────────────────────────
@@ -84,11 +297,13 @@ def process_overdue_booking(booking: Booking) -> bool:
     overdue = OverdueCharge(
         booking_id=booking.id,
         hours=1,
-        amount=Decimal(price.price_per_hour),
+        amount=Decimal(price_per_hour),
         payment_status="pending",
     )
 
     db.session.add(overdue)
+    # отметка для выборки кандидатов — тем же commit'ом, что и charge
+    booking.last_overdue_charge_at = now_utc()
     db.session.flush()  # нужен overdue.id
 
     # ───────────────────────────────
@@ -0,0 +1,729 @@
+from __future__ import annotations
+
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import app.extensions as ext
+from app import db
+from app.models import (
+    Booking,
+    OverdueCharge,
+    OwnerPaymentAccount,
+    PaymentEvent,
+    UserPaymentMethod,
+)
+from app.services.booking_service import (
+    confirm_booking_payment,
+    clear_access,
+    mark_booking_refunded,
+)
+from app.services.revenue_rollup_service import (
+    record_booking_payment_reversed,
+    record_overdue_paid,
+    record_overdue_refunded,
+)
+from app.services.yookassa_service import YooKassaService
+from app.utils.time import now_utc
+
+
+INBOX_BATCH_SIZE = 100
+INBOX_WORKERS = 4                          # параллельных booking_key
+# backoff 2, 4, … с, дальше раз в INBOX_MAX_BACKOFF: 60 попыток ≈ 2 суток —
+# не меньше окна повторных доставок YooKassa (~сутки), которые теперь
+# отвечаются как duplicate и сами событие не перезапускают
+INBOX_MAX_ATTEMPTS = 60
+INBOX_MAX_BACKOFF = timedelta(hours=1)
+INBOX_STALE_AFTER = timedelta(minutes=5)   # processing дольше → worker умер
+
+DEDUPE_REDIS_KEY = "payment_event:{dedupe_key}"
+DEDUPE_REDIS_TTL = 7 * 24 * 3600           # секунд; YooKassa повторяет доставку до ~суток
+
+
+class PaymentWebhookError(Exception):
+    pass
+
+
+# ─────────────────────────────────────────────
+# INBOX: ПРИЁМ
+# ─────────────────────────────────────────────
+
+def _metadata_booking_ids(metadata: dict) -> list[int]:
+    """
+    booking_ids в metadata группового платежа: "1,2,3"
+    (YooKassa хранит metadata только строками).
+    """
+    raw = metadata.get("booking_ids") or ""
+    try:
+        return [int(x) for x in str(raw).split(",") if x.strip()]
+    except ValueError:
+        return []
+
+
+def event_dedupe_key(event: dict) -> str:
+    """event:object_id:object_status — повторная доставка даёт тот же ключ."""
+    obj = event.get("object") or {}
+    return f"{event.get('event')}:{obj.get('id')}:{obj.get('status')}"
+
+
+def event_idempotence_key(event: dict, action: str) -> str:
+    """
+    Idempotence-Key для запросов в YooKassa из обработки события:
+    повторная обработка того же события (retry inbox, stale reset)
+    даёт тот же ключ → YooKassa не создаст второй refund.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{action}:{event_dedupe_key(event)}"))
+
+
+def event_booking_key(event: dict) -> str:
+    """
+    Ключ упорядочивания: события одной брони (группы, overdue)
+    обрабатываются строго по очереди, разные — параллельно.
+    """
+    obj = event.get("object") or {}
+    metadata = obj.get("metadata") or {}
+    kind = metadata.get("type")
+
+    if kind == "booking" and metadata.get("booking_id"):
+        return f"booking:{metadata['booking_id']}"
+    if kind == "booking_group" and metadata.get("booking_ids"):
+        return "booking_group:" + ",".join(str(i) for i in _metadata_booking_ids(metadata))
+    if kind in ("overdue", "overdue_refund") and metadata.get("overdue_id"):
+        return f"overdue:{metadata['overdue_id']}"
+
+    # refund без metadata — по платежу
+    return f"payment:{obj.get('payment_id') or obj.get('id')}"
+
+
+# ─────────────────────────────────────────────
+# DEDUPE (повторные доставки)
+# ─────────────────────────────────────────────
+
+# один indexed lookup по unique dedupe_key, без ORM и без записи
+_EXISTS_SQL = text("""
+    SELECT 1
+    FROM payment_events
+    WHERE dedupe_key = :dedupe_key
+""")
+
+# аудит повторов (deliveries / last_delivered_at) — только после аутентификации;
+# повторная доставка failed-события возвращает его в очередь
+_REDELIVERY_SQL = text("""
+    UPDATE payment_events
+    SET deliveries = deliveries + 1,
+        last_delivered_at = :now,
+        attempts = CASE WHEN status = 'failed' THEN 0 ELSE attempts END,
+        next_attempt_at = CASE WHEN status = 'failed' THEN :now ELSE next_attempt_at END,
+        status = CASE WHEN status = 'failed' THEN 'pending' ELSE status END
+    WHERE dedupe_key = :dedupe_key
+""")
+
+
+def _remember_event(dedupe_key: str) -> None:
+    """Redis-front: ключ ставится ТОЛЬКО после commit в payment_events."""
+    if not ext.redis_client:
+        return
+    try:
+        ext.redis_client.set(
+            DEDUPE_REDIS_KEY.format(dedupe_key=dedupe_key), "1", ex=DEDUPE_REDIS_TTL
+        )
+    except Exception:
+        pass  # Redis — только ускоритель, источник истины — БД
+
+
+def is_duplicate_event(event: dict) -> bool:
+    """
+    Событие уже есть в inbox?
+      1) Redis EXISTS — без обращения к БД
+      2) SELECT по unique-индексу
+    Только чтение: вызывается ДО аутентификации, поэтому
+    неаутентифицированный запрос ничего не пишет.
+    """
+    dedupe_key = event_dedupe_key(event)
+
+    if ext.redis_client:
+        try:
+            if ext.redis_client.exists(DEDUPE_REDIS_KEY.format(dedupe_key=dedupe_key)):
+                return True
+        except Exception:
+            pass
+
+    row = db.session.execute(_EXISTS_SQL, {"dedupe_key": dedupe_key}).first()
+    if row:
+        _remember_event(dedupe_key)
+        return True
+    return False
+
+
+def record_redelivery(event: dict) -> None:
+    """
+    Повторная доставка аутентифицированного события → счётчик;
+    failed-событие снова уходит в обработку. Коммитит сам.
+    """
+    db.session.execute(
+        _REDELIVERY_SQL, {"now": now_utc(), "dedupe_key": event_dedupe_key(event)}
+    )
+    db.session.commit()
+
+
+def enqueue_payment_event(event: dict, account: OwnerPaymentAccount) -> bool:
+    """
+    Сохраняет событие в inbox. Коммитит сам.
+    False — событие уже было (повторная доставка).
+    """
+    obj = event.get("object") or {}
+    if not event.get("event") or not obj.get("id"):
+        raise PaymentWebhookError("Malformed event")
+
+    stmt = (
+        pg_insert(PaymentEvent.__table__)
+        .values(
+            provider="yookassa",
+            dedupe_key=event_dedupe_key(event),
+            event_type=event["event"],
+            object_id=str(obj["id"]),
+            booking_key=event_booking_key(event),
+            payment_account_id=account.id,
+            payload=event,
+            status="pending",
+            attempts=0,
+            deliveries=1,
+            received_at=now_utc(),
+            last_delivered_at=now_utc(),
+            next_attempt_at=now_utc(),
+        )
+        .on_conflict_do_nothing(index_elements=["dedupe_key"])
+    )
+
+    result = db.session.execute(stmt)
+    db.session.commit()
+
+    _remember_event(event_dedupe_key(event))
+    return result.rowcount == 1
+
+
+# ─────────────────────────────────────────────
+# PROCESSING (бывшее тело yookassa_webhook)
+# ─────────────────────────────────────────────
+
+def _initiate_booking_refund(
+    *,
+    booking: Booking,
+    payment_id: str,
+    account: OwnerPaymentAccount,
+    idempotence_key: str,
+    reason: str | None = None,
+):
+    """
+    ЕДИНАЯ точка инициации refund booking.
+    Неоплаченная (pending) бронь отменяется — лежак освобождается сразу.
+    """
+    record_booking_payment_reversed(booking)
+    if booking.status == "pending":
+        booking.status = "cancelled"
+    booking.payment_status = "refund_pending"
+    booking.updated_at = now_utc()
+    clear_access(booking)
+    db.session.commit()
+
+    svc = YooKassaService(payment_account=account)
+    svc.refund_payment(
+        payment_id,
+        metadata={
+            "type": "booking",
+            "booking_id": booking.id,
+            "payment_account_id": account.id,
+            "reason": reason,
+        },
+        idempotence_key=idempotence_key,
+    )
+
+
+def _initiate_group_refund(
+    *,
+    bookings: list[Booking],
+    payment_id: str,
+    account: OwnerPaymentAccount,
+    idempotence_key: str,
+    reason: str | None = None,
+):
+    """
+    Refund группового платежа целиком (один refund на всю сумму).
+    Ещё pending брони группы отменяются в том же commit.
+    Брони, подтверждённые другим платежом, не трогаются: возвращается
+    только этот платёж, их оплата и доступ остаются как есть.
+    """
+    affected = [
+        b for b in bookings
+        if b.payment_status != "refunded"
+        and (b.status == "pending" or b.payment_id == payment_id)
+    ]
+
+    now = now_utc()
+    for booking in affected:
+        record_booking_payment_reversed(booking)
+        if booking.status == "pending":
+            booking.status = "cancelled"
+        booking.payment_status = "refund_pending"
+        booking.updated_at = now
+        clear_access(booking)
+    db.session.commit()
+
+    svc = YooKassaService(payment_account=account)
+    svc.refund_payment(
+        payment_id,
+        metadata={
+            "type": "booking_group",
+            # refund.succeeded закрывает только их
+            "booking_ids": ",".join(str(b.id) for b in affected),
+            "payment_account_id": account.id,
+            "reason": reason,
+        },
+        idempotence_key=idempotence_key,
+    )
+
+
+def _save_payment_method(obj: dict, user_id: int) -> UserPaymentMethod | None:
+    pm = obj.get("payment_method") or {}
+    if not pm.get("saved") or not pm.get("id"):
+        return None
+
+    card = pm.get("card") or {}
+    method = (
+        UserPaymentMethod.query
+        .filter_by(
+            provider="yookassa",
+            external_id=pm.get("id"),
+            user_id=user_id,
+        )
+        .first()
+    )
+
+    if not method:
+        method = UserPaymentMethod(
+            user_id=user_id,
+            provider="yookassa",
+            external_id=pm.get("id"),
+            card_last4=card.get("last4"),
+            card_brand=card.get("card_type"),
+            is_active=True,
+        )
+        db.session.add(method)
+        db.session.flush()
+
+    return method
+
+
+def process_payment_event(event: dict, account: OwnerPaymentAccount) -> str:
+    """
+    Применяет событие YooKassa. Возвращает результат (для логов / аудита).
+    Коммитит сам; исключение → событие уйдёт на retry.
+    """
+    event_type = event.get("event")
+    obj = event.get("object") or {}
+    metadata = obj.get("metadata") or {}
+
+    # ==================================================
+    # PAYMENT SUCCEEDED
+    # ==================================================
+    if event_type == "payment.succeeded":
+        payment_type = metadata.get("type")
+        payment_id = obj.get("id")
+
+        # ───────────────────────────────
+        # BOOKING PAYMENT
+        # ───────────────────────────────
+        if payment_type == "booking":
+            booking_id = metadata.get("booking_id")
+            booking = Booking.query.get(int(booking_id)) if booking_id else None
+
+            if not booking:
+                return "ignored"
+
+            # уже подтверждена этим платежом (повторная обработка события)
+            if booking.status == "confirmed" and booking.payment_id == payment_id:
+                return "booking_confirmed"
+
+            # возврат этого платежа уже завершён — не откатываем refunded
+            if booking.payment_status == "refunded" and booking.payment_id == payment_id:
+                return "booking_refund_initiated"
+
+            # ❌ late / invalid booking → refund
+            if booking.status != "pending":
+                _initiate_booking_refund(
+                    booking=booking,
+                    payment_id=payment_id,
+                    account=account,
+                    idempotence_key=event_idempotence_key(event, "refund"),
+                    reason="late_or_invalid_booking",
+                )
+                return "booking_refund_initiated"
+
+            # ───────────────────────────────
+            # 🔒 ACCEPT ONLY BANK CARDS
+            # ───────────────────────────────
+            pm = obj.get("payment_method") or {}
+            pm_type = pm.get("type")
+
+            if pm_type != "bank_card":
+                _initiate_booking_refund(
+                    booking=booking,
+                    payment_id=payment_id,
+                    account=account,
+                    idempotence_key=event_idempotence_key(event, "refund"),
+                    reason=f"unsupported_payment_method:{pm_type}",
+                )
+                return "booking_refund_initiated"
+
+            # ───────────────────────────────
+            # 💳 SAVE PAYMENT METHOD
+            # ───────────────────────────────
+            method = _save_payment_method(obj, booking.user_id)
+            if method:
+                booking.payment_method_id = method.id
+
+            # ───────────────────────────────
+            # ✅ CONFIRM BOOKING
+            # ───────────────────────────────
+            confirm_booking_payment(
+                booking,
+                payment_id=payment_id,
+                method="yookassa",
+            )
+            db.session.commit()
+
+            return "booking_confirmed"
+
+        # ───────────────────────────────
+        # GROUP BOOKING PAYMENT
+        # ───────────────────────────────
+        if payment_type == "booking_group":
+            booking_ids = _metadata_booking_ids(metadata)
+            bookings = (
+                Booking.query
+                .filter(Booking.id.in_(booking_ids))
+                .order_by(Booking.id)
+                .all()
+                if booking_ids else []
+            )
+
+            if not bookings:
+                return "ignored"
+
+            # уже подтверждена (повторный webhook)
+            if all(
+                b.status == "confirmed" and b.payment_id == payment_id
+                for b in bookings
+            ) and len(bookings) == len(booking_ids):
+                return "booking_group_confirmed"
+
+            # refund уже прошёл; брони, подтверждённые другим платежом, не в счёт
+            own = [b for b in bookings if b.payment_id == payment_id]
+            if own and all(b.payment_status == "refunded" for b in own):
+                return "booking_group_refund_initiated"
+
+            # ❌ хотя бы одна бронь потеряна / не pending → refund всего платежа
+            if len(bookings) != len(booking_ids) or any(b.status != "pending" for b in bookings):
+                _initiate_group_refund(
+                    bookings=bookings,
+                    payment_id=payment_id,
+                    account=account,
+                    idempotence_key=event_idempotence_key(event, "refund"),
+                    reason="late_or_invalid_booking",
+                )
+                return "booking_group_refund_initiated"
+
+            pm = obj.get("payment_method") or {}
+            pm_type = pm.get("type")
+
+            if pm_type != "bank_card":
+                _initiate_group_refund(
+                    bookings=bookings,
+                    payment_id=payment_id,
+                    account=account,
+                    idempotence_key=event_idempotence_key(event, "refund"),
+                    reason=f"unsupported_payment_method:{pm_type}",
+                )
+                return "booking_group_refund_initiated"
+
+            method = _save_payment_method(obj, bookings[0].user_id)
+
+            for booking in bookings:
+                if method:
+                    booking.payment_method_id = method.id
+                confirm_booking_payment(
+                    booking,
+                    payment_id=payment_id,
+                    method="yookassa",
+                )
+            db.session.commit()
+
+            return "booking_group_confirmed"
+
+        # ───────────────────────────────
+        # OVERDUE PAYMENT
+        # ───────────────────────────────
+        if payment_type == "overdue":
+            overdue_id = metadata.get("overdue_id")
+            overdue = OverdueCharge.query.get(int(overdue_id)) if overdue_id else None
+
+            if overdue and overdue.payment_status != "paid":
+                overdue.payment_status = "paid"
+                overdue.paid_at = now_utc()
+                record_overdue_paid(overdue)
+                db.session.commit()
+
+            return "overdue_paid"
+
+    # ==================================================
+    # REFUND SUCCEEDED
+    # ==================================================
+    if event_type == "refund.succeeded":
+        refund_metadata = obj.get("metadata") or {}
+        refund_type = refund_metadata.get("type")
+        refund_payment_id = obj.get("payment_id")
+
+        # ───────────────────────────────
+        # BOOKING REFUND CONFIRM
+        # ───────────────────────────────
+        if refund_type == "booking":
+            booking_id = refund_metadata.get("booking_id")
+            booking = Booking.query.get(int(booking_id)) if booking_id else None
+
+            if booking and mark_booking_refunded(booking):
+                db.session.commit()
+
+            return "booking_refund_confirmed"
+
+        # ───────────────────────────────
+        # GROUP BOOKING REFUND CONFIRM
+        # ───────────────────────────────
+        if refund_type == "booking_group":
+            booking_ids = _metadata_booking_ids(refund_metadata)
+            bookings = (
+                Booking.query
+                .filter(
+                    Booking.id.in_(booking_ids),
+                    Booking.payment_status == "refund_pending",
+                )
+                .all()
+                if booking_ids else []
+            )
+
+            for booking in bookings:
+                mark_booking_refunded(booking)
+            if bookings:
+                db.session.commit()
+
+            return "booking_group_refund_confirmed"
+
+        # ───────────────────────────────
+        # OVERDUE REFUND CONFIRM
+        # ───────────────────────────────
+        if refund_type == "overdue_refund":
+            overdue_id = refund_metadata.get("overdue_id")
+            overdue = OverdueCharge.query.get(int(overdue_id)) if overdue_id else None
+
+            if overdue and overdue.payment_status != "refunded":
+                overdue.payment_status = "refunded"
+                overdue.refunded_at = now_utc()
+                record_overdue_refunded(overdue)
+                db.session.commit()
+
+            return "overdue_refund_confirmed"
+
+        # ───────────────────────────────
+        # FALLBACK (старые refund без metadata)
+        # ───────────────────────────────
+        if refund_payment_id:
+            # групповой платёж → несколько броней с одним payment_id
+            bookings = Booking.query.filter_by(
+                payment_id=refund_payment_id,
+                payment_status="refund_pending",
+            ).all()
+
+            if bookings:
+                for booking in bookings:
+                    mark_booking_refunded(booking)
+                db.session.commit()
+                return "booking_refund_confirmed_fallback"
+
+            overdue = OverdueCharge.query.filter_by(
+                payment_id=refund_payment_id,
+                payment_status="refund_pending",
+            ).first()
+
+            if overdue:
+                overdue.payment_status = "refunded"
+                overdue.refunded_at = now_utc()
+                record_overdue_refunded(overdue)
+                db.session.commit()
+                return "overdue_refund_confirmed_fallback"
+
+    return "ignored"
+
+
+# ─────────────────────────────────────────────
+# INBOX: ОБРАБОТКА
+# ─────────────────────────────────────────────
+
+_RESET_STALE_SQL = text("""
+    UPDATE payment_events
+    SET status = 'pending', locked_at = NULL
+    WHERE status = 'processing'
+      AND locked_at < :stale_before
+""")
+
+# Событие берём, только если более раннее событие того же booking_key
+# не обрабатывается и не ждёт retry — порядок внутри ключа сохраняется.
+_CLAIM_SQL = text("""
+    WITH picked AS (
+        SELECT e.id
+        FROM payment_events e
+        WHERE e.status = 'pending'
+          AND e.next_attempt_at <= :now
+          AND NOT EXISTS (
+              SELECT 1
+              FROM payment_events p
+              WHERE p.booking_key = e.booking_key
+                AND p.id < e.id
+                AND (
+                    p.status = 'processing'
+                    OR (p.status = 'pending' AND p.next_attempt_at > :now)
+                )
+          )
+        ORDER BY e.id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE payment_events e
+    SET status = 'processing', locked_at = :now
+    FROM picked
+    WHERE e.id = picked.id
+    RETURNING e.id, e.booking_key
+""")
+
+
+def claim_payment_events(limit: int = INBOX_BATCH_SIZE) -> "OrderedDict[str, list[int]]":
+    """
+    Забирает пачку событий (pending → processing). Коммитит сам.
+    Возвращает {booking_key: [event_id, ...]} в порядке id.
+    """
+    now = now_utc()
+
+    db.session.execute(_RESET_STALE_SQL, {"stale_before": now - INBOX_STALE_AFTER})
+    rows = db.session.execute(_CLAIM_SQL, {"now": now, "limit": limit}).all()
+    db.session.commit()
+
+    groups: OrderedDict[str, list[int]] = OrderedDict()
+    for event_id, booking_key in sorted(rows):
+        groups.setdefault(booking_key, []).append(event_id)
+    return groups
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    return min(timedelta(seconds=2 ** attempts), INBOX_MAX_BACKOFF)
+
+
+def _process_one(event_id: int) -> bool:
+    event = PaymentEvent.query.get(event_id)
+    if not event or event.status != "processing":
+        return True
+
+    try:
+        account = OwnerPaymentAccount.query.get(event.payment_account_id)
+        result = process_payment_event(event.payload, account) if account else "ignored"
+
+        event = PaymentEvent.query.get(event_id)
+        event.status = "done"
+        event.result = result[:64]
+        event.processed_at = now_utc()
+        event.last_error = None
+        db.session.commit()
+
+        current_app.logger.info(f"Payment event {event_id}: {result}")
+        return True
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(f"Payment event {event_id} failed")
+
+        event = PaymentEvent.query.get(event_id)
+        event.attempts = (event.attempts or 0) + 1
+        event.last_error = str(e)[:2000]
+        event.locked_at = None
+        event.result = "error"
+        if event.attempts >= INBOX_MAX_ATTEMPTS:
+            event.status = "failed"
+        else:
+            event.status = "pending"
+            event.next_attempt_at = now_utc() + _retry_delay(event.attempts)
+        db.session.commit()
+        return False
+
+
+def requeue_payment_events(event_ids: list[int] | None = None) -> int:
+    """
+    failed → pending (attempts с нуля), сразу в обработку. Коммитит сам.
+    event_ids=None — все failed. Возвращает число событий.
+    """
+    query = PaymentEvent.query.filter(PaymentEvent.status == "failed")
+    if event_ids:
+        query = query.filter(PaymentEvent.id.in_(event_ids))
+
+    count = query.update(
+        {
+            "status": "pending",
+            "attempts": 0,
+            "locked_at": None,
+            "next_attempt_at": now_utc(),
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return count
+
+
+def _release(event_ids: list[int]) -> None:
+    if not event_ids:
+        return
+    (
+        PaymentEvent.query
+        .filter(PaymentEvent.id.in_(event_ids), PaymentEvent.status == "processing")
+        .update({"status": "pending", "locked_at": None}, synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def drain_payment_events(limit: int = INBOX_BATCH_SIZE) -> int:
+    """
+    Одна пачка inbox: booking_key — параллельно (INBOX_WORKERS потоков),
+    события внутри ключа — строго по порядку. Ошибка события
+    останавливает его ключ до retry (остальные события ключа ждут).
+    Возвращает число обработанных событий.
+    """
+    groups = claim_payment_events(limit)
+    if not groups:
+        return 0
+
+    app = current_app._get_current_object()
+
+    def run_group(event_ids: list[int]) -> int:
+        # свой app context → своя сессия БД в потоке
+        with app.app_context():
+            done = 0
+            for i, event_id in enumerate(event_ids):
+                if not _process_one(event_id):
+                    _release(event_ids[i + 1:])
+                    break
+                done += 1
+            return done
+
+    workers = min(INBOX_WORKERS, len(groups))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(run_group, groups.values()))
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db
+from app.models import PinRevocation
+from app.services.ttlock_service import TTLockService, TTLockError
+from app.utils.time import now_utc
+
+
+REVOKE_BATCH_SIZE = 50
+REVOKE_MAX_ATTEMPTS = 12
+REVOKE_MAX_BACKOFF = timedelta(minutes=30)
+REVOKE_STALE_AFTER = timedelta(minutes=5)   # processing дольше → worker умер
+
+
+class PinRevocationError(Exception):
+    pass
+
+
+# ─────────────────────────────────────────────
+# ENQUEUE
+# ─────────────────────────────────────────────
+
+def enqueue_pin_revocation(lock_id, password_id: str, *, booking_id: int | None = None) -> None:
+    """
+    Ставит удаление PIN в outbox.
+    Вызывается в бизнес-транзакции — commit делает вызывающий код,
+    строка появится ровно тогда, когда зафиксирована смена статуса брони.
+    """
+    if not lock_id or not password_id:
+        raise PinRevocationError("lock_id and password_id are required")
+
+    stmt = pg_insert(PinRevocation.__table__).values(
+        lock_id=str(lock_id),
+        password_id=str(password_id),
+        booking_id=booking_id,
+        status="pending",
+        attempts=0,
+        created_at=now_utc(),
+        next_attempt_at=now_utc(),
+    )
+    # тот же PIN уже в очереди — второй раз не нужен
+    stmt = stmt.on_conflict_do_nothing(constraint="uq_pin_revocation")
+    db.session.execute(stmt)
+
+
+# ─────────────────────────────────────────────
+# WORKER
+# ─────────────────────────────────────────────
+
+_RESET_STALE_SQL = text("""
+    UPDATE pin_revocations
+    SET status = 'pending', locked_at = NULL
+    WHERE status = 'processing'
+      AND locked_at < :stale_before
+""")
+
+_CLAIM_SQL = text("""
+    WITH picked AS (
+        SELECT id
+        FROM pin_revocations
+        WHERE status = 'pending'
+          AND next_attempt_at <= :now
+        ORDER BY next_attempt_at, id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE pin_revocations r
+    SET status = 'processing', locked_at = :now
+    FROM picked
+    WHERE r.id = picked.id
+    RETURNING r.id, r.lock_id, r.password_id, r.attempts
+""")
+
+
+def claim_pin_revocations(limit: int = REVOKE_BATCH_SIZE) -> "OrderedDict[str, list[tuple]]":
+    """
+    Забирает пачку (pending → processing). Коммитит сам.
+    Возвращает {lock_id: [(id, password_id, attempts), ...]}.
+    """
+    now = now_utc()
+
+    db.session.execute(_RESET_STALE_SQL, {"stale_before": now - REVOKE_STALE_AFTER})
+    rows = db.session.execute(_CLAIM_SQL, {"now": now, "limit": limit}).all()
+    db.session.commit()
+
+    groups: OrderedDict[str, list[tuple]] = OrderedDict()
+    for item_id, lock_id, password_id, attempts in rows:
+        groups.setdefault(lock_id, []).append((item_id, password_id, attempts))
+    return groups
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    return min(timedelta(seconds=5 * 2 ** attempts), REVOKE_MAX_BACKOFF)
+
+
+def _mark_done(item_id: int) -> None:
+    (
+        PinRevocation.query
+        .filter(PinRevocation.id == item_id)
+        .update(
+            {"status": "done", "processed_at": now_utc(), "locked_at": None, "last_error": None},
+            synchronize_session=False,
+        )
+    )
+    db.session.commit()
+
+
+def _release(items: list[tuple]) -> None:
+    """
+    Не отправленные в TTLock → обратно в pending как есть:
+    attempts и next_attempt_at не меняются (попытки не было).
+    """
+    if not items:
+        return
+    (
+        PinRevocation.query
+        .filter(
+            PinRevocation.id.in_([item_id for item_id, _, _ in items]),
+            PinRevocation.status == "processing",
+        )
+        .update({"status": "pending", "locked_at": None}, synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def _mark_failed(items: list[tuple], error: str) -> None:
+    """Ошибка → pending с backoff (или failed после REVOKE_MAX_ATTEMPTS)."""
+    now = now_utc()
+    for item_id, _, attempts in items:
+        attempts += 1
+        values = {"attempts": attempts, "last_error": error[:2000], "locked_at": None}
+        if attempts >= REVOKE_MAX_ATTEMPTS:
+            values["status"] = "failed"
+            current_app.logger.error(f"PIN revocation {item_id} failed permanently: {error}")
+        else:
+            values["status"] = "pending"
+            values["next_attempt_at"] = now + _retry_delay(attempts)
+        (
+            PinRevocation.query
+            .filter(PinRevocation.id == item_id)
+            .update(values, synchronize_session=False)
+        )
+    db.session.commit()
+
+
+def drain_pin_revocations(limit: int = REVOKE_BATCH_SIZE) -> int:
+    """
+    Одна пачка outbox: PIN'ы одного замка — подряд, одним клиентом.
+    Ошибка по замку: attempt + backoff получает только упавший PIN,
+    остаток пачки замка (замок / gateway, скорее всего, недоступен)
+    возвращается в pending без попытки — и без штрафа: не отправленный
+    PIN не может стать failed, а упавший не держит остальных за собой.
+    Возвращает число удалённых PIN'ов.
+    """
+    groups = claim_pin_revocations(limit)
+    if not groups:
+        return 0
+
+    try:
+        ttlock = TTLockService()
+    except TTLockError as e:
+        # до TTLock не дошли — попыток не было
+        current_app.logger.warning(f"PIN revocations skipped: {e}")
+        for items in groups.values():
+            _release(items)
+        return 0
+
+    done = 0
+    for lock_id, items in groups.items():
+        for i, (item_id, password_id, _) in enumerate(items):
+            try:
+                ttlock.delete_pin(int(lock_id), password_id)
+            except Exception as e:
+                current_app.logger.warning(f"PIN revocation on lock {lock_id} failed: {e}")
+                _mark_failed(items[i:i + 1], str(e))
+                _release(items[i + 1:])
+                break
+            _mark_done(item_id)
+            done += 1
+
+    return done
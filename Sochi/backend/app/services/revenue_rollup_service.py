@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import select, literal, func, text, Date, Integer, Numeric
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db
+from app.models import Beach, Booking, DailyRevenue, OverdueCharge, Sunbed
+from app.utils.time import now_utc, to_msk
+
+
+# ─────────────────────────────────────────────
+# INCREMENTAL UPSERT
+# ─────────────────────────────────────────────
+
+def _record(
+    *,
+    sunbed_id,
+    when: datetime | None,
+    bookings_count: int = 0,
+    gross=0,
+    refunds=0,
+    overdue_income=0,
+) -> None:
+    """
+    Прибавляет дельту к строке (owner, beach, msk_date).
+
+    Один INSERT ... SELECT ... ON CONFLICT DO UPDATE:
+    owner / beach берутся из sunbeds → beaches в том же запросе.
+    commit делает вызывающий код.
+    """
+    msk_date = to_msk(when or now_utc()).date()
+
+    source = (
+        select(
+            Beach.owner_id,
+            Beach.id,
+            literal(msk_date, Date),
+            literal(bookings_count, Integer),
+            literal(Decimal(gross), Numeric(12, 2)),
+            literal(Decimal(refunds), Numeric(12, 2)),
+            literal(Decimal(overdue_income), Numeric(12, 2)),
+            func.now(),
+        )
+        .select_from(Sunbed)
+        .join(Beach, Beach.id == Sunbed.beach_id)
+        .where(Sunbed.id == sunbed_id)
+    )
+
+    stmt = pg_insert(DailyRevenue.__table__).from_select(
+        [
+            "owner_id",
+            "beach_id",
+            "msk_date",
+            "bookings_count",
+            "gross",
+            "refunds",
+            "overdue_income",
+            "updated_at",
+        ],
+        source,
+    )
+
+    table = DailyRevenue.__table__
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_daily_revenue_owner_beach_date",
+        set_={
+            "bookings_count": table.c.bookings_count + stmt.excluded.bookings_count,
+            "gross": table.c.gross + stmt.excluded.gross,
+            "refunds": table.c.refunds + stmt.excluded.refunds,
+            "overdue_income": table.c.overdue_income + stmt.excluded.overdue_income,
+            "updated_at": func.now(),
+        },
+    )
+
+    db.session.execute(stmt)
+
+
+def _sunbed_of_booking(booking_id: int):
+    return (
+        select(Booking.sunbed_id)
+        .where(Booking.id == booking_id)
+        .scalar_subquery()
+    )
+
+
+def record_booking_completed(booking: Booking) -> None:
+    """confirmed → completed: бронь попадает в gross дня завершения."""
+    if booking.payment_status != "paid":
+        return
+
+    _record(
+        sunbed_id=booking.sunbed_id,
+        when=booking.lock_closed_confirmed_at,
+        bookings_count=1,
+        gross=booking.total_price or 0,
+    )
+
+
+def record_booking_payment_reversed(booking: Booking) -> None:
+    """
+    completed + paid уходит из paid (начат возврат): бронь убирается
+    из gross / bookings_count дня завершения. Вызывать ДО смены payment_status.
+    """
+    if booking.status != "completed" or booking.payment_status != "paid":
+        return
+
+    _record(
+        sunbed_id=booking.sunbed_id,
+        when=booking.lock_closed_confirmed_at,
+        bookings_count=-1,
+        gross=-(booking.total_price or 0),
+    )
+
+
+def record_booking_refunded(booking: Booking) -> None:
+    _record(
+        sunbed_id=booking.sunbed_id,
+        when=booking.refunded_at,
+        refunds=booking.total_price or 0,
+    )
+
+
+def record_overdue_paid(overdue: OverdueCharge) -> None:
+    _record(
+        sunbed_id=_sunbed_of_booking(overdue.booking_id),
+        when=overdue.paid_at,
+        overdue_income=overdue.amount or 0,
+    )
+
+
+def record_overdue_refunded(overdue: OverdueCharge) -> None:
+    _record(
+        sunbed_id=_sunbed_of_booking(overdue.booking_id),
+        when=overdue.refunded_at,
+        refunds=overdue.amount or 0,
+    )
+
+
+# ─────────────────────────────────────────────
+# REBUILD
+# ─────────────────────────────────────────────
+
+_RANGE_FILTER = """
+    (CAST(:date_from AS date) IS NULL OR msk_date >= CAST(:date_from AS date))
+    AND (CAST(:date_to AS date) IS NULL OR msk_date <= CAST(:date_to AS date))
+"""
+
+_DELETE_SQL = text(f"DELETE FROM daily_revenue WHERE {_RANGE_FILTER}")
+
+# Живые таблицы + архив (archive_service), иначе пересборка
+# старых дней потеряет перенесённые брони.
+# Те же правила, что и у инкрементальных record_*:
+#   gross          — completed + paid (как total_earned до rollup),
+#                    день = lock_closed_confirmed_at
+#   refunds        — возвраты броней и overdue, день = refunded_at
+#   overdue_income — оплаченные overdue, день = paid_at
+_REBUILD_SQL = text(f"""
+    WITH all_bookings AS (
+        SELECT id, sunbed_id, status, payment_status, total_price,
+               lock_closed_confirmed_at, refunded_at, updated_at
+        FROM bookings
+        UNION ALL
+        SELECT id, sunbed_id, status, payment_status, total_price,
+               lock_closed_confirmed_at, refunded_at, updated_at
+        FROM bookings_archive
+    ),
+    all_overdue AS (
+        SELECT booking_id, amount, payment_status, paid_at, refunded_at
+        FROM overdue_charges
+        UNION ALL
+        SELECT booking_id, amount, payment_status, paid_at, refunded_at
+        FROM overdue_charges_archive
+    ),
+    facts AS (
+        SELECT b.sunbed_id,
+               (COALESCE(b.lock_closed_confirmed_at, b.updated_at)
+                    AT TIME ZONE 'Europe/Moscow')::date AS msk_date,
+               1 AS bookings_count,
+               b.total_price AS gross,
+               0 AS refunds,
+               0 AS overdue_income
+        FROM all_bookings b
+        WHERE b.status = 'completed'
+          AND b.payment_status = 'paid'
+
+        UNION ALL
+
+        SELECT b.sunbed_id,
+               (b.refunded_at AT TIME ZONE 'Europe/Moscow')::date,
+               0, 0, b.total_price, 0
+        FROM all_bookings b
+        WHERE b.refunded_at IS NOT NULL
+          AND b.payment_status = 'refunded'
+
+        UNION ALL
+
+        SELECT b.sunbed_id,
+               (o.paid_at AT TIME ZONE 'Europe/Moscow')::date,
+               0, 0, 0, o.amount
+        FROM all_overdue o
+        JOIN all_bookings b ON b.id = o.booking_id
+        WHERE o.paid_at IS NOT NULL
+          AND o.payment_status IN ('paid', 'refund_pending', 'refunded')
+
+        UNION ALL
+
+        SELECT b.sunbed_id,
+               (o.refunded_at AT TIME ZONE 'Europe/Moscow')::date,
+               0, 0, o.amount, 0
+        FROM all_overdue o
+        JOIN all_bookings b ON b.id = o.booking_id
+        WHERE o.refunded_at IS NOT NULL
+          AND o.payment_status = 'refunded'
+    )
+    INSERT INTO daily_revenue (
+        owner_id, beach_id, msk_date,
+        bookings_count, gross, refunds, overdue_income, updated_at
+    )
+    SELECT be.owner_id,
+           be.id,
+           f.msk_date,
+           SUM(f.bookings_count),
+           SUM(f.gross),
+           SUM(f.refunds),
+           SUM(f.overdue_income),
+           now()
+    FROM facts f
+    JOIN sunbeds s ON s.id = f.sunbed_id
+    JOIN beaches be ON be.id = s.beach_id
+    WHERE {_RANGE_FILTER}
+    GROUP BY be.owner_id, be.id, f.msk_date
+    ON CONFLICT ON CONSTRAINT uq_daily_revenue_owner_beach_date DO UPDATE
+    SET bookings_count = EXCLUDED.bookings_count,
+        gross = EXCLUDED.gross,
+        refunds = EXCLUDED.refunds,
+        overdue_income = EXCLUDED.overdue_income,
+        updated_at = EXCLUDED.updated_at
+""")
+
+
+def rebuild_daily_revenue(
+    *,
+    date_from: date | None = None,
+    date_to: date | None = None,
+) -> int:
+    """
+    Пересобирает rollup за [date_from, date_to] (MSK, включительно).
+    Без границ — вся история. Коммитит сам (одна транзакция).
+    ON CONFLICT — на случай инкрементального upsert между DELETE и INSERT.
+    """
+    params = {"date_from": date_from, "date_to": date_to}
+
+    db.session.execute(_DELETE_SQL, params)
+    result = db.session.execute(_REBUILD_SQL, params)
+    db.session.commit()
+
+    return result.rowcount or 0
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db
+from app.config import PENDING_TTL_MINUTES, OVERDUE_REFUND_GRACE_MINUTES
+from app.models import Booking, ScheduledAction
+from app.utils.time import now_utc
+
+
+ACTION_EXPIRE_PENDING = "expire_pending"
+ACTION_OVERDUE_CHECK = "overdue_check"
+ACTION_AUTOCOMPLETE_CHECK = "autocomplete_check"
+
+POP_BATCH_SIZE = 200
+RETRY_BACKOFF = timedelta(minutes=1)
+
+
+class ScheduledActionError(Exception):
+    pass
+
+
+# ─────────────────────────────────────────────
+# SCHEDULE
+# ─────────────────────────────────────────────
+
+def schedule_action(action: str, booking_id: int, due_at: datetime) -> None:
+    """
+    Ставит (или переносит) действие по брони на due_at.
+    Upsert по (action, booking_id). commit делает вызывающий код.
+    """
+    if booking_id is None:
+        raise ScheduledActionError("booking_id is required (flush booking first)")
+
+    stmt = pg_insert(ScheduledAction.__table__).values(
+        action=action,
+        booking_id=booking_id,
+        due_at=due_at,
+        attempts=0,
+        created_at=now_utc(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_scheduled_action_booking",
+        set_={"due_at": stmt.excluded.due_at, "attempts": 0},
+    )
+    db.session.execute(stmt)
+
+
+def schedule_pending_expiry(booking: Booking) -> None:
+    created_at = booking.created_at or now_utc()
+    schedule_action(
+        ACTION_EXPIRE_PENDING,
+        booking.id,
+        created_at + timedelta(minutes=PENDING_TTL_MINUTES),
+    )
+
+
+def schedule_overdue_check(booking: Booking, *, at: datetime | None = None) -> None:
+    # тот же порог, что и в process_overdue_booking: end_time + grace
+    due = at or booking.end_time + timedelta(minutes=OVERDUE_REFUND_GRACE_MINUTES)
+    schedule_action(ACTION_OVERDUE_CHECK, booking.id, due)
+
+
+def schedule_autocomplete_check(booking: Booking, *, delay: timedelta = timedelta(seconds=5)) -> None:
+    schedule_action(ACTION_AUTOCOMPLETE_CHECK, booking.id, now_utc() + delay)
+
+
+# ─────────────────────────────────────────────
+# POP
+# ─────────────────────────────────────────────
+
+# созревшие строки забираются и удаляются одним запросом;
+# SKIP LOCKED — на случай второго worker'а (leader не успел сменить)
+_POP_SQL = text("""
+    DELETE FROM scheduled_actions
+    WHERE id IN (
+        SELECT id
+        FROM scheduled_actions
+        WHERE due_at <= :now
+        ORDER BY due_at
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING action, booking_id, attempts
+""")
+
+
+def pop_due_actions(limit: int = POP_BATCH_SIZE) -> list[tuple[str, int, int]]:
+    """
+    Забирает созревшие действия. Коммитит сам.
+    Упавшее действие вызывающий код возвращает через retry_action.
+    """
+    rows = db.session.execute(_POP_SQL, {"now": now_utc(), "limit": limit}).all()
+    db.session.commit()
+    return [(action, booking_id, attempts) for action, booking_id, attempts in rows]
+
+
+def retry_action(action: str, booking_id: int, attempts: int) -> None:
+    """Повтор с линейным backoff. commit делает вызывающий код."""
+    stmt = pg_insert(ScheduledAction.__table__).values(
+        action=action,
+        booking_id=booking_id,
+        due_at=now_utc() + RETRY_BACKOFF * (attempts + 1),
+        attempts=attempts + 1,
+        created_at=now_utc(),
+    )
+    stmt = stmt.on_conflict_do_nothing(constraint="uq_scheduled_action_booking")
+    db.session.execute(stmt)
@@ -2,7 +2,8 @@ import time
 import random
 import requests
 from flask import current_app
-import app.extensions as ext
+from app.services.http_pool import get_session
+from app.utils.rate_limit import allow_sliding_window, CircuitBreaker
 
 
 # ───────────────────────────────
@@ -13,11 +14,22 @@ TTLOCK_TIMEOUT = 5               # seconds
 TTLOCK_MAX_RETRIES = 3
 TTLOCK_BACKOFF = 1.5
 
+# общий бюджет времени на вызов (все попытки + паузы)
+TTLOCK_BUDGET_INTERACTIVE = 3    # seconds — внутри HTTP-запроса пользователя
+TTLOCK_BUDGET_BACKGROUND = 20    # seconds — worker / фоновые потоки
+TTLOCK_MIN_ATTEMPT_TIMEOUT = 0.5 # seconds — меньше нет смысла начинать попытку
+
 TTLOCK_RATE_LIMIT = 20           # requests
 TTLOCK_RATE_WINDOW = 60          # seconds
 
-TTLOCK_CIRCUIT_KEY = "circuit:ttlock"
-TTLOCK_CIRCUIT_TTL = 60          # seconds
+TTLOCK_CIRCUIT_FAILURES = 5     # неудачных попыток подряд → open
+TTLOCK_CIRCUIT_TTL = 60          # seconds до half-open пробы
+
+_circuit = CircuitBreaker(
+    "ttlock",
+    failure_threshold=TTLOCK_CIRCUIT_FAILURES,
+    recovery_seconds=TTLOCK_CIRCUIT_TTL,
+)
 
 
 # ───────────────────────────────
@@ -25,6 +37,13 @@ TTLOCK_CIRCUIT_TTL = 60          # seconds
 # ───────────────────────────────
 
 class TTLockError(Exception):
+    def __init__(self, message: str = "", *, errcode=None):
+        super().__init__(message)
+        self.errcode = errcode  # errcode TTLock, если ошибку вернул API
+
+
+class TTLockDeadlineExceeded(TTLockError):
+    """Бюджет времени вызова исчерпан — ретраи прерваны досрочно."""
     pass
 
 
@@ -38,11 +57,16 @@ class TTLockService:
     Safe version with:
       - timeout
       - retry + backoff
+      - deadline: общий бюджет времени на вызов
       - rate limit
       - circuit breaker
+
+    budget — секунды на весь вызов (все попытки + паузы).
+    В web-запросах — TTLOCK_BUDGET_INTERACTIVE, в фоне — BACKGROUND.
     """
 
-    def __init__(self):
+    def __init__(self, *, budget: float = TTLOCK_BUDGET_BACKGROUND):
+        self.budget = budget
         self.client_id = current_app.config.get("TTLOCK_CLIENT_ID")
         self.access_token = current_app.config.get("TTLOCK_ACCESS_TOKEN")
         self.base_url = current_app.config.get(
@@ -70,35 +94,41 @@ class TTLockService:
     def _request(self, method: str, endpoint: str, payload: dict) -> dict:
         url = f"{self.base_url}{endpoint}"
 
-        # ── circuit breaker
-        if ext.redis_client and ext.redis_client.get(TTLOCK_CIRCUIT_KEY):
+        # ── circuit breaker (open / half-open проба)
+        if not _circuit.allow():
             raise TTLockError("TTLock circuit breaker is open")
 
-        # ── rate limit
-        if ext.redis_client:
-            key = "ratelimit:ttlock"
-            count = ext.redis_client.incr(key)
-            if count == 1:
-                ext.redis_client.expire(key, TTLOCK_RATE_WINDOW)
-            if count > TTLOCK_RATE_LIMIT:
-                raise TTLockError("TTLock rate limit exceeded")
+        # ── rate limit (скользящее окно, атомарно)
+        if not allow_sliding_window("ratelimit:ttlock", TTLOCK_RATE_LIMIT, TTLOCK_RATE_WINDOW):
+            raise TTLockError("TTLock rate limit exceeded")
 
+        deadline = time.monotonic() + self.budget
         delay = 1
 
         for attempt in range(1, TTLOCK_MAX_RETRIES + 1):
+            # попытка не дольше, чем осталось от бюджета
+            remaining = deadline - time.monotonic()
+            if remaining < TTLOCK_MIN_ATTEMPT_TIMEOUT:
+                raise TTLockDeadlineExceeded("TTLock deadline exceeded")
+
             try:
-                resp = requests.request(
+                resp = get_session("ttlock").request(
                     method=method,
                     url=url,
                     data=payload,
-                    timeout=TTLOCK_TIMEOUT,
+                    timeout=min(TTLOCK_TIMEOUT, remaining),
                 )
+                if resp.status_code >= 500:
+                    _circuit.record_failure()
+                else:
+                    _circuit.record_success()
                 resp.raise_for_status()
                 data = resp.json()
 
                 if data.get("errcode") != 0:
                     raise TTLockError(
-                        f"{data.get('errcode')}: {data.get('errmsg')}"
+                        f"{data.get('errcode')}: {data.get('errmsg')}",
+                        errcode=data.get("errcode"),
                     )
 
                 return data
@@ -108,18 +138,34 @@ class TTLockService:
                     f"TTLock timeout (attempt {attempt}/{TTLOCK_MAX_RETRIES})"
                 )
 
+                # каждая неудачная попытка — в breaker (а не только весь цикл)
+                _circuit.record_failure()
+
                 if attempt == TTLOCK_MAX_RETRIES:
-                    if ext.redis_client:
-                        ext.redis_client.setex(
-                            TTLOCK_CIRCUIT_KEY,
-                            TTLOCK_CIRCUIT_TTL,
-                            "1"
-                        )
                     raise TTLockError("TTLock unavailable") from e
 
+                if not _circuit.allow():
+                    raise TTLockError("TTLock circuit breaker is open") from e
+
+                # early abort: пауза + следующая попытка не влезают в бюджет
+                if deadline - time.monotonic() < delay + TTLOCK_MIN_ATTEMPT_TIMEOUT:
+                    raise TTLockDeadlineExceeded("TTLock deadline exceeded") from e
+
                 time.sleep(delay)
                 delay *= TTLOCK_BACKOFF
 
+            # 4xx / не-JSON / прочие ошибки requests — тоже TTLockError:
+            # вызывающий код (bulk-статусы, web) ловит только его
+            except requests.HTTPError as e:
+                raise TTLockError(f"TTLock HTTP error: {e}") from e
+
+            except ValueError as e:
+                raise TTLockError("TTLock returned invalid JSON") from e
+
+            except requests.RequestException as e:
+                _circuit.record_failure()
+                raise TTLockError(f"TTLock request failed: {e}") from e
+
     # ───────────────────────────────
     # PUBLIC API
     # ───────────────────────────────
@@ -157,7 +203,21 @@ class TTLockService:
 
         raise TTLockError("Failed to generate unique PIN")
 
+    def _pin_not_found_errcodes(self) -> set[int]:
+        raw = current_app.config.get("TTLOCK_PIN_NOT_FOUND_ERRCODES") or ""
+        codes = set()
+        for x in raw.split(","):
+            try:
+                codes.add(int(x))
+            except ValueError:
+                continue
+        return codes
+
     def delete_pin(self, lock_id: int, password_id: str) -> bool:
+        """
+        True — PIN удалён; False — на замке его уже нет (удалён раньше):
+        для вызывающего кода результат тот же.
+        """
         payload = {
             "clientId": self.client_id,
             "accessToken": self.access_token,
@@ -166,11 +226,16 @@ class TTLockService:
             "date": self._now_ms(),
         }
 
-        self._request(
-            "POST",
-            "/v3/keyboardPwd/delete",
-            payload
-        )
+        try:
+            self._request(
+                "POST",
+                "/v3/keyboardPwd/delete",
+                payload
+            )
+        except TTLockError as e:
+            if e.errcode is not None and e.errcode in self._pin_not_found_errcodes():
+                return False
+            raise
         return True
 
     def query_status(self, lock_id: int) -> dict:
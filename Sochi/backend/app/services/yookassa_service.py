@@ -6,6 +6,18 @@ from typing import Optional
 from flask import current_app
 
 from app.models import OwnerPaymentAccount
+from app.services.http_pool import get_session
+from app.utils.rate_limit import allow_token_bucket, CircuitBreaker
+
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+YOOKASSA_RATE_PER_SECOND = 10    # запросов в секунду на магазин
+YOOKASSA_RATE_BURST = 20
+
+_circuit = CircuitBreaker("yookassa", failure_threshold=5, recovery_seconds=30)
 
 
 # ============================================================
@@ -27,6 +39,7 @@ class YooKassaService:
     ❌ НЕ использует yookassa.Configuration
     ❌ НЕ имеет глобального состояния
     ✅ per-request Basic Auth
+    ✅ keep-alive: общая Session на магазин (http_pool)
     ✅ Idempotence-Key на каждый запрос
     """
 
@@ -47,6 +60,7 @@ class YooKassaService:
             payment_account.shop_id,
             payment_account.secret_key,
         )
+        self.session = get_session("yookassa", str(payment_account.shop_id))
 
     # --------------------------------------------------------
     # INTERNAL
@@ -60,20 +74,36 @@ class YooKassaService:
             headers["Idempotence-Key"] = idem_key
         return headers
 
-    def _post(self, path: str, payload: dict) -> dict:
-        idem_key = str(uuid.uuid4())
+    def _send(self, method: str, path: str, **kwargs) -> dict:
+        # ── circuit breaker (общий на провайдера)
+        if not _circuit.allow():
+            raise YooKassaServiceError("YooKassa circuit breaker is open")
+
+        # ── rate limit (token bucket на магазин)
+        if not allow_token_bucket(
+            f"ratelimit:yookassa:{self.account.shop_id}",
+            YOOKASSA_RATE_PER_SECOND,
+            YOOKASSA_RATE_BURST,
+        ):
+            raise YooKassaServiceError("YooKassa rate limit exceeded")
 
         try:
-            resp = requests.post(
+            resp = self.session.request(
+                method,
                 f"{self.BASE_URL}{path}",
-                json=payload,
                 auth=self.auth,
-                headers=self._headers(idem_key=idem_key),
                 timeout=10,
+                **kwargs,
             )
         except requests.RequestException as e:
+            _circuit.record_failure()
             raise YooKassaServiceError(f"Network error: {e}") from e
 
+        if resp.status_code >= 500:
+            _circuit.record_failure()
+        else:
+            _circuit.record_success()
+
         if not resp.ok:
             raise YooKassaServiceError(
                 f"YooKassa error {resp.status_code}: {resp.text}"
@@ -81,22 +111,19 @@ class YooKassaService:
 
         return resp.json()
 
-    def _get(self, path: str) -> dict:
-        try:
-            resp = requests.get(
-                f"{self.BASE_URL}{path}",
-                auth=self.auth,
-                timeout=10,
-            )
-        except requests.RequestException as e:
-            raise YooKassaServiceError(f"Network error: {e}") from e
+    def _post(self, path: str, payload: dict, *, idem_key: Optional[str] = None) -> dict:
+        # стабильный ключ от вызывающего → повтор не создаст второй объект
+        idem_key = idem_key or str(uuid.uuid4())
 
-        if not resp.ok:
-            raise YooKassaServiceError(
-                f"YooKassa error {resp.status_code}: {resp.text}"
-            )
+        return self._send(
+            "POST",
+            path,
+            json=payload,
+            headers=self._headers(idem_key=idem_key),
+        )
 
-        return resp.json()
+    def _get(self, path: str) -> dict:
+        return self._send("GET", path)
 
     # --------------------------------------------------------
     # PAYMENTS
@@ -158,6 +185,7 @@ class YooKassaService:
         payment_id: str,
         *,
         metadata: dict,
+        idempotence_key: Optional[str] = None,
     ) -> dict:
         if not payment_id:
             raise YooKassaServiceError("payment_id is required")
@@ -181,4 +209,4 @@ class YooKassaService:
             "metadata": metadata,
         }
 
-        return self._post("/refunds", payload)
+        return self._post("/refunds", payload, idem_key=idempotence_key)
@@ -0,0 +1,18 @@
+from flask import current_app
+
+from app.services.archive_service import archive_terminal_bookings, ensure_upcoming_partitions
+
+
+def archive_old_bookings():
+    """
+    Periodic job (scheduler, раз в сутки):
+
+    1. заранее создаёт месячные партиции архива
+    2. переносит терминальные брони старше ARCHIVE_AFTER_MONTHS
+       в bookings_archive (пачками)
+    """
+    ensure_upcoming_partitions()
+
+    moved = archive_terminal_bookings()
+    if moved:
+        current_app.logger.info(f"Archived {moved} bookings")
@@ -1,13 +1,17 @@
+from sqlalchemy import false, true
+
 from app.models import Booking
 from app.services.booking_service import try_complete_booking, BookingServiceError
 from app import db
 
 
 def auto_complete_bookings():
+    # "= true / = false", а не "IS": так planner сопоставит условие
+    # с partial index idx_booking_close_requested
     bookings = Booking.query.filter(
         Booking.status == "confirmed",
-        Booking.user_requested_close.is_(True),
-        Booking.lock_closed_confirmed.is_(False)
+        Booking.user_requested_close == true(),
+        Booking.lock_closed_confirmed == false()
     ).all()
 
     for booking in bookings:
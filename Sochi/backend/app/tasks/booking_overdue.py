@@ -1,7 +1,4 @@
-from app.models import Booking
-from app.services.overdue_service import process_overdue_booking
-from app.utils.time import now_utc
-from flask import current_app
+from app.services.overdue_service import process_overdue_candidates
 
 
 def process_overdue_bookings():
@@ -12,25 +9,9 @@ def process_overdue_bookings():
       - are confirmed (active rent)
       - have end_time in the past
       - are not completed
-    """
-
-    now = now_utc()
-
-    bookings = Booking.query.filter(
-        Booking.status == "confirmed",
-        Booking.end_time < now,
-        Booking.lock_closed_confirmed.is_(False),  # 🔒 КЛЮЧЕВОЕ
-    ).all()
+      - were not charged within the last hour
 
-    print(bookings)
-
-    if not bookings:
-        return
-
-    for booking in bookings:
-        try:
-            process_overdue_booking(booking)
-        except Exception:
-            current_app.logger.exception(
-                f"Overdue processing failed for booking {booking.id}"
-            )
+    Кандидаты выбираются одним запросом (см. select_overdue_candidates),
+    статусы замков — пачкой.
+    """
+    process_overdue_candidates()
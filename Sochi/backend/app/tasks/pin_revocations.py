@@ -0,0 +1,13 @@
+from app.services.pin_revocation_service import drain_pin_revocations, REVOKE_BATCH_SIZE
+
+
+def revoke_pending_pins():
+    """
+    Periodic job (scheduler):
+
+    Удаляет PIN-коды TTLock из outbox (pin_revocations),
+    пока очередь не опустеет или не пройдёт несколько пачек.
+    """
+    for _ in range(5):
+        if drain_pin_revocations() < REVOKE_BATCH_SIZE:
+            return
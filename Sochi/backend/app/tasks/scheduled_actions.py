@@ -0,0 +1,117 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.models import Booking
+from app.services.booking_service import (
+    expire_pending_booking,
+    try_complete_booking,
+    BookingServiceError,
+)
+from app.services.overdue_service import process_overdue_bookings_bulk
+from app.services.scheduled_actions_service import (
+    ACTION_EXPIRE_PENDING,
+    ACTION_OVERDUE_CHECK,
+    ACTION_AUTOCOMPLETE_CHECK,
+    pop_due_actions,
+    retry_action,
+    schedule_overdue_check,
+    schedule_autocomplete_check,
+)
+from app.utils.time import now_utc
+
+MAX_ATTEMPTS = 10
+OVERDUE_RECHECK = timedelta(minutes=5)        # аренда не закрыта → следующая проверка
+AUTOCOMPLETE_RECHECK = timedelta(minutes=1)   # замок ещё открыт → следующая проверка
+
+
+def _retry(action: str, booking_id: int, attempts: int) -> None:
+    db.session.rollback()
+    if attempts + 1 >= MAX_ATTEMPTS:
+        current_app.logger.error(f"Scheduled {action} for booking {booking_id} dropped")
+        return
+    retry_action(action, booking_id, attempts)
+    db.session.commit()
+
+
+def run_scheduled_actions() -> int:
+    """
+    Periodic job (scheduler, каждые несколько секунд):
+
+    Выполняет только созревшие scheduled_actions — без сканирования bookings.
+    Старые сканирующие задачи остаются редкой страховкой.
+    """
+    popped = pop_due_actions()
+    if not popped:
+        return 0
+
+    by_action: dict[str, list[tuple[int, int]]] = defaultdict(list)
+    for action, booking_id, attempts in popped:
+        by_action[action].append((booking_id, attempts))
+
+    bookings = {
+        b.id: b
+        for b in (
+            Booking.query
+            .options(joinedload(Booking.sunbed))
+            .filter(Booking.id.in_({booking_id for _, booking_id, _ in popped}))
+            .all()
+        )
+    }
+
+    # ---------- pending → cancelled ----------
+    for booking_id, attempts in by_action[ACTION_EXPIRE_PENDING]:
+        booking = bookings.get(booking_id)
+        if not booking:
+            continue
+        try:
+            if expire_pending_booking(booking):
+                db.session.commit()
+        except Exception:
+            current_app.logger.exception(f"Pending expiry failed for booking {booking_id}")
+            _retry(ACTION_EXPIRE_PENDING, booking_id, attempts)
+
+    # ---------- overdue ----------
+    overdue = [
+        (bookings[booking_id], attempts)
+        for booking_id, attempts in by_action[ACTION_OVERDUE_CHECK]
+        if booking_id in bookings
+        and bookings[booking_id].status == "confirmed"
+        and not bookings[booking_id].lock_closed_confirmed
+    ]
+    if overdue:
+        try:
+            # статусы замков — пачкой
+            process_overdue_bookings_bulk([booking for booking, _ in overdue])
+        except Exception:
+            current_app.logger.exception("Scheduled overdue processing failed")
+            for booking, attempts in overdue:
+                _retry(ACTION_OVERDUE_CHECK, booking.id, attempts)
+        else:
+            recheck_at = now_utc() + OVERDUE_RECHECK
+            for booking, _ in overdue:
+                if booking.status == "confirmed" and not booking.lock_closed_confirmed:
+                    schedule_overdue_check(booking, at=recheck_at)
+            db.session.commit()
+
+    # ---------- auto complete ----------
+    for booking_id, attempts in by_action[ACTION_AUTOCOMPLETE_CHECK]:
+        booking = bookings.get(booking_id)
+        if not booking or booking.status != "confirmed" or not booking.user_requested_close:
+            continue
+        try:
+            if try_complete_booking(booking, require_user_request=True):
+                db.session.commit()
+            else:
+                schedule_autocomplete_check(booking, delay=AUTOCOMPLETE_RECHECK)
+                db.session.commit()
+        except BookingServiceError:
+            _retry(ACTION_AUTOCOMPLETE_CHECK, booking_id, attempts)
+        except Exception:
+            current_app.logger.exception(f"Scheduled autocomplete failed for booking {booking_id}")
+            _retry(ACTION_AUTOCOMPLETE_CHECK, booking_id, attempts)
+
+    return len(popped)
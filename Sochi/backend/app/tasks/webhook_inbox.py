@@ -0,0 +1,13 @@
+from app.services.payment_webhook_service import drain_payment_events, INBOX_BATCH_SIZE
+
+
+def drain_webhook_inbox():
+    """
+    Periodic job (scheduler):
+
+    Обрабатывает накопившиеся webhook'и YooKassa (payment_events),
+    пока inbox не опустеет или не пройдёт несколько пачек.
+    """
+    for _ in range(10):
+        if drain_payment_events() < INBOX_BATCH_SIZE:
+            return
@@ -0,0 +1,274 @@
+"""
+Rate limit + circuit breaker (Redis Lua, in-process fallback).
+
+Каждая проверка — ОДИН round trip в Redis: логика атомарно
+выполняется Lua-скриптом (EVALSHA), гонок INCR → EXPIRE нет,
+ключи всегда получают TTL.
+
+Redis опционален: нет клиента или он упал → те же алгоритмы
+в памяти процесса (лимиты становятся per-process, но не отключаются).
+
+Используется:
+- TTLockService / YooKassaService (исходящие вызовы + breaker)
+- /bookings/<id>/pay, /bookings/batch/pay
+- /auth/login
+"""
+import threading
+import time
+import uuid
+from collections import deque
+
+import app.extensions as ext
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+# ───────────────────────────────
+# LUA SCRIPTS
+# ───────────────────────────────
+
+# KEYS[1] — zset; ARGV: now_ms, window_ms, limit, member
+_SLIDING_WINDOW_LUA = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], window)
+return 1
+"""
+
+# KEYS[1] — hash {tokens, ts}; ARGV: now_ms, rate_per_ms, capacity, cost
+_TOKEN_BUCKET_LUA = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate) + 1000)
+return allowed
+"""
+
+# KEYS[1] — hash {state, failures, opened_at}
+# ARGV: op (allow|success|failure), now_ms, threshold, recovery_ms
+# state: closed → open (threshold ошибок) → half_open (одна проба) → closed / open
+_CIRCUIT_LUA = """
+local op = ARGV[1]
+local now = tonumber(ARGV[2])
+local threshold = tonumber(ARGV[3])
+local recovery = tonumber(ARGV[4])
+
+local data = redis.call('HMGET', KEYS[1], 'state', 'failures', 'opened_at')
+local state = data[1] or 'closed'
+local failures = tonumber(data[2]) or 0
+local opened_at = tonumber(data[3]) or 0
+
+if op == 'allow' then
+    if state == 'closed' then
+        return 1
+    end
+    if state == 'open' and now - opened_at >= recovery then
+        redis.call('HSET', KEYS[1], 'state', 'half_open', 'opened_at', now)
+        redis.call('PEXPIRE', KEYS[1], recovery * 10)
+        return 1
+    end
+    if state == 'half_open' and now - opened_at >= recovery then
+        -- проба зависла: даём ещё одну
+        redis.call('HSET', KEYS[1], 'opened_at', now)
+        return 1
+    end
+    return 0
+end
+
+if op == 'success' then
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+
+-- failure
+failures = failures + 1
+if state == 'half_open' or failures >= threshold then
+    redis.call('HSET', KEYS[1], 'state', 'open', 'failures', failures, 'opened_at', now)
+else
+    redis.call('HSET', KEYS[1], 'state', 'closed', 'failures', failures)
+end
+redis.call('PEXPIRE', KEYS[1], recovery * 10)
+return 1
+"""
+
+_scripts: dict[str, object] = {}
+_scripts_client = None
+_scripts_lock = threading.Lock()
+
+
+def _script(name: str, source: str):
+    """register_script кэшируется на клиента: EVALSHA, EVAL только при NOSCRIPT."""
+    global _scripts_client
+
+    client = ext.redis_client
+    if client is None:
+        return None
+
+    with _scripts_lock:
+        if _scripts_client is not client:
+            _scripts.clear()
+            _scripts_client = client
+        script = _scripts.get(name)
+        if script is None:
+            script = client.register_script(source)
+            _scripts[name] = script
+        return script
+
+
+# ───────────────────────────────
+# IN-PROCESS FALLBACK
+# ───────────────────────────────
+
+_local_lock = threading.Lock()
+_local_windows: dict[str, deque] = {}
+_local_buckets: dict[str, tuple[float, int]] = {}
+_local_circuits: dict[str, dict] = {}
+
+
+def _local_sliding_window(key: str, limit: int, window_ms: int, now: int) -> bool:
+    with _local_lock:
+        hits = _local_windows.setdefault(key, deque())
+        while hits and hits[0] <= now - window_ms:
+            hits.popleft()
+        if len(hits) >= limit:
+            return False
+        hits.append(now)
+        return True
+
+
+def _local_token_bucket(key: str, rate_per_ms: float, capacity: int, cost: int, now: int) -> bool:
+    with _local_lock:
+        tokens, ts = _local_buckets.get(key, (float(capacity), now))
+        tokens = min(capacity, tokens + max(0, now - ts) * rate_per_ms)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        _local_buckets[key] = (tokens, now)
+        return allowed
+
+
+# ───────────────────────────────
+# PUBLIC API
+# ───────────────────────────────
+
+def allow_sliding_window(key: str, limit: int, window_seconds: float) -> bool:
+    """
+    Не больше limit событий за скользящее окно window_seconds.
+    True = разрешено (и событие засчитано).
+    """
+    now = _now_ms()
+    window_ms = int(window_seconds * 1000)
+
+    script = _script("sliding_window", _SLIDING_WINDOW_LUA)
+    if script is not None:
+        try:
+            member = f"{now}:{uuid.uuid4().hex}"
+            return bool(script(keys=[key], args=[now, window_ms, limit, member]))
+        except Exception:
+            pass  # Redis недоступен → локальный лимит
+
+    return _local_sliding_window(key, limit, window_ms, now)
+
+
+def allow_token_bucket(key: str, rate_per_second: float, capacity: int, cost: int = 1) -> bool:
+    """
+    Token bucket: устойчивая скорость rate_per_second, всплеск до capacity.
+    True = разрешено (токены списаны).
+    """
+    now = _now_ms()
+    rate_per_ms = rate_per_second / 1000
+
+    script = _script("token_bucket", _TOKEN_BUCKET_LUA)
+    if script is not None:
+        try:
+            return bool(script(keys=[key], args=[now, rate_per_ms, capacity, cost]))
+        except Exception:
+            pass  # Redis недоступен → локальный bucket
+
+    return _local_token_bucket(key, rate_per_ms, capacity, cost, now)
+
+
+class CircuitBreaker:
+    """
+    closed → open после failure_threshold ошибок подряд;
+    через recovery_seconds → half_open: пропускаем одну пробу;
+    проба успешна → closed, ошибка → снова open.
+
+    allow() / record_success() / record_failure() — по одному round trip.
+    """
+
+    def __init__(self, name: str, *, failure_threshold: int = 5, recovery_seconds: float = 60):
+        self.key = f"circuit:{name}"
+        self.failure_threshold = failure_threshold
+        self.recovery_ms = int(recovery_seconds * 1000)
+
+    def _call(self, op: str):
+        now = _now_ms()
+        script = _script("circuit", _CIRCUIT_LUA)
+        if script is not None:
+            try:
+                return script(
+                    keys=[self.key],
+                    args=[op, now, self.failure_threshold, self.recovery_ms],
+                )
+            except Exception:
+                pass  # Redis недоступен → локальное состояние
+
+        return self._local(op, now)
+
+    def _local(self, op: str, now: int) -> int:
+        with _local_lock:
+            st = _local_circuits.setdefault(
+                self.key, {"state": "closed", "failures": 0, "opened_at": 0}
+            )
+
+            if op == "allow":
+                if st["state"] == "closed":
+                    return 1
+                if now - st["opened_at"] >= self.recovery_ms:
+                    st["state"] = "half_open"
+                    st["opened_at"] = now
+                    return 1
+                return 0
+
+            if op == "success":
+                _local_circuits.pop(self.key, None)
+                return 1
+
+            st["failures"] += 1
+            if st["state"] == "half_open" or st["failures"] >= self.failure_threshold:
+                st["state"] = "open"
+                st["opened_at"] = now
+            return 1
+
+    def allow(self) -> bool:
+        return bool(self._call("allow"))
+
+    def record_success(self) -> None:
+        self._call("success")
+
+    def record_failure(self) -> None:
+        self._call("failure")
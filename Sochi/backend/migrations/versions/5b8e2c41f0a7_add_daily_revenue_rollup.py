@@ -0,0 +1,45 @@
+"""add daily_revenue rollup
+
+Revision ID: 5b8e2c41f0a7
+Revises: c3f1a7d2e9b4
+Create Date: 2026-10-17 12:40:05.774102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e2c41f0a7'
+down_revision = 'c3f1a7d2e9b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'daily_revenue',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.Column('beach_id', sa.Integer(), nullable=False),
+        sa.Column('msk_date', sa.Date(), nullable=False),
+        sa.Column('bookings_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('gross', sa.Numeric(precision=12, scale=2), nullable=False, server_default='0'),
+        sa.Column('refunds', sa.Numeric(precision=12, scale=2), nullable=False, server_default='0'),
+        sa.Column('overdue_income', sa.Numeric(precision=12, scale=2), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id']),
+        sa.ForeignKeyConstraint(['beach_id'], ['beaches.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('owner_id', 'beach_id', 'msk_date', name='uq_daily_revenue_owner_beach_date'),
+    )
+    op.create_index('ix_daily_revenue_owner_id', 'daily_revenue', ['owner_id'], unique=False)
+    op.create_index('idx_daily_revenue_date', 'daily_revenue', ['msk_date'], unique=False)
+
+    # заполняется в 9e4b2d7c1a58 — после появления архива и bookings.refunded_at
+
+
+def downgrade():
+    op.drop_index('idx_daily_revenue_date', table_name='daily_revenue')
+    op.drop_index('ix_daily_revenue_owner_id', table_name='daily_revenue')
+    op.drop_table('daily_revenue')
@@ -0,0 +1,120 @@
+"""bookings.refunded_at + daily_revenue rebuild
+
+Revision ID: 9e4b2d7c1a58
+Revises: f4d19a6c2b57
+Create Date: 2026-10-18 11:05:37.240619
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b2d7c1a58'
+down_revision = 'f4d19a6c2b57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('bookings', sa.Column('refunded_at', sa.DateTime(timezone=True), nullable=True))
+    # партиционированная таблица: колонка уходит во все партиции
+    op.add_column('bookings_archive', sa.Column('refunded_at', sa.DateTime(timezone=True), nullable=True))
+
+    # для уже возвращённых точнее updated_at ничего нет
+    for table in ('bookings', 'bookings_archive'):
+        op.execute(
+            f"""
+            UPDATE {table}
+            SET refunded_at = updated_at
+            WHERE payment_status = 'refunded'
+              AND refunded_at IS NULL
+            """
+        )
+
+    # rollup целиком — снимок формулы rebuild-daily-revenue на эту ревизию
+    # (gross — только completed + paid, возвраты броней — по refunded_at);
+    # дальнейшие правки сервиса на эту миграцию не влияют
+    op.execute("DELETE FROM daily_revenue")
+    op.execute(
+        """
+        WITH all_bookings AS (
+            SELECT id, sunbed_id, status, payment_status, total_price,
+                   lock_closed_confirmed_at, refunded_at, updated_at
+            FROM bookings
+            UNION ALL
+            SELECT id, sunbed_id, status, payment_status, total_price,
+                   lock_closed_confirmed_at, refunded_at, updated_at
+            FROM bookings_archive
+        ),
+        all_overdue AS (
+            SELECT booking_id, amount, payment_status, paid_at, refunded_at
+            FROM overdue_charges
+            UNION ALL
+            SELECT booking_id, amount, payment_status, paid_at, refunded_at
+            FROM overdue_charges_archive
+        ),
+        facts AS (
+            SELECT b.sunbed_id,
+                   (COALESCE(b.lock_closed_confirmed_at, b.updated_at)
+                        AT TIME ZONE 'Europe/Moscow')::date AS msk_date,
+                   1 AS bookings_count,
+                   b.total_price AS gross,
+                   0 AS refunds,
+                   0 AS overdue_income
+            FROM all_bookings b
+            WHERE b.status = 'completed'
+              AND b.payment_status = 'paid'
+
+            UNION ALL
+
+            SELECT b.sunbed_id,
+                   (b.refunded_at AT TIME ZONE 'Europe/Moscow')::date,
+                   0, 0, b.total_price, 0
+            FROM all_bookings b
+            WHERE b.refunded_at IS NOT NULL
+              AND b.payment_status = 'refunded'
+
+            UNION ALL
+
+            SELECT b.sunbed_id,
+                   (o.paid_at AT TIME ZONE 'Europe/Moscow')::date,
+                   0, 0, 0, o.amount
+            FROM all_overdue o
+            JOIN all_bookings b ON b.id = o.booking_id
+            WHERE o.paid_at IS NOT NULL
+              AND o.payment_status IN ('paid', 'refund_pending', 'refunded')
+
+            UNION ALL
+
+            SELECT b.sunbed_id,
+                   (o.refunded_at AT TIME ZONE 'Europe/Moscow')::date,
+                   0, 0, o.amount, 0
+            FROM all_overdue o
+            JOIN all_bookings b ON b.id = o.booking_id
+            WHERE o.refunded_at IS NOT NULL
+              AND o.payment_status = 'refunded'
+        )
+        INSERT INTO daily_revenue (
+            owner_id, beach_id, msk_date,
+            bookings_count, gross, refunds, overdue_income, updated_at
+        )
+        SELECT be.owner_id,
+               be.id,
+               f.msk_date,
+               SUM(f.bookings_count),
+               SUM(f.gross),
+               SUM(f.refunds),
+               SUM(f.overdue_income),
+               now()
+        FROM facts f
+        JOIN sunbeds s ON s.id = f.sunbed_id
+        JOIN beaches be ON be.id = s.beach_id
+        GROUP BY be.owner_id, be.id, f.msk_date
+        """
+    )
+
+
+def downgrade():
+    op.drop_column('bookings_archive', 'refunded_at')
+    op.drop_column('bookings', 'refunded_at')
@@ -0,0 +1,77 @@
+"""add scheduled_actions delayed queue
+
+Revision ID: a7d3f51c9e26
+Revises: f2b96e3d5a10
+Create Date: 2026-10-17 17:12:40.551920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.config import PENDING_TTL_MINUTES, OVERDUE_REFUND_GRACE_MINUTES
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3f51c9e26'
+down_revision = 'f2b96e3d5a10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'scheduled_actions',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('action', sa.String(length=30), nullable=False),
+        sa.Column('booking_id', sa.Integer(), nullable=False),
+        sa.Column('due_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.text('now()')),
+        sa.CheckConstraint(
+            "action IN ('expire_pending','overdue_check','autocomplete_check')",
+            name='check_scheduled_action',
+        ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('action', 'booking_id', name='uq_scheduled_action_booking'),
+    )
+    op.create_index('idx_scheduled_actions_due', 'scheduled_actions', ['due_at'], unique=False)
+
+    # сроки для уже живых броней (те же формулы, что и в scheduled_actions_service)
+    op.execute(
+        sa.text(
+            """
+            INSERT INTO scheduled_actions (action, booking_id, due_at)
+            SELECT 'expire_pending', id, created_at + make_interval(mins => :ttl)
+            FROM bookings
+            WHERE status = 'pending' AND payment_status = 'pending'
+            ON CONFLICT DO NOTHING
+            """
+        ).bindparams(ttl=PENDING_TTL_MINUTES)
+    )
+    op.execute(
+        sa.text(
+            """
+            INSERT INTO scheduled_actions (action, booking_id, due_at)
+            SELECT 'overdue_check', id, end_time + make_interval(mins => :grace)
+            FROM bookings
+            WHERE status = 'confirmed' AND lock_closed_confirmed IS NOT TRUE
+            ON CONFLICT DO NOTHING
+            """
+        ).bindparams(grace=OVERDUE_REFUND_GRACE_MINUTES)
+    )
+    op.execute(
+        """
+        INSERT INTO scheduled_actions (action, booking_id, due_at)
+        SELECT 'autocomplete_check', id, now()
+        FROM bookings
+        WHERE status = 'confirmed'
+          AND user_requested_close IS TRUE
+          AND lock_closed_confirmed IS NOT TRUE
+        ON CONFLICT DO NOTHING
+        """
+    )
+
+
+def downgrade():
+    op.drop_index('idx_scheduled_actions_due', table_name='scheduled_actions')
+    op.drop_table('scheduled_actions')
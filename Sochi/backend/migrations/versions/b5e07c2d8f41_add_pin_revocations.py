@@ -0,0 +1,51 @@
+"""add pin_revocations outbox
+
+Revision ID: b5e07c2d8f41
+Revises: a7d3f51c9e26
+Create Date: 2026-10-17 18:03:12.204417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e07c2d8f41'
+down_revision = 'a7d3f51c9e26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'pin_revocations',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('lock_id', sa.String(length=100), nullable=False),
+        sa.Column('password_id', sa.String(length=50), nullable=False),
+        sa.Column('booking_id', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.text('now()')),
+        sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.text('now()')),
+        sa.Column('locked_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.CheckConstraint(
+            "status IN ('pending','processing','done','failed')",
+            name='check_pin_revocation_status',
+        ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('lock_id', 'password_id', name='uq_pin_revocation'),
+    )
+    op.create_index(
+        'idx_pin_revocations_queue',
+        'pin_revocations',
+        ['next_attempt_at', 'lock_id'],
+        unique=False,
+        postgresql_where=sa.text("status = 'pending'"),
+    )
+
+
+def downgrade():
+    op.drop_index('idx_pin_revocations_queue', table_name='pin_revocations')
+    op.drop_table('pin_revocations')
@@ -0,0 +1,109 @@
+"""booking period exclusion constraint
+
+Revision ID: c3f1a7d2e9b4
+Revises: 07e129b35220
+Create Date: 2026-10-17 10:12:41.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.config import PENDING_TTL_MINUTES
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1a7d2e9b4'
+down_revision = '07e129b35220'
+branch_labels = None
+depends_on = None
+
+
+# те же брони, что занимают лежак в busy_booking_clause (без TTL — его
+# constraint не видит; просроченные pending снимает release_expired_pending)
+def _blocking(alias: str = "") -> str:
+    p = f"{alias}." if alias else ""
+    return (
+        f"({p}status = 'pending' AND {p}payment_status = 'pending') "
+        f"OR {p}status = 'confirmed'"
+    )
+
+# вывести не больше N конфликтующих пар
+CONFLICTS_REPORT_LIMIT = 50
+
+
+def _assert_no_overlaps(bind):
+    """
+    ADD CONSTRAINT упадёт на пересекающихся бронях без указания строк.
+    Проверяем заранее и называем id — их нужно разрулить вручную.
+    """
+    rows = bind.execute(
+        sa.text(
+            f"""
+            SELECT a.id, b.id, a.sunbed_id
+            FROM bookings a
+            JOIN bookings b
+              ON b.sunbed_id = a.sunbed_id
+             AND b.id > a.id
+             AND tstzrange(b.start_time, b.end_time, '[)')
+                 && tstzrange(a.start_time, a.end_time, '[)')
+            WHERE ({_blocking("a")})
+              AND ({_blocking("b")})
+            ORDER BY a.id, b.id
+            LIMIT :limit
+            """
+        ),
+        {"limit": CONFLICTS_REPORT_LIMIT},
+    ).all()
+
+    if rows:
+        pairs = ", ".join(f"{a}/{b} (sunbed {s})" for a, b, s in rows)
+        raise RuntimeError(
+            "Overlapping bookings block excl_booking_sunbed_period, "
+            f"resolve them first: {pairs}"
+        )
+
+
+def upgrade():
+    # sunbed_id WITH = внутри GiST требует btree_gist
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+
+    # просроченные pending иначе нарушат constraint на существующих данных
+    op.execute(
+        sa.text(
+            """
+            UPDATE bookings
+            SET status = 'cancelled',
+                payment_status = 'failed',
+                updated_at = now()
+            WHERE status = 'pending'
+              AND payment_status = 'pending'
+              AND created_at < now() - make_interval(mins => :ttl)
+            """
+        ).bindparams(ttl=PENDING_TTL_MINUTES)
+    )
+
+    _assert_no_overlaps(op.get_bind())
+
+    op.execute(
+        """
+        ALTER TABLE bookings
+        ADD COLUMN period tstzrange
+        GENERATED ALWAYS AS (tstzrange(start_time, end_time, '[)')) STORED
+        """
+    )
+
+    op.execute(
+        f"""
+        ALTER TABLE bookings
+        ADD CONSTRAINT excl_booking_sunbed_period
+        EXCLUDE USING gist (sunbed_id WITH =, period WITH &&)
+        WHERE ({_blocking()})
+        """
+    )
+
+
+def downgrade():
+    op.execute(
+        "ALTER TABLE bookings DROP CONSTRAINT IF EXISTS excl_booking_sunbed_period"
+    )
+    op.drop_column("bookings", "period")
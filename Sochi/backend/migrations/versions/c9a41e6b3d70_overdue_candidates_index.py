@@ -0,0 +1,56 @@
+"""partial index for overdue candidates + backfill last_overdue_charge_at
+
+Revision ID: c9a41e6b3d70
+Revises: b5e07c2d8f41
+Create Date: 2026-10-17 18:41:55.913024
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9a41e6b3d70'
+down_revision = 'b5e07c2d8f41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # отметка последнего списания для открытых аренд
+    op.execute(
+        """
+        UPDATE bookings b
+        SET last_overdue_charge_at = oc.last_at
+        FROM (
+            SELECT booking_id, MAX(created_at) AS last_at
+            FROM overdue_charges
+            GROUP BY booking_id
+        ) oc
+        WHERE oc.booking_id = b.id
+          AND b.status = 'confirmed'
+          AND (b.last_overdue_charge_at IS NULL OR b.last_overdue_charge_at < oc.last_at)
+        """
+    )
+
+    # CONCURRENTLY — без блокировки записи в bookings
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'idx_booking_overdue_candidates',
+            'bookings',
+            ['end_time'],
+            unique=False,
+            postgresql_where=sa.text("status = 'confirmed' AND lock_closed_confirmed = false"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'idx_booking_overdue_candidates',
+            table_name='bookings',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,63 @@
+"""add payment_events inbox
+
+Revision ID: d41c7a9e0b85
+Revises: e8a4d9c17b32
+Create Date: 2026-10-17 15:21:47.118604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c7a9e0b85'
+down_revision = 'e8a4d9c17b32'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'payment_events',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('provider', sa.String(length=20), nullable=False, server_default='yookassa'),
+        sa.Column('dedupe_key', sa.String(length=200), nullable=False),
+        sa.Column('event_type', sa.String(length=50), nullable=False),
+        sa.Column('object_id', sa.String(length=100), nullable=False),
+        sa.Column('booking_key', sa.String(length=200), nullable=False),
+        sa.Column('payment_account_id', sa.Integer(), nullable=False),
+        sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('received_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.text('now()')),
+        sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.text('now()')),
+        sa.Column('locked_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.CheckConstraint(
+            "status IN ('pending','processing','done','failed')",
+            name='check_payment_event_status',
+        ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('dedupe_key'),
+    )
+    op.create_index(
+        'idx_payment_events_queue',
+        'payment_events',
+        ['next_attempt_at', 'id'],
+        unique=False,
+        postgresql_where=sa.text("status = 'pending'"),
+    )
+    op.create_index(
+        'idx_payment_events_booking_key',
+        'payment_events',
+        ['booking_key', 'status'],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index('idx_payment_events_booking_key', table_name='payment_events')
+    op.drop_index('idx_payment_events_queue', table_name='payment_events')
+    op.drop_table('payment_events')
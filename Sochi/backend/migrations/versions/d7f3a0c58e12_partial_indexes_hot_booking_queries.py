@@ -0,0 +1,103 @@
+"""partial indexes for hot booking queries, drop duplicate indexes
+
+Revision ID: d7f3a0c58e12
+Revises: c9a41e6b3d70
+Create Date: 2026-10-17 19:20:08.771340
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7f3a0c58e12'
+down_revision = 'c9a41e6b3d70'
+branch_labels = None
+depends_on = None
+
+
+# (name, columns, include, where)
+PARTIAL_INDEXES = [
+    (
+        'idx_booking_confirmed_sunbed',
+        ['sunbed_id', 'end_time'],
+        ['start_time', 'payment_status', 'total_price'],
+        "status = 'confirmed'",
+    ),
+    (
+        'idx_booking_pending_sunbed',
+        ['sunbed_id', 'end_time'],
+        ['start_time', 'created_at'],
+        "status = 'pending' AND payment_status = 'pending'",
+    ),
+    (
+        'idx_booking_pending_created',
+        ['created_at'],
+        [],
+        "status = 'pending' AND payment_status = 'pending'",
+    ),
+    (
+        'idx_booking_close_requested',
+        ['end_time'],
+        [],
+        "status = 'confirmed' AND user_requested_close = true AND lock_closed_confirmed = false",
+    ),
+    (
+        'idx_booking_completed_paid',
+        ['updated_at'],
+        ['total_price'],
+        "status = 'completed' AND payment_status = 'paid'",
+    ),
+]
+
+# дубли индексов, которые уже создаёт index=True / unique=True на колонке
+DUPLICATE_INDEXES = [
+    ('idx_user_phone', 'users', ['phone_number']),          # ix_users_phone_number + unique
+    ('idx_beach_owner', 'beaches', ['owner_id']),           # ix_beaches_owner_id
+    ('idx_sunbed_lock', 'sunbeds', ['lock_identifier']),    # ix_sunbeds_lock_identifier + unique
+]
+
+
+def upgrade():
+    # CONCURRENTLY нельзя внутри транзакции; без блокировки записи
+    with op.get_context().autocommit_block():
+        for name, columns, include, where in PARTIAL_INDEXES:
+            op.create_index(
+                name,
+                'bookings',
+                columns,
+                unique=False,
+                postgresql_include=include,
+                postgresql_where=sa.text(where),
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+        for name, table, _ in DUPLICATE_INDEXES:
+            op.drop_index(
+                name,
+                table_name=table,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in DUPLICATE_INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=False,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+        for name, _, _, _ in reversed(PARTIAL_INDEXES):
+            op.drop_index(
+                name,
+                table_name='bookings',
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
@@ -0,0 +1,124 @@
+"""add partitioned bookings_archive / overdue_charges_archive
+
+Revision ID: e2c85b7a1f93
+Revises: d7f3a0c58e12
+Create Date: 2026-10-17 20:02:37.118650
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2c85b7a1f93'
+down_revision = 'd7f3a0c58e12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'bookings_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('start_time', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('sunbed_id', sa.Integer(), nullable=False),
+        sa.Column('payment_account_id', sa.Integer(), nullable=True),
+        sa.Column('payment_method_id', sa.Integer(), nullable=True),
+        sa.Column('end_time', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('total_price', sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('payment_status', sa.String(length=30), nullable=False),
+        sa.Column('payment_id', sa.String(length=100), nullable=True),
+        sa.Column('payment_provider', sa.String(length=50), nullable=True),
+        sa.Column('user_requested_close', sa.Boolean(), nullable=True),
+        sa.Column('user_requested_close_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('lock_closed_confirmed', sa.Boolean(), nullable=True),
+        sa.Column('lock_closed_confirmed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_overdue_charge_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('overdue_hours', sa.Integer(), nullable=True),
+        sa.Column('reminder_sent', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('archived_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.text('now()')),
+        sa.PrimaryKeyConstraint('id', 'start_time'),
+        postgresql_partition_by='RANGE (start_time)',
+    )
+    op.create_index(
+        'idx_bookings_archive_user',
+        'bookings_archive',
+        ['user_id', 'start_time', 'id'],
+        unique=False,
+    )
+
+    op.create_table(
+        'overdue_charges_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('booking_start_time', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('booking_id', sa.Integer(), nullable=False),
+        sa.Column('hours', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.Column('payment_id', sa.String(length=100), nullable=True),
+        sa.Column('payment_status', sa.String(length=20), nullable=False),
+        sa.Column('refund_id', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('paid_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('refunded_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('archived_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.text('now()')),
+        sa.PrimaryKeyConstraint('id', 'booking_start_time'),
+        postgresql_partition_by='RANGE (booking_start_time)',
+    )
+    op.create_index(
+        'idx_overdue_charges_archive_booking',
+        'overdue_charges_archive',
+        ['booking_id'],
+        unique=False,
+    )
+
+    # DEFAULT — страховка: строка вне месячных партиций не роняет перенос
+    op.execute("CREATE TABLE bookings_archive_default PARTITION OF bookings_archive DEFAULT")
+    op.execute(
+        "CREATE TABLE overdue_charges_archive_default "
+        "PARTITION OF overdue_charges_archive DEFAULT"
+    )
+
+    # месячные партиции (границы — полночь UTC): от самой старой брони
+    # до текущего месяца + 2
+    # (дальше — archive_service.ensure_upcoming_partitions / CLI)
+    op.execute(
+        """
+        DO $$
+        DECLARE
+            m date;
+            last_month date := date_trunc('month', now() + interval '2 months')::date;
+        BEGIN
+            m := COALESCE(
+                (SELECT date_trunc('month', MIN(start_time) AT TIME ZONE 'UTC')::date FROM bookings),
+                date_trunc('month', now() AT TIME ZONE 'UTC')::date
+            );
+            WHILE m <= last_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF bookings_archive '
+                    'FOR VALUES FROM (%L) TO (%L)',
+                    'bookings_archive_p' || to_char(m, 'YYYY_MM'),
+                    m::timestamp AT TIME ZONE 'UTC',
+                    (m + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+                );
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF overdue_charges_archive '
+                    'FOR VALUES FROM (%L) TO (%L)',
+                    'overdue_charges_archive_p' || to_char(m, 'YYYY_MM'),
+                    m::timestamp AT TIME ZONE 'UTC',
+                    (m + interval '1 month')::timestamp AT TIME ZONE 'UTC'
+                );
+                m := (m + interval '1 month')::date;
+            END LOOP;
+        END $$;
+        """
+    )
+
+
+def downgrade():
+    # партиции удаляются вместе с родительскими таблицами
+    op.drop_table('overdue_charges_archive')
+    op.drop_table('bookings_archive')
@@ -0,0 +1,28 @@
+"""add users.perm_version
+
+Revision ID: e8a4d9c17b32
+Revises: 5b8e2c41f0a7
+Create Date: 2026-10-17 14:02:19.402518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8a4d9c17b32'
+down_revision = '5b8e2c41f0a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column('perm_version', sa.Integer(), nullable=False, server_default='0')
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('perm_version')
@@ -0,0 +1,41 @@
+"""payment_events audit columns
+
+Revision ID: f2b96e3d5a10
+Revises: d41c7a9e0b85
+Create Date: 2026-10-17 16:05:12.640331
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b96e3d5a10'
+down_revision = 'd41c7a9e0b85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payment_events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('result', sa.String(length=64), nullable=True))
+        batch_op.add_column(
+            sa.Column('deliveries', sa.Integer(), nullable=False, server_default='1')
+        )
+        batch_op.add_column(
+            sa.Column(
+                'last_delivered_at',
+                sa.DateTime(timezone=True),
+                nullable=False,
+                server_default=sa.text('now()'),
+            )
+        )
+        batch_op.create_index('idx_payment_events_object', ['object_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('payment_events', schema=None) as batch_op:
+        batch_op.drop_index('idx_payment_events_object')
+        batch_op.drop_column('last_delivered_at')
+        batch_op.drop_column('deliveries')
+        batch_op.drop_column('result')
@@ -0,0 +1,39 @@
+"""index for keyset pagination of booking history
+
+Revision ID: f4d19a6c2b57
+Revises: e2c85b7a1f93
+Create Date: 2026-10-17 20:47:21.603115
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4d19a6c2b57'
+down_revision = 'e2c85b7a1f93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'idx_booking_user_history',
+            'bookings',
+            ['user_id', 'start_time', 'id'],
+            unique=False,
+            postgresql_where=sa.text("status IN ('completed', 'cancelled')"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'idx_booking_user_history',
+            table_name='bookings',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
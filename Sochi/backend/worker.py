@@ -0,0 +1,33 @@
+import os
+import signal
+
+# web-процессы (run.py / gunicorn) scheduler не поднимают,
+# задачи выполняет этот процесс. Worker'ов может быть несколько:
+# задачи выполняет только лидер (pg advisory lock), остальные — standby.
+# ❗ до импорта app: Config читает env при импорте
+os.environ["SCHEDULER_IN_WEB"] = "false"
+
+from app import create_app
+from app.scheduler import SchedulerRunner
+
+app = create_app()
+
+runner = SchedulerRunner(app)
+
+
+def _shutdown(signum, frame):
+    runner.stop()
+
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    print("=" * 60)
+    print("⏱  Sunbed Rental scheduler worker")
+    print("=" * 60)
+    print(f"📊 База данных: {app.config['SQLALCHEMY_DATABASE_URI']}")
+    print(f"🔒 Advisory lock: {app.config['SCHEDULER_LOCK_KEY']}")
+    print("=" * 60)
+
+    runner.run_forever()